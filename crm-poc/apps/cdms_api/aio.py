@@ -0,0 +1,141 @@
+import json
+import asyncio
+import logging
+
+import aiohttp
+
+from django.conf import settings
+
+from .base import BaseCDMSApi
+from .exceptions import CDMSException, CDMSUnauthorizedException
+
+logger = logging.getLogger('cmds_api')
+
+
+class AsyncCDMSApi(BaseCDMSApi):
+    """
+    asyncio version of CDMSApi, all the public methods are coroutines.
+
+    Requests go through one aiohttp session with a connection pool of max `limit`
+    connections so that many requests can be in flight at the same time.
+
+    Usage:
+        async with AsyncCDMSApi(username, password) as api:
+            results = await asyncio.gather(
+                api.get('Account', guid1),
+                api.get('Account', guid2)
+            )
+    """
+    def __init__(self, username, password, limit=None):
+        super(AsyncCDMSApi, self).__init__(username, password)
+
+        self.limit = limit or settings.CDMS_ASYNC_POOL_SIZE
+        self.session = None
+        self.generation = 0
+        self._session_lock = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+        return False
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def setup_session(self, force=False, expired_generation=None):
+        """
+        Logs in (in a thread as the login is blocking) and sets the cookies on the aiohttp session.
+
+        If `expired_generation` is given and another coroutine has already reauthenticated
+        since then, nothing happens so that concurrent 401s trigger only one login.
+        """
+        if not self._session_lock:
+            self._session_lock = asyncio.Lock()
+
+        async with self._session_lock:
+            if expired_generation is not None and expired_generation != self.generation:
+                return
+
+            loop = asyncio.get_event_loop()
+            jar = await loop.run_in_executor(None, lambda: self.load_cookies(force=force))
+
+            if not self.session:
+                self.session = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.limit, ssl=False)
+                )
+            self.session.cookie_jar.clear()
+            self.session.cookie_jar.update_cookies(
+                {cookie.name: cookie.value for cookie in jar}
+            )
+            self.generation += 1
+
+    async def make_request(self, verb, url, data={}):
+        """
+        Makes the call to CDMS, if 401 is found, it reauthenticates
+        and tries again making the same call
+        """
+        if not self.session:
+            await self.setup_session(expired_generation=self.generation)
+
+        generation = self.generation
+        try:
+            return await self._make_request(verb, url, data=data)
+        except CDMSUnauthorizedException:
+            logger.debug('Session expired, reauthenticating and trying again')
+            await self.setup_session(force=True, expired_generation=generation)
+        return await self._make_request(verb, url, data=data)
+
+    async def _make_request(self, verb, url, data={}):
+        logger.debug('Calling CDMS url (%s) on %s' % (verb, url))
+        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+
+        if data:
+            data = json.dumps(data)
+
+        async with self.session.request(verb, url, data=data or None, headers=headers) as resp:
+            content = await resp.read()
+
+            if resp.status >= 400:
+                logger.debug('Got CDMS error (%s): %s' % (resp.status, content))
+
+                ExceptionClass = self.EXCEPTIONS_MAP.get(resp.status, CDMSException)
+                raise ExceptionClass(
+                    content,
+                    status_code=resp.status
+                )
+
+            if resp.status in (200, 201):
+                return json.loads(content.decode('utf-8'))['d']
+
+            return resp
+
+    async def list(self, service, top=50, skip=0, select=None, filters=None, order_by=None):
+        url = self._get_list_url(
+            service, top=top, skip=skip, select=select, filters=filters, order_by=order_by
+        )
+
+        results = await self.make_request('get', url)
+        return results['results']
+
+    async def get(self, service, guid, select=None):
+        url = self.get_url(service, guid, select=select)
+        return await self.make_request('get', url)
+
+    async def update(self, service, guid, data):
+        url = self.get_url(service, guid)
+
+        # PUT returns 204 so we need to make an extra GET query to return the latest values
+        await self.make_request('put', url, data=data)
+        return await self.get(service, guid)
+
+    async def create(self, service, data):
+        url = self.get_url(service)
+        return await self.make_request('post', url, data=data)
+
+    async def delete(self, service, guid):
+        url = self.get_url(service, guid)
+        return await self.make_request('delete', url)
@@ -1,15 +1,21 @@
 import json
+import collections
 import requests
 import pickle
 import os
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from django.conf import settings
 from django.utils.text import slugify
 
 from pyquery import PyQuery
 
-from .exceptions import CDMSException, CDMSUnauthorizedException, CDMSNotFoundException
+from .exceptions import CDMSException, CDMSUnauthorizedException, CDMSNotFoundException, \
+    CDMSConflictException
+from .batch import CDMSBatch
+from .sessions import SessionPool
 
 CRM_BASE_URL = settings.CDMS_BASE_URL
 
@@ -20,25 +26,30 @@ COOKIE_FILE = '/tmp/cdms_cookie_{slug}.tmp'.format(
 logger = logging.getLogger('cmds_api')
 
 
-class CDMSApi(object):
+class BaseCDMSApi(object):
+    """
+    Logic shared by the sync and async clients: authentication and urls.
+    """
     CRM_BASE_URL = settings.CDMS_BASE_URL
     CRM_ADFS_URL = settings.CDMS_ADFS_URL
     CRM_REST_BASE_URL = '%s/XRMServices/2011/OrganizationData.svc' % CRM_BASE_URL
 
     EXCEPTIONS_MAP = {
         401: CDMSUnauthorizedException,
-        404: CDMSNotFoundException
+        404: CDMSNotFoundException,
+        412: CDMSConflictException
     }
 
     def __init__(self, username, password):
         self.username = username
         self.password = password
-        self.setup_session()
 
-    def setup_session(self, force=False):
+    def load_cookies(self, force=False):
         """
         So that we don't login every time during dev, we save the cookie
         in a file and load it afterwards.
+
+        Returns the RequestsCookieJar of the logged in session.
         """
         if force and os.path.exists(COOKIE_FILE):
             os.remove(COOKIE_FILE)
@@ -50,12 +61,9 @@ class CDMSApi(object):
 
         with open(COOKIE_FILE, 'rb') as f:
             cookies = pickle.load(f)
-            session = requests.session()
             jar = requests.cookies.RequestsCookieJar()
             jar._cookies = cookies
-            session.cookies = jar
-
-        self.session = session
+        return jar
 
     def login(self):
         session = requests.session()
@@ -108,25 +116,89 @@ class CDMSApi(object):
         )
         return session
 
-    def make_request(self, verb, url, data={}):
+    def _get_list_url(self, service, top=50, skip=0, select=None, filters=None, order_by=None, inlinecount=False):
+        params = {}
+        if filters:
+            params['$filter'] = filters
+
+        if inlinecount:
+            params['$inlinecount'] = 'allpages'
+
+        if select:
+            params['$select'] = ','.join(select)
+
+        if order_by:
+            if isinstance(order_by, str):
+                order_by = [order_by]
+            params['$orderby'] = ','.join(order_by)
+
+        return "{base_url}/{service}Set?$top={top}&$skip={skip}&{params}".format(
+            base_url=self.CRM_REST_BASE_URL,
+            service=service,
+            top=top,
+            skip=skip,
+            params='&'.join([u'%s=%s' % (k, v) for k, v in params.items()])
+        )
+
+    def get_url(self, service, guid=None, select=None):
+        url = "{base_url}/{service}Set".format(
+            base_url=self.CRM_REST_BASE_URL,
+            service=service
+        )
+        if guid:
+            url = "{url}(guid'{guid}')".format(url=url, guid=guid)
+        if select:
+            url = "{url}?$select={select}".format(url=url, select=','.join(select))
+        return url
+
+
+class CDMSApi(BaseCDMSApi):
+    def __init__(self, username, password):
+        super(CDMSApi, self).__init__(username, password)
+
+        self.session_pool = SessionPool(
+            size=settings.CDMS_SESSION_POOL_SIZE,
+            keep_alive=settings.CDMS_SESSION_KEEP_ALIVE
+        )
+        self._session_lock = threading.Lock()
+        self.setup_session()
+
+    def setup_session(self, force=False, expired_generation=None):
+        """
+        Loads the cookies and sets them on all the pooled sessions at once.
+
+        If `expired_generation` is given and another thread has already reauthenticated
+        since then, nothing happens so that concurrent 401s trigger only one login.
+        """
+        with self._session_lock:
+            if expired_generation is not None and expired_generation != self.session_pool.generation:
+                return
+
+            self.session_pool.set_cookies(self.load_cookies(force=force))
+
+    def make_request(self, verb, url, data={}, headers=None):
         """
         Makes the call to CDMS, if 401 is found, it reauthenticates
         and tries again making the same call
         """
+        generation = self.session_pool.generation
         try:
-            return self._make_request(verb, url, data=data)
+            return self._make_request(verb, url, data=data, headers=headers)
         except CDMSUnauthorizedException:
             logger.debug('Session expired, reauthenticating and trying again')
-            self.setup_session(force=True)
-        return self._make_request(verb, url, data=data)
+            self.setup_session(force=True, expired_generation=generation)
+        return self._make_request(verb, url, data=data, headers=headers)
 
-    def _make_request(self, verb, url, data={}):
+    def _make_request(self, verb, url, data={}, headers=None):
         logger.debug('Calling CDMS url (%s) on %s' % (verb, url))
-        headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        _headers = {'Content-type': 'application/json', 'Accept': 'application/json'}
+        _headers.update(headers or {})
+        headers = _headers
 
-        if data:
+        if data and headers['Content-type'] == 'application/json':
             data = json.dumps(data)
-        resp = getattr(self.session, verb)(url, data=data, headers=headers, verify=False)
+        with self.session_pool.borrow() as session:
+            resp = getattr(session, verb)(url, data=data, headers=headers, verify=False)
 
         if resp.status_code >= 400:
             logger.debug('Got CDMS error (%s): %s' % (resp.status_code, resp.content))
@@ -143,59 +215,196 @@ class CDMSApi(object):
         return resp
 
     def list(self, service, top=50, skip=0, select=None, filters=None, order_by=None):
-        params = {}
-        if filters:
-            params['$filter'] = filters
-
-        if select:
-            params['$select'] = ','.join(select)
-
-        if order_by:
-            if isinstance(order_by, str):
-                order_by = [order_by]
-            params['$orderby'] = ','.join(order_by)
-
-        url = "{base_url}/{service}Set?$top={top}&$skip={skip}&{params}".format(
-            base_url=self.CRM_REST_BASE_URL,
-            service=service,
-            top=top,
-            skip=skip,
-            params='&'.join([u'%s=%s' % (k, v) for k, v in params.items()])
+        """
+        Returns one single page of results.
+        Use `iter_list` if you want to get all of them.
+        """
+        url = self._get_list_url(
+            service, top=top, skip=skip, select=select, filters=filters, order_by=order_by
         )
 
         results = self.make_request('get', url)
         return results['results']
 
-    def get(self, service, guid):
-        url = "{base_url}/{service}Set(guid'{guid}')".format(
-            base_url=self.CRM_REST_BASE_URL,
-            service=service,
-            guid=guid
+    def count(self, service, filters=None):
+        """
+        Returns the number of results matching `filters` without fetching any of them.
+        """
+        url = self._get_list_url(service, top=0, filters=filters, inlinecount=True)
+
+        results = self.make_request('get', url)
+        return int(results['__count'])
+
+    def iter_list(self, service, top=50, skip=0, limit=None, select=None, filters=None, order_by=None, prefetch=0):
+        """
+        Generator which yields all the results of the query starting from `skip`,
+        `limit` results at most if given.
+
+        Pages are fetched lazily, one at a time, so that no more than one page is kept in memory.
+        The `__next` link returned by CDMS is followed if present, otherwise $skip gets
+        advanced until a page with less than `top` results is found or `limit` is reached.
+
+        If `prefetch` > 0, the next `prefetch` $skip windows are requested concurrently
+        while the current page is being consumed, see `_iter_list_with_prefetch`.
+        """
+        if limit is not None and limit <= 0:
+            return
+
+        if prefetch:
+            yield from self._iter_list_with_prefetch(
+                service, top=top, skip=skip, limit=limit, prefetch=prefetch,
+                select=select, filters=filters, order_by=order_by
+            )
+            return
+
+        stop = skip + limit if limit is not None else None
+        yield from self._iter_list_from(
+            service, top=top, skip=skip, stop=stop, select=select, filters=filters, order_by=order_by
         )
+
+    def _iter_list_from(self, service, top, skip, stop, select=None, filters=None, order_by=None, url=None):
+        """
+        Sequential part of `iter_list`, yields the results from position `skip` up to `stop`
+        (excluded, all if None) starting from `url` if given (e.g. a `__next` link for that position).
+        """
+        page_top = min(top, stop - skip) if stop is not None else top
+        if url is None:
+            url = self._get_list_url(
+                service, top=page_top, skip=skip, select=select, filters=filters, order_by=order_by
+            )
+
+        while url:
+            page = self.make_request('get', url)
+            results = page['results']
+
+            for result in results:
+                if stop is not None and skip >= stop:
+                    return
+                skip += 1
+                yield result
+
+            next_url = page.get('__next')
+            if stop is not None and skip >= stop:
+                url = None
+            elif next_url:
+                url = next_url
+            elif len(results) < page_top:
+                url = None
+            else:
+                page_top = min(top, stop - skip) if stop is not None else top
+                url = self._get_list_url(
+                    service, top=page_top, skip=skip, select=select, filters=filters, order_by=order_by
+                )
+
+    def _iter_list_with_prefetch(
+        self, service, top, prefetch, skip=0, limit=None, select=None, filters=None, order_by=None
+    ):
+        """
+        Like `iter_list` but keeps `prefetch` upcoming $skip windows in flight on a
+        thread pool of the same size.
+
+        Pages are yielded in $skip order so the $orderby of the query is respected.
+        The first page with less than `top` results (or reaching `limit`) stops
+        the iteration and any outstanding request gets cancelled.
+
+        If CDMS returns a `__next` link, it pages server-side and the $skip windows
+        requested ahead might not match so the outstanding requests get cancelled and
+        the iteration goes on sequentially following the link as `iter_list` does.
+        """
+        stop = skip + limit if limit is not None else None
+
+        def get_page(page_skip, page_top):
+            url = self._get_list_url(
+                service, top=page_top, skip=page_skip, select=select, filters=filters, order_by=order_by
+            )
+            return page_skip, page_top, self.make_request('get', url)
+
+        executor = ThreadPoolExecutor(max_workers=prefetch)
+        pending = collections.deque()
+        try:
+            while True:
+                while len(pending) <= prefetch and (stop is None or skip < stop):
+                    page_top = min(top, stop - skip) if stop is not None else top
+                    pending.append(executor.submit(get_page, skip, page_top))
+                    skip += page_top
+
+                if not pending:
+                    break
+
+                page_skip, page_top, page = pending.popleft().result()
+                results = page['results']
+                for result in results:
+                    yield result
+
+                next_url = page.get('__next')
+                if next_url:
+                    for future in pending:
+                        future.cancel()
+                    pending.clear()
+
+                    position = page_skip + len(results)
+                    if stop is None or position < stop:
+                        yield from self._iter_list_from(
+                            service, top=top, skip=position, stop=stop,
+                            select=select, filters=filters, order_by=order_by, url=next_url
+                        )
+                    break
+
+                if len(results) < page_top:
+                    break
+        finally:
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def get(self, service, guid, select=None):
+        url = self.get_url(service, guid, select=select)
         return self.make_request('get', url)
 
-    def update(self, service, guid, data):
-        url = "{base_url}/{service}Set(guid'{guid}')".format(
-            base_url=self.CRM_REST_BASE_URL,
-            service=service,
-            guid=guid
-        )
+    def update(self, service, guid, data, if_match=None):
+        """
+        If `if_match` (etag) is given, the update only happens if the cdms obj didn't change
+        otherwise CDMSConflictException is raised.
+        """
+        url = self.get_url(service, guid)
+        headers = {'If-Match': if_match} if if_match else None
 
         # PUT returns 204 so we need to make an extra GET query to return the latest values
-        self.make_request('put', url, data=data)
+        self.make_request('put', url, data=data, headers=headers)
         return self.get(service, guid)
 
+    def partial_update(self, service, guid, data, if_match=None):
+        """
+        Updates only the attributes in `data` (MERGE) and returns the new ModifiedOn in the
+        same round trip by sending the MERGE and a GET of ModifiedOn in one $batch request.
+
+        `if_match` as in `update`.
+        """
+        with self.batch() as batch:
+            operation = batch.update(
+                service, guid, data, merge=True, select=['ModifiedOn'], if_match=if_match
+            )
+        return operation.result()
+
     def create(self, service, data):
-        url = "{base_url}/{service}Set".format(
-            base_url=self.CRM_REST_BASE_URL,
-            service=service
-        )
+        url = self.get_url(service)
         return self.make_request('post', url, data=data)
 
     def delete(self, service, guid):
-        url = "{base_url}/{service}Set(guid'{guid}')".format(
-            base_url=self.CRM_REST_BASE_URL,
-            service=service,
-            guid=guid
-        )
+        url = self.get_url(service, guid)
         return self.make_request('delete', url)
+
+    def batch(self):
+        """
+        Returns a CDMSBatch which collects operations and sends them to CDMS
+        in one single $batch request, see `cdms_api.batch`.
+
+        Usage:
+            with api.batch() as batch:
+                op1 = batch.get('Account', guid)
+                op2 = batch.create('Account', data)
+
+            op1.result()
+            op2.result()
+        """
+        return CDMSBatch(self)
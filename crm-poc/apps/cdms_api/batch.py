@@ -0,0 +1,224 @@
+import json
+import uuid
+import logging
+
+from email.parser import BytesParser
+
+from .exceptions import CDMSException
+
+logger = logging.getLogger('cmds_api')
+
+
+class BatchOperation(object):
+    """
+    Single operation of a CDMSBatch.
+
+    Its result is only available after the batch has been executed.
+    `result()` returns the value the equivalent CDMSApi method would have returned
+    or raises the exception it would have raised.
+    """
+    def __init__(self, verb, url, data=None, depends_on=None, headers=None):
+        self.verb = verb
+        self.url = url
+        self.data = data
+        self.depends_on = depends_on
+        self.headers = headers or {}
+
+        self.done = False
+        self._result = None
+        self._exception = None
+
+    def set_result(self, result):
+        self._result = result
+        self.done = True
+
+    def set_exception(self, exception):
+        self._exception = exception
+        self.done = True
+
+    def result(self):
+        if not self.done:
+            raise CDMSException('Batch not executed yet')
+
+        if self.depends_on:
+            self.depends_on.result()
+
+        if self._exception:
+            raise self._exception
+        return self._result
+
+    def as_http_request(self):
+        lines = [
+            '{verb} {url} HTTP/1.1'.format(verb=self.verb.upper(), url=self.url),
+            'Accept: application/json',
+        ]
+        lines.extend(
+            '{0}: {1}'.format(name, value) for name, value in sorted(self.headers.items())
+        )
+        body = ''
+        if self.data is not None:
+            lines.append('Content-Type: application/json')
+            body = json.dumps(self.data)
+        return '\r\n'.join(lines) + '\r\n\r\n' + body
+
+
+class CDMSBatch(object):
+    """
+    Collects get/create/update/delete operations and sends them to CDMS in one
+    single multipart $batch request.
+
+    Writes are sent in their own change set each so that every operation gets its own
+    result or exception (mapped through CDMSApi.EXCEPTIONS_MAP).
+    As with CDMSApi.update, updates are followed by a GET of the record within the same batch
+    so that the latest values are returned.
+
+    Can be used as context manager, in which case the batch is executed on exit.
+    """
+    def __init__(self, api):
+        self.api = api
+        self.parts = []  # each part is a BatchOperation (read) or a list of BatchOperation (change set)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if not exc_type:
+            self.execute()
+        return False
+
+    def _add_read(self, verb, url, **kwargs):
+        operation = BatchOperation(verb, url, **kwargs)
+        self.parts.append(operation)
+        return operation
+
+    def _add_write(self, verb, url, data=None, headers=None):
+        operation = BatchOperation(verb, url, data=data, headers=headers)
+        self.parts.append([operation])
+        return operation
+
+    def get(self, service, guid, select=None):
+        return self._add_read('get', self.api.get_url(service, guid, select=select))
+
+    def create(self, service, data):
+        return self._add_write('post', self.api.get_url(service), data=data)
+
+    def update(self, service, guid, data, merge=False, select=None, if_match=None):
+        """
+        PUT (or MERGE if `merge` == True) followed by a GET of the `select` fields (all if None).
+        With `if_match` (etag), the write fails with CDMSConflictException if the cdms obj changed.
+        """
+        write_operation = self._add_write(
+            'merge' if merge else 'put', self.api.get_url(service, guid), data=data,
+            headers={'If-Match': if_match} if if_match else None
+        )
+        read_operation = self.get(service, guid, select=select)
+        read_operation.depends_on = write_operation
+        return read_operation
+
+    def delete(self, service, guid):
+        return self._add_write('delete', self.api.get_url(service, guid))
+
+    def get_body(self, boundary):
+        parts = []
+        for part in self.parts:
+            if isinstance(part, list):
+                changeset_boundary = 'changeset_{0}'.format(uuid.uuid4().hex)
+                changeset = []
+                for operation in part:
+                    changeset.append(
+                        '--{boundary}\r\n'
+                        'Content-Type: application/http\r\n'
+                        'Content-Transfer-Encoding: binary\r\n\r\n'
+                        '{request}\r\n'.format(
+                            boundary=changeset_boundary,
+                            request=operation.as_http_request()
+                        )
+                    )
+                changeset.append('--{boundary}--\r\n'.format(boundary=changeset_boundary))
+                parts.append(
+                    '--{boundary}\r\n'
+                    'Content-Type: multipart/mixed; boundary={changeset_boundary}\r\n\r\n'
+                    '{changeset}'.format(
+                        boundary=boundary,
+                        changeset_boundary=changeset_boundary,
+                        changeset=''.join(changeset)
+                    )
+                )
+            else:
+                parts.append(
+                    '--{boundary}\r\n'
+                    'Content-Type: application/http\r\n'
+                    'Content-Transfer-Encoding: binary\r\n\r\n'
+                    '{request}\r\n'.format(
+                        boundary=boundary,
+                        request=part.as_http_request()
+                    )
+                )
+        parts.append('--{boundary}--\r\n'.format(boundary=boundary))
+        return ''.join(parts)
+
+    def parse_http_response(self, text):
+        """
+        Returns (status_code, result or exception) from the raw http response `text`.
+        """
+        text = text.replace('\r\n', '\n')
+        head, _, body = text.partition('\n\n')
+        status_code = int(head.split('\n')[0].split()[1])
+
+        if status_code >= 400:
+            logger.debug('Got CDMS error (%s) in batch: %s' % (status_code, body))
+
+            ExceptionClass = self.api.EXCEPTIONS_MAP.get(status_code, CDMSException)
+            return status_code, ExceptionClass(body, status_code=status_code)
+
+        if status_code in (200, 201):
+            return status_code, json.loads(body)['d']
+        return status_code, None
+
+    def set_operation_response(self, operation, text):
+        status_code, result = self.parse_http_response(text)
+        if status_code >= 400:
+            operation.set_exception(result)
+        else:
+            operation.set_result(result)
+
+    def get_part_text(self, message):
+        # the raw payload would keep non-ascii chars as surrogate escapes
+        return message.get_payload(decode=True).decode('utf-8')
+
+    def get_subparts(self, message, expected):
+        subparts = message.get_payload()
+        if len(subparts) != expected:
+            raise CDMSException(
+                'Got {0} responses in batch instead of {1}'.format(len(subparts), expected)
+            )
+        return subparts
+
+    def parse_response(self, resp):
+        message = BytesParser().parsebytes(
+            'Content-Type: {0}\r\n\r\n'.format(resp.headers['Content-Type']).encode('utf-8') + resp.content
+        )
+
+        for part, response_part in zip(self.parts, self.get_subparts(message, len(self.parts))):
+            if not isinstance(part, list):
+                self.set_operation_response(part, self.get_part_text(response_part))
+            elif response_part.is_multipart():
+                for operation, operation_response in zip(part, self.get_subparts(response_part, len(part))):
+                    self.set_operation_response(operation, self.get_part_text(operation_response))
+            else:
+                # failed change sets return one single error response
+                for operation in part:
+                    self.set_operation_response(operation, self.get_part_text(response_part))
+
+    def execute(self):
+        if not self.parts:
+            return
+
+        boundary = 'batch_{0}'.format(uuid.uuid4().hex)
+        resp = self.api.make_request(
+            'post',
+            '{base_url}/$batch'.format(base_url=self.api.CRM_REST_BASE_URL),
+            data=self.get_body(boundary),
+            headers={'Content-type': 'multipart/mixed; boundary={0}'.format(boundary)}
+        )
+        self.parse_response(resp)
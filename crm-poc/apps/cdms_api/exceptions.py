@@ -11,3 +11,13 @@ class CDMSNotFoundException(CDMSException):
 
 class CDMSUnauthorizedException(CDMSException):
     pass
+
+
+class CDMSConflictException(CDMSException):
+    """
+    Raised when a conditional write (If-Match) fails because the cdms obj changed in the meantime.
+    `conflicting_fields` can be filled with the output of BaseCDMSMigrator.get_conflicting_fields.
+    """
+    def __init__(self, message, status_code=None, conflicting_fields=None):
+        super(CDMSConflictException, self).__init__(message, status_code=status_code)
+        self.conflicting_fields = conflicting_fields
@@ -0,0 +1,76 @@
+import queue
+import threading
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool(object):
+    """
+    Thread-safe pool of requests sessions sharing the same cookies.
+
+    Each thread borrows a session for the duration of a request so that concurrent
+    calls don't race on one connection. Sessions are created lazily up to `size` and
+    keep their connections alive (if `keep_alive`) so that TCP/TLS connections get reused.
+
+    `generation` gets incremented every time the cookies are replaced and can be used
+    to find out if somebody else reauthenticated in the meantime.
+    """
+    def __init__(self, size=10, keep_alive=True):
+        self.size = size
+        self.keep_alive = keep_alive
+
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._sessions = []
+        self._available = queue.LifoQueue()  # LIFO so that warm connections get reused first
+
+    def create_session(self):
+        session = requests.session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        session.cookies = self.cookies
+        return session
+
+    def get_session(self):
+        try:
+            return self._available.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if len(self._sessions) < self.size:
+                session = self.create_session()
+                self._sessions.append(session)
+                return session
+
+        # pool exhausted, wait for a session to be returned
+        return self._available.get()
+
+    def put_session(self, session):
+        self._available.put(session)
+
+    @contextmanager
+    def borrow(self):
+        session = self.get_session()
+        try:
+            yield session
+        finally:
+            self.put_session(session)
+
+    def set_cookies(self, cookies):
+        """
+        Replaces the cookies of all the sessions, including the ones currently borrowed.
+        """
+        with self._lock:
+            self.cookies = cookies
+            for session in self._sessions:
+                session.cookies = cookies
+            self.generation += 1
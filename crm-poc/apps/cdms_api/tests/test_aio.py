@@ -0,0 +1,181 @@
+import json
+import asyncio
+import threading
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from unittest import mock
+
+from django.test.testcases import SimpleTestCase
+
+from requests.cookies import RequestsCookieJar
+
+from cdms_api.aio import AsyncCDMSApi
+from cdms_api.exceptions import CDMSNotFoundException
+
+
+class StandInCDMSServer(ThreadingMixIn, HTTPServer):
+    """
+    Local http server standing in for CDMS.
+
+    `responses` maps (verb, path) to (status_code, data) and every request
+    is recorded in `requests` as (verb, path, headers, body).
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        super(StandInCDMSServer, self).__init__(('localhost', 0), StandInCDMSHandler)
+        self.responses = {}
+        self.requests = []
+        self.unauthorized_once = False
+
+    @property
+    def base_url(self):
+        return 'http://localhost:{0}/XRMServices/2011/OrganizationData.svc'.format(self.server_port)
+
+
+class StandInCDMSHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def handle_verb(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        self.server.requests.append((self.command, self.path, self.headers, body))
+
+        if self.server.unauthorized_once:
+            self.server.unauthorized_once = False
+            status_code, data = 401, None
+        else:
+            status_code, data = self.server.responses.get((self.command, self.path), (404, None))
+
+        content = json.dumps({'d': data}).encode('utf-8') if data is not None else b''
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = handle_verb
+
+
+class AsyncCDMSApiTestCase(SimpleTestCase):
+    def setUp(self):
+        super(AsyncCDMSApiTestCase, self).setUp()
+        self.server = StandInCDMSServer()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.api = AsyncCDMSApi('username', 'password', limit=5)
+        self.api.CRM_REST_BASE_URL = self.server.base_url
+
+        jar = RequestsCookieJar()
+        jar.set('auth', 'token')
+        self.load_cookies_patcher = mock.patch.object(AsyncCDMSApi, 'load_cookies', return_value=jar)
+        self.mocked_load_cookies = self.load_cookies_patcher.start()
+
+    def tearDown(self):
+        self.load_cookies_patcher.stop()
+        self.loop.run_until_complete(self.api.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        self.server.shutdown()
+        self.server.server_close()
+        super(AsyncCDMSApiTestCase, self).tearDown()
+
+    def run_coroutine(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def get_path(self, url):
+        return url[len('http://localhost:{0}'.format(self.server.server_port)):]
+
+    def test_get(self):
+        path = self.get_path(self.api.get_url('Account', 'cdms-pk'))
+        self.server.responses[('GET', path)] = (200, {'Name': 'name'})
+
+        self.assertEqual(
+            self.run_coroutine(self.api.get('Account', 'cdms-pk')),
+            {'Name': 'name'}
+        )
+        _, _, headers, _ = self.server.requests[0]
+        self.assertEqual(headers['Cookie'], 'auth=token')
+
+    def test_list(self):
+        self.server.responses[('GET', self.get_path(self.api.get_url('Account')) + '?$top=50&$skip=0&')] = (
+            200, {'results': [{'Name': 'name'}]}
+        )
+
+        self.assertEqual(
+            self.run_coroutine(self.api.list('Account')),
+            [{'Name': 'name'}]
+        )
+
+    def test_create(self):
+        path = self.get_path(self.api.get_url('Account'))
+        self.server.responses[('POST', path)] = (201, {'AccountId': 'new-pk'})
+
+        self.assertEqual(
+            self.run_coroutine(self.api.create('Account', {'Name': 'name'})),
+            {'AccountId': 'new-pk'}
+        )
+        _, _, _, body = self.server.requests[0]
+        self.assertEqual(json.loads(body), {'Name': 'name'})
+
+    def test_update(self):
+        """
+        As with CDMSApi, update makes a PUT followed by a GET.
+        """
+        path = self.get_path(self.api.get_url('Account', 'cdms-pk'))
+        self.server.responses[('PUT', path)] = (204, None)
+        self.server.responses[('GET', path)] = (200, {'Name': 'new name'})
+
+        self.assertEqual(
+            self.run_coroutine(self.api.update('Account', 'cdms-pk', {'Name': 'new name'})),
+            {'Name': 'new name'}
+        )
+        self.assertEqual(
+            [request[0] for request in self.server.requests], ['PUT', 'GET']
+        )
+
+    def test_delete(self):
+        path = self.get_path(self.api.get_url('Account', 'cdms-pk'))
+        self.server.responses[('DELETE', path)] = (204, None)
+
+        resp = self.run_coroutine(self.api.delete('Account', 'cdms-pk'))
+        self.assertEqual(resp.status, 204)
+
+    def test_exception(self):
+        self.assertRaises(
+            CDMSNotFoundException,
+            self.run_coroutine, self.api.get('Account', 'invalid')
+        )
+
+    def test_reauthenticates_on_401(self):
+        path = self.get_path(self.api.get_url('Account', 'cdms-pk'))
+        self.server.responses[('GET', path)] = (200, {'Name': 'name'})
+        self.server.unauthorized_once = True
+
+        self.assertEqual(
+            self.run_coroutine(self.api.get('Account', 'cdms-pk')),
+            {'Name': 'name'}
+        )
+        self.assertEqual(len(self.server.requests), 2)
+        self.mocked_load_cookies.assert_called_with(force=True)
+
+    def test_concurrent_requests(self):
+        for index in range(20):
+            path = self.get_path(self.api.get_url('Account', 'cdms-pk{0}'.format(index)))
+            self.server.responses[('GET', path)] = (200, {'Name': 'name{0}'.format(index)})
+
+        results = self.run_coroutine(
+            asyncio.gather(*[
+                self.api.get('Account', 'cdms-pk{0}'.format(index)) for index in range(20)
+            ])
+        )
+        self.assertEqual(
+            [result['Name'] for result in results],
+            ['name{0}'.format(index) for index in range(20)]
+        )
+        self.assertEqual(self.mocked_load_cookies.call_count, 1)
@@ -0,0 +1,226 @@
+import re
+import time
+
+from unittest import mock
+
+from django.test.testcases import TestCase
+
+from cdms_api.base import CDMSApi
+from cdms_api.exceptions import CDMSUnauthorizedException
+
+
+class BaseCDMSApiTestCase(TestCase):
+    def setUp(self):
+        super(BaseCDMSApiTestCase, self).setUp()
+        with mock.patch.object(CDMSApi, 'setup_session'):
+            self.api = CDMSApi('username', 'password')
+        self.api.make_request = mock.MagicMock()
+
+    def get_called_urls(self):
+        return [_args[1] for _args, _ in self.api.make_request.call_args_list]
+
+
+class MakeRequestTestCase(TestCase):
+    def setUp(self):
+        super(MakeRequestTestCase, self).setUp()
+        with mock.patch.object(CDMSApi, 'setup_session'):
+            self.api = CDMSApi('username', 'password')
+        self.api._make_request = mock.MagicMock()
+
+    def test_reauthenticates_on_401(self):
+        self.api._make_request.side_effect = [CDMSUnauthorizedException('expired'), {'Name': 'name'}]
+
+        with mock.patch.object(CDMSApi, 'setup_session') as mocked_setup_session:
+            self.assertEqual(self.api.make_request('get', 'url'), {'Name': 'name'})
+
+        mocked_setup_session.assert_called_once_with(force=True, expired_generation=0)
+
+    def test_setup_session_skipped_if_already_reauthenticated(self):
+        """
+        If another thread reauthenticated after the failing request started, no new login happens.
+        """
+        with mock.patch.object(CDMSApi, 'login') as mocked_login:
+            self.api.session_pool.generation = 1
+            self.api.setup_session(force=True, expired_generation=0)
+
+        self.assertEqual(mocked_login.call_count, 0)
+
+
+class CountTestCase(BaseCDMSApiTestCase):
+    def test(self):
+        """
+        count uses $inlinecount without getting any result.
+        """
+        self.api.make_request.return_value = {'results': [], '__count': '123'}
+
+        self.assertEqual(self.api.count('Service', filters="Name eq 'name'"), 123)
+
+        url = self.get_called_urls()[0]
+        self.assertTrue('$top=0' in url)
+        self.assertTrue('$inlinecount=allpages' in url)
+        self.assertTrue("$filter=Name eq 'name'" in url)
+
+
+class IterListTestCase(BaseCDMSApiTestCase):
+    def test_single_page(self):
+        """
+        If the first page has less than `top` results, no other requests are made.
+        """
+        self.api.make_request.return_value = {'results': [{'id': 1}, {'id': 2}]}
+
+        results = list(self.api.iter_list('Service', top=3))
+        self.assertEqual(results, [{'id': 1}, {'id': 2}])
+
+        urls = self.get_called_urls()
+        self.assertEqual(len(urls), 1)
+        self.assertTrue('$top=3&$skip=0' in urls[0])
+
+    def test_advances_skip(self):
+        """
+        If no __next link is returned, $skip gets advanced until a partial page is found.
+        """
+        self.api.make_request.side_effect = [
+            {'results': [{'id': 1}, {'id': 2}]},
+            {'results': [{'id': 3}, {'id': 4}]},
+            {'results': [{'id': 5}]},
+        ]
+
+        results = list(self.api.iter_list('Service', top=2, filters="Name eq 'name'"))
+        self.assertEqual([result['id'] for result in results], [1, 2, 3, 4, 5])
+
+        urls = self.get_called_urls()
+        self.assertEqual(len(urls), 3)
+        for url, skip in zip(urls, [0, 2, 4]):
+            self.assertTrue('$top=2&$skip={0}'.format(skip) in url)
+            self.assertTrue("$filter=Name eq 'name'" in url)
+
+    def test_follows_next_link(self):
+        """
+        If CDMS returns a __next link, that one is used to get the next page.
+        """
+        self.api.make_request.side_effect = [
+            {'results': [{'id': 1}], '__next': 'http://next-page'},
+            {'results': [{'id': 2}]},
+        ]
+
+        results = list(self.api.iter_list('Service', top=2))
+        self.assertEqual([result['id'] for result in results], [1, 2])
+        self.assertEqual(self.get_called_urls()[1], 'http://next-page')
+
+    def test_skip_and_limit(self):
+        """
+        Iteration starts from `skip` and stops after `limit` results, asking only for the ones needed.
+        """
+        self.api.make_request.side_effect = [
+            {'results': [{'id': 11}, {'id': 12}]},
+            {'results': [{'id': 13}]},
+        ]
+
+        results = list(self.api.iter_list('Service', top=2, skip=10, limit=3))
+        self.assertEqual([result['id'] for result in results], [11, 12, 13])
+
+        urls = self.get_called_urls()
+        self.assertEqual(len(urls), 2)
+        self.assertTrue('$top=2&$skip=10' in urls[0])
+        self.assertTrue('$top=1&$skip=12' in urls[1])
+
+    def test_is_lazy(self):
+        """
+        Pages are only fetched when needed.
+        """
+        self.api.make_request.side_effect = [
+            {'results': [{'id': 1}, {'id': 2}]},
+            {'results': []},
+        ]
+
+        results = self.api.iter_list('Service', top=2)
+        self.assertEqual(self.api.make_request.call_count, 0)
+
+        next(results)
+        next(results)
+        self.assertEqual(self.api.make_request.call_count, 1)
+
+        self.assertRaises(StopIteration, next, results)
+        self.assertEqual(self.api.make_request.call_count, 2)
+
+
+class IterListWithPrefetchTestCase(BaseCDMSApiTestCase):
+    def mock_pages(self, pages, delays=None):
+        """
+        Mocks make_request so that it returns the page matching the $skip in the url
+        (truncated to $top), optionally sleeping `delays[page_index]` seconds before returning.
+        """
+        def make_request(verb, url):
+            page_index = int(re.search(r'\$skip=(\d+)', url).group(1)) // 2
+            if page_index >= len(pages):
+                return {'results': []}
+            if delays:
+                time.sleep(delays[page_index])
+            top = int(re.search(r'\$top=(\d+)', url).group(1))
+            return {'results': pages[page_index][:top]}
+        self.api.make_request.side_effect = make_request
+
+    def test_results_in_order(self):
+        """
+        Pages are returned in $skip order even if the later ones complete first.
+        """
+        self.mock_pages(
+            [[{'id': 1}, {'id': 2}], [{'id': 3}, {'id': 4}], [{'id': 5}]],
+            delays=[0.2, 0.1, 0]
+        )
+
+        results = list(self.api.iter_list('Service', top=2, prefetch=2))
+        self.assertEqual([result['id'] for result in results], [1, 2, 3, 4, 5])
+
+    def test_requests_in_flight(self):
+        """
+        With prefetch=N, N upcoming pages are requested while the current one is consumed.
+        """
+        self.mock_pages([[{'id': 1}, {'id': 2}]] * 10)
+
+        results = self.api.iter_list('Service', top=2, prefetch=3)
+        next(results)
+        time.sleep(0.1)
+        self.assertEqual(self.api.make_request.call_count, 4)
+        results.close()
+
+    def test_skip_and_limit(self):
+        self.mock_pages([[{'id': 1}, {'id': 2}], [{'id': 3}, {'id': 4}], [{'id': 5}, {'id': 6}]])
+
+        results = list(self.api.iter_list('Service', top=2, skip=2, limit=3, prefetch=2))
+        self.assertEqual([result['id'] for result in results], [3, 4, 5])
+        self.assertEqual(self.api.make_request.call_count, 2)
+
+    def test_stops_at_partial_page(self):
+        self.mock_pages([[{'id': 1}, {'id': 2}], [{'id': 3}]])
+
+        results = list(self.api.iter_list('Service', top=2, prefetch=1))
+        self.assertEqual([result['id'] for result in results], [1, 2, 3])
+
+    def test_follows_next_link(self):
+        """
+        If CDMS returns a __next link, the $skip windows requested ahead are dropped and
+        the link is followed sequentially as iter_list does without prefetch.
+        """
+        def make_request(verb, url):
+            if url == 'http://next-page':
+                return {'results': [{'id': 3}, {'id': 4}], '__next': 'http://last-page'}
+            if url == 'http://last-page':
+                return {'results': [{'id': 5}]}
+            if '$skip=0' in url:
+                return {'results': [{'id': 1}, {'id': 2}], '__next': 'http://next-page'}
+            return {'results': [{'id': 'not in order'}] * 2}
+        self.api.make_request.side_effect = make_request
+
+        results = list(self.api.iter_list('Service', top=2, prefetch=2))
+        self.assertEqual([result['id'] for result in results], [1, 2, 3, 4, 5])
+
+    def test_follows_next_link_up_to_limit(self):
+        def make_request(verb, url):
+            if url == 'http://next-page':
+                return {'results': [{'id': 3}, {'id': 4}]}
+            return {'results': [{'id': 1}, {'id': 2}], '__next': 'http://next-page'}
+        self.api.make_request.side_effect = make_request
+
+        results = list(self.api.iter_list('Service', top=2, limit=3, prefetch=2))
+        self.assertEqual([result['id'] for result in results], [1, 2, 3])
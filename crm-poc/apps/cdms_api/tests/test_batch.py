@@ -0,0 +1,228 @@
+import json
+
+from unittest import mock
+
+from cdms_api.exceptions import CDMSException, CDMSNotFoundException, CDMSConflictException
+from cdms_api.tests.test_base import BaseCDMSApiTestCase
+
+
+def http_response(status, data=None):
+    body = json.dumps({'d': data}, ensure_ascii=False) if data is not None else ''
+    return (
+        'Content-Type: application/http\r\n'
+        'Content-Transfer-Encoding: binary\r\n\r\n'
+        'HTTP/1.1 {status}\r\n'
+        'Content-Type: application/json\r\n\r\n'
+        '{body}\r\n'
+    ).format(status=status, body=body)
+
+
+def batch_response(parts):
+    """
+    Returns a mocked $batch response made of `parts`.
+    Each part is either an http response (string) or a list of http responses (change set).
+    """
+    content = []
+    for index, part in enumerate(parts):
+        if isinstance(part, list):
+            changeset = ''.join(
+                '--changeset_{index}\r\n{response}'.format(index=index, response=response)
+                for response in part
+            )
+            part = (
+                'Content-Type: multipart/mixed; boundary=changeset_{index}\r\n\r\n'
+                '{changeset}--changeset_{index}--\r\n'
+            ).format(index=index, changeset=changeset)
+        content.append('--batchresponse\r\n{part}'.format(part=part))
+    content.append('--batchresponse--\r\n')
+
+    resp = mock.MagicMock()
+    resp.status_code = 202
+    resp.headers = {'Content-Type': 'multipart/mixed; boundary=batchresponse'}
+    resp.content = ''.join(content).encode('utf-8')
+    return resp
+
+
+class BatchTestCase(BaseCDMSApiTestCase):
+    def test_request(self):
+        """
+        All operations are sent in one single $batch request, writes in change sets.
+        """
+        self.api.make_request.return_value = batch_response([
+            http_response('200 OK', {'Name': 'name'}),
+            [http_response('201 Created', {'AccountId': 'new-pk'})],
+        ])
+
+        with self.api.batch() as batch:
+            batch.get('Account', 'cdms-pk')
+            batch.create('Account', {'Name': 'new name'})
+
+        self.assertEqual(self.api.make_request.call_count, 1)
+        (verb, url), kwargs = self.api.make_request.call_args
+        self.assertEqual(verb, 'post')
+        self.assertTrue(url.endswith('/OrganizationData.svc/$batch'))
+        self.assertTrue(kwargs['headers']['Content-type'].startswith('multipart/mixed; boundary=batch_'))
+
+        body = kwargs['data']
+        self.assertTrue("GET {0} HTTP/1.1".format(self.api.get_url('Account', 'cdms-pk')) in body)
+        self.assertTrue("POST {0} HTTP/1.1".format(self.api.get_url('Account')) in body)
+        self.assertTrue('{"Name": "new name"}' in body)
+        self.assertEqual(body.count('Content-Type: multipart/mixed; boundary=changeset_'), 1)
+
+    def test_results(self):
+        """
+        Each operation gets its own result.
+        Updates return the values of the GET following the PUT.
+        """
+        self.api.make_request.return_value = batch_response([
+            http_response('200 OK', {'Name': 'name'}),
+            [http_response('201 Created', {'AccountId': 'new-pk'})],
+            [http_response('204 No Content')],
+            http_response('200 OK', {'Name': 'updated name'}),
+            [http_response('204 No Content')],
+        ])
+
+        with self.api.batch() as batch:
+            get_op = batch.get('Account', 'cdms-pk')
+            create_op = batch.create('Account', {'Name': 'new name'})
+            update_op = batch.update('Account', 'cdms-pk', {'Name': 'updated name'})
+            delete_op = batch.delete('Account', 'cdms-pk2')
+
+        self.assertEqual(get_op.result(), {'Name': 'name'})
+        self.assertEqual(create_op.result(), {'AccountId': 'new-pk'})
+        self.assertEqual(update_op.result(), {'Name': 'updated name'})
+        self.assertEqual(delete_op.result(), None)
+
+    def test_exceptions(self):
+        """
+        Errors are mapped through EXCEPTIONS_MAP and only affect the related operation.
+        """
+        self.api.make_request.return_value = batch_response([
+            http_response('404 Not Found', {}),
+            http_response('200 OK', {'Name': 'name'}),
+            http_response('500 Internal Server Error', {}),
+            http_response('404 Not Found', {}),
+            http_response('404 Not Found', {}),
+        ])
+
+        with self.api.batch() as batch:
+            not_found_op = batch.get('Account', 'invalid')
+            get_op = batch.get('Account', 'cdms-pk')
+            failed_op = batch.create('Account', {'Name': 'new name'})
+            update_op = batch.update('Account', 'invalid', {'Name': 'updated name'})
+
+        self.assertRaises(CDMSNotFoundException, not_found_op.result)
+        self.assertEqual(get_op.result(), {'Name': 'name'})
+
+        with self.assertRaises(CDMSException) as cm:
+            failed_op.result()
+        self.assertEqual(cm.exception.status_code, 500)
+
+        # the PUT failed so the update fails as well
+        self.assertRaises(CDMSException, update_op.result)
+
+    def test_non_ascii(self):
+        self.api.make_request.return_value = batch_response([
+            http_response('200 OK', {'Name': 'Café'}),
+            [http_response('201 Created', {'Name': 'Café'})],
+        ])
+
+        with self.api.batch() as batch:
+            get_op = batch.get('Account', 'cdms-pk')
+            create_op = batch.create('Account', {'Name': 'Café'})
+
+        self.assertEqual(get_op.result(), {'Name': 'Café'})
+        self.assertEqual(create_op.result(), {'Name': 'Café'})
+
+    def test_missing_responses(self):
+        """
+        If cdms returns fewer responses than operations, CDMSException is raised
+        instead of leaving some operations without result.
+        """
+        self.api.make_request.return_value = batch_response([
+            http_response('200 OK', {'Name': 'name'}),
+        ])
+
+        batch = self.api.batch()
+        batch.get('Account', 'cdms-pk')
+        batch.get('Account', 'other-pk')
+        self.assertRaises(CDMSException, batch.execute)
+
+    def test_result_before_execute(self):
+        batch = self.api.batch()
+        op = batch.get('Account', 'cdms-pk')
+        self.assertRaises(CDMSException, op.result)
+
+    def test_empty(self):
+        with self.api.batch():
+            pass
+        self.assertEqual(self.api.make_request.call_count, 0)
+
+    def test_merge(self):
+        """
+        Updates with merge=True use MERGE and only GET the `select` fields afterwards.
+        """
+        self.api.make_request.return_value = batch_response([
+            [http_response('204 No Content')],
+            http_response('200 OK', {'ModifiedOn': '/Date(1451606400000)/'}),
+        ])
+
+        with self.api.batch() as batch:
+            op = batch.update('Account', 'cdms-pk', {'Name': 'new name'}, merge=True, select=['ModifiedOn'])
+
+        self.assertEqual(op.result(), {'ModifiedOn': '/Date(1451606400000)/'})
+
+        body = self.api.make_request.call_args[1]['data']
+        url = self.api.get_url('Account', 'cdms-pk')
+        self.assertTrue('MERGE {0} HTTP/1.1'.format(url) in body)
+        self.assertTrue('GET {0}?$select=ModifiedOn HTTP/1.1'.format(url) in body)
+
+
+class PartialUpdateTestCase(BaseCDMSApiTestCase):
+    def test_one_request(self):
+        """
+        partial_update sends the MERGE and the GET of ModifiedOn in one single request
+        and returns the values of the GET.
+        """
+        self.api.make_request.return_value = batch_response([
+            [http_response('204 No Content')],
+            http_response('200 OK', {'ModifiedOn': '/Date(1451606400000)/'}),
+        ])
+
+        self.assertEqual(
+            self.api.partial_update('Account', 'cdms-pk', {'Name': 'new name'}),
+            {'ModifiedOn': '/Date(1451606400000)/'}
+        )
+
+        self.assertEqual(self.api.make_request.call_count, 1)
+        (verb, url), kwargs = self.api.make_request.call_args
+        self.assertTrue(url.endswith('$batch'))
+        self.assertTrue('MERGE ' in kwargs['data'])
+
+    def test_exception(self):
+        self.api.make_request.return_value = batch_response([
+            http_response('404 Not Found', {}),
+            http_response('404 Not Found', {}),
+        ])
+
+        self.assertRaises(
+            CDMSNotFoundException,
+            self.api.partial_update, 'Account', 'invalid', {'Name': 'new name'}
+        )
+
+    def test_if_match(self):
+        """
+        With if_match, the MERGE is sent with the If-Match header and 412 raises CDMSConflictException.
+        """
+        self.api.make_request.return_value = batch_response([
+            [http_response('412 Precondition Failed', {})],
+            http_response('412 Precondition Failed', {}),
+        ])
+
+        self.assertRaises(
+            CDMSConflictException,
+            self.api.partial_update, 'Account', 'cdms-pk', {'Name': 'new name'}, if_match='W/"1"'
+        )
+
+        (verb, url), kwargs = self.api.make_request.call_args
+        self.assertTrue('\r\nIf-Match: W/"1"\r\n' in kwargs['data'])
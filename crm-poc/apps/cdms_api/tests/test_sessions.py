@@ -0,0 +1,69 @@
+import threading
+
+from django.test.testcases import TestCase
+
+from requests.cookies import RequestsCookieJar
+
+from cdms_api.sessions import SessionPool
+
+
+class SessionPoolTestCase(TestCase):
+    def test_sessions_reused(self):
+        """
+        A returned session is given to the next borrower instead of creating a new one.
+        """
+        pool = SessionPool(size=2)
+        with pool.borrow() as session:
+            pass
+
+        with pool.borrow() as other_session:
+            self.assertTrue(other_session is session)
+
+    def test_concurrent_borrowers_get_different_sessions(self):
+        pool = SessionPool(size=2)
+        with pool.borrow() as session1:
+            with pool.borrow() as session2:
+                self.assertFalse(session1 is session2)
+
+    def test_borrow_waits_when_exhausted(self):
+        """
+        No more than `size` sessions get created, other borrowers wait.
+        """
+        pool = SessionPool(size=1)
+        borrowed = []
+
+        def borrow():
+            with pool.borrow() as session:
+                borrowed.append(session)
+
+        with pool.borrow() as session:
+            thread = threading.Thread(target=borrow)
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(borrowed, [])
+
+        thread.join(1)
+        self.assertEqual(borrowed, [session])
+
+    def test_set_cookies(self):
+        """
+        set_cookies replaces the cookies of all the sessions, borrowed ones included.
+        """
+        pool = SessionPool(size=2)
+        with pool.borrow() as session1:
+            with pool.borrow() as session2:
+                jar = RequestsCookieJar()
+                pool.set_cookies(jar)
+
+                self.assertTrue(session1.cookies is jar)
+                self.assertTrue(session2.cookies is jar)
+        self.assertEqual(pool.generation, 1)
+
+        with pool.borrow() as session:
+            self.assertTrue(session.cookies is jar)
+
+    def test_keep_alive(self):
+        pool = SessionPool(size=1, keep_alive=False)
+        with pool.borrow() as session:
+            self.assertEqual(session.headers['Connection'], 'close')
@@ -61,7 +61,7 @@ def populate_data(service, data={}, guid=None):
 
 
 def mocked_cdms_get(get_data={}):
-    def internal(service, guid):
+    def internal(service, guid, select=None):
         return populate_data(service, get_data, guid)
     return internal
 
@@ -73,7 +73,7 @@ def mocked_cdms_create(create_data={}):
 
 
 def mocked_cdms_update(update_data={}):
-    def internal(service, guid, data):
+    def internal(service, guid, data, if_match=None):
         return populate_data(service, update_data, guid)
     return internal
 
@@ -90,5 +90,7 @@ def get_mocked_api():
     api.create.side_effect = mocked_cdms_create()
     api.get.side_effect = mocked_cdms_get()
     api.update.side_effect = mocked_cdms_update()
+    api.partial_update.side_effect = mocked_cdms_update()
     api.list.side_effect = mocked_cdms_list()
+    api.iter_list.side_effect = mocked_cdms_list()
     return api
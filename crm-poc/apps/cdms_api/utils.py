@@ -1,29 +1,73 @@
 import re
-import time
 import datetime
 
 
-DATETIME_RE = re.compile('/Date\(([-+]?\d+)\)/')
+DATETIME_RE = re.compile('/Date\(([-+]?\d+)(?:[-+]\d{4})?\)/')
 
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
 
-def cdms_datetime_to_datetime(value):
+
+def cdms_datetime_to_datetime(value, _epoch=EPOCH, _timedelta=datetime.timedelta):
     """
     Parses a cdms datetime as string and returns the equivalent datetime value.
-    Dates in CDMS are always UTC.
+    Dates in CDMS are always UTC (milliseconds since the epoch, the optional
+    offset suffix is informative only).
+
+    The canonical /Date(n)/ form is sliced directly, the others go through the regex.
     """
-    match = DATETIME_RE.match(value or '')
+    if not value:
+        return None
+    try:
+        if value[:6] == '/Date(' and value[-2:] == ')/':
+            return _epoch + _timedelta(0, 0, 0, int(value[6:-2]))
+    except ValueError:
+        pass
+
+    match = DATETIME_RE.match(value)
     if match:
-        parsed_val = int(match.group(1))
-        parsed_val = datetime.datetime.fromtimestamp(parsed_val / 1000)
-        return parsed_val.replace(tzinfo=datetime.timezone.utc)
+        return _epoch + _timedelta(0, 0, 0, int(match.group(1)))
 
 
-def datetime_to_cdms_datetime(value):
+def datetime_to_cdms_datetime(value, _epoch=EPOCH, _utc=datetime.timezone.utc):
     """
-    Returns the cdms string equivalent of the datetime value.
+    Returns the cdms string equivalent of the datetime value, naive datetimes are
+    considered UTC. CDMS stores seconds so the microseconds get dropped.
     """
     if not value:
         return value
-    return '/Date({0})/'.format(
-        int(time.mktime(value.timetuple()) * 1000)
-    )
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=_utc)
+
+    delta = value - _epoch
+    return '/Date({0})/'.format((delta.days * 86400 + delta.seconds) * 1000)
+
+
+def cdms_datetimes_to_datetimes(values):
+    """
+    Batch version of cdms_datetime_to_datetime, e.g. for the ModifiedOn values of a page.
+    Repeated values are parsed once and return the same datetime object.
+    """
+    epoch, timedelta = EPOCH, datetime.timedelta
+    parsed = {}
+    results = []
+    append = results.append
+    for value in values:
+        result = parsed.get(value)
+        if result is None:
+            try:
+                result = epoch + timedelta(0, 0, 0, int(value[6:-2]))
+            except (TypeError, ValueError):
+                result = cdms_datetime_to_datetime(value)
+            else:
+                if value[:6] != '/Date(' or value[-2:] != ')/':
+                    result = cdms_datetime_to_datetime(value)
+            parsed[value] = result
+        append(result)
+    return results
+
+
+def datetimes_to_cdms_datetimes(values):
+    """
+    Batch version of datetime_to_cdms_datetime.
+    """
+    return [datetime_to_cdms_datetime(value) for value in values]
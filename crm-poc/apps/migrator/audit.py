@@ -0,0 +1,119 @@
+import math
+import random
+import logging
+
+from collections import Counter
+
+from django.conf import settings
+
+from cdms_api import fields as cdms_fields
+
+from .query import CDMSQuery, CDMSSelectCompiler, CDMSCountCompiler
+
+logger = logging.getLogger('migrator')
+
+
+class AuditReport(object):
+    """
+    Outcome of ModelAudit.run().
+
+    `checked`: number of cdms objs compared
+    `missing`: number of them without local obj
+    `drifted`: number of them with at least one field different from the local obj
+    `fields`: Counter of field name -> number of objs with that field different
+    """
+    def __init__(self, model):
+        self.model = model
+        self.checked = 0
+        self.missing = 0
+        self.drifted = 0
+        self.fields = Counter()
+
+    def __str__(self):
+        lines = [
+            '{0}: {1} checked, {2} missing, {3} drifted'.format(
+                self.model._meta.label, self.checked, self.missing, self.drifted
+            )
+        ]
+        lines.extend(
+            '  {0}: {1}'.format(field_name, tot)
+            for field_name, tot in sorted(self.fields.items(), key=lambda item: (-item[1], item[0]))
+        )
+        return '\n'.join(lines)
+
+
+class ModelAudit(object):
+    """
+    Measures the drift between the cdms objs of `model` and their local objs.
+
+    Same comparison as BaseCDMSMigrator.get_conflicting_fields but in bulk: cdms objs are
+    read one page at a time (ordered by id) and the local values of each page are
+    fetched with one values_list query so that memory stays bounded and no model
+    instances get built. Foreign keys are compared by cdms_pk.
+
+    With `sample_rate` < 1 only that fraction of the pages, picked at random, is requested.
+    """
+    def __init__(self, model, sample_rate=1, page_size=None):
+        self.model = model
+        self.sample_rate = sample_rate
+        self.page_size = page_size or settings.CDMS_SYNC_PAGE_SIZE
+        self.plan = self.build_plan()
+
+    def build_plan(self):
+        plan = []
+        for field_plan in self.model.cdms_migrator.get_plan(self.model):
+            cdms_field = field_plan.cdms_field
+            if isinstance(cdms_field, cdms_fields.ForeignKeyField):
+                lookup = '{0}__{1}'.format(field_plan.name, cdms_field.model_cdms_pk_field)
+                converter = super(cdms_fields.ForeignKeyField, cdms_field).from_cdms_value
+            else:
+                lookup = field_plan.name
+                converter = field_plan.from_cdms_value
+            plan.append((field_plan.name, lookup, field_plan.cdms_name, converter))
+        return plan
+
+    def get_page_indexes(self):
+        count = CDMSCountCompiler(CDMSQuery(self.model)).execute()
+        pages = math.ceil(count / self.page_size)
+        if self.sample_rate >= 1:
+            return range(pages)
+        return sorted(random.sample(range(pages), math.ceil(pages * self.sample_rate)))
+
+    def get_page(self, index):
+        query = CDMSQuery(self.model)
+        query.add_ordering('cdms_pk')
+        query.set_limits(index * self.page_size, (index + 1) * self.page_size)
+        return list(CDMSSelectCompiler(query).execute())
+
+    def audit_page(self, page, report):
+        migrator = self.model.cdms_migrator
+        lookups = [lookup for _, lookup, _, _ in self.plan]
+        local_rows = {
+            row[0]: row[1:]
+            for row in self.model.objects.skip_cdms().filter(
+                cdms_pk__in=[migrator.get_cdms_pk(cdms_data) for cdms_data in page]
+            ).values_list('cdms_pk', *lookups)
+        }
+
+        for cdms_data in page:
+            report.checked += 1
+            local_row = local_rows.get(migrator.get_cdms_pk(cdms_data))
+            if local_row is None:
+                report.missing += 1
+                continue
+
+            drifted_fields = [
+                field_name
+                for (field_name, _, cdms_name, converter), local_value in zip(self.plan, local_row)
+                if converter(cdms_data[cdms_name]) != local_value
+            ]
+            if drifted_fields:
+                report.drifted += 1
+                report.fields.update(drifted_fields)
+
+    def run(self):
+        report = AuditReport(self.model)
+        for index in self.get_page_indexes():
+            self.audit_page(self.get_page(index), report)
+        logger.debug('Audited %s %s objs' % (report.checked, self.model._meta.label))
+        return report
@@ -1,15 +1,97 @@
+from collections import namedtuple
+
+from django.db.models.signals import class_prepared
+
 from cdms_api.utils import cdms_datetime_to_datetime
 from cdms_api import fields as cdms_fields
 
 from .exceptions import NotMappingFieldException, ObjectsNotInSyncException
 
 
+FieldPlan = namedtuple('FieldPlan', ['name', 'cdms_name', 'from_cdms_value', 'to_cdms_value', 'cdms_field'])
+
+
+class CDMSRow(object):
+    """
+    Read-only view of the data of a cdms obj, see BaseCDMSMigrator.get_rows.
+
+    Mapped fields (plus cdms_pk and created) are converted from `cdms_data` on first access
+    only and cached in slots so that fields never read don't cost anything.
+    Subclasses are generated per model with one slot per field.
+    """
+    __slots__ = ('cdms_data',)
+    plan = {}
+
+    def __init__(self, cdms_data):
+        self.cdms_data = cdms_data
+
+    def __getattr__(self, name):
+        # only called when the slot has not been set yet
+        try:
+            field_plan = self.plan[name]
+        except KeyError:
+            raise AttributeError(name)
+
+        try:
+            cdms_value = self.cdms_data[field_plan.cdms_name]
+        except KeyError:
+            # e.g. not requested with $select
+            raise AttributeError(name)
+
+        value = field_plan.from_cdms_value(cdms_value)
+        setattr(self, name, value)
+        return value
+
+    def __repr__(self):
+        return '<{0}: {1}>'.format(self.__class__.__name__, self.cdms_pk)
+
+
 class BaseCDMSMigrator(object):
+    """
+    Maps the fields of a CDMSModel subclass to the ones of a cdms service.
+
+    When assigned to a model as `cdms_migrator`, the list of its mapped fields with their
+    converters (see `get_plan`) is computed once the model class is ready so that
+    converting cdms objs doesn't go through all the model fields every time.
+    """
     fields = {}
     service = None
 
     def __init__(self):
         self.all_fields = self.build_filters()
+        self.select_fields = self.build_select_fields()
+        self.plans = {}
+        self.row_classes = {}
+
+    def contribute_to_class(self, cls, name):
+        setattr(cls, name, self)
+        if not cls._meta.abstract:
+            class_prepared.connect(self.on_class_prepared, sender=cls, weak=False)
+
+    def on_class_prepared(self, sender, **kwargs):
+        self.plans[sender] = self.build_plan(sender)
+
+    def build_plan(self, model):
+        return tuple(
+            FieldPlan(
+                field.name, cdms_field.cdms_name,
+                cdms_field.from_cdms_value, cdms_field.to_cdms_value, cdms_field
+            )
+            for field, cdms_field in (
+                (field, self.all_fields.get(field.name)) for field in model._meta.fields
+            )
+            if cdms_field
+        )
+
+    def get_plan(self, model):
+        """
+        Returns the tuple of FieldPlan (name, cdms name, converters) of the mapped fields of `model`.
+        """
+        plan = self.plans.get(model)
+        if plan is None:
+            # e.g. subclasses of the model the migrator was assigned to
+            plan = self.plans[model] = self.build_plan(model)
+        return plan
 
     def build_filters(self):
         all_fields = {
@@ -18,12 +100,59 @@ class BaseCDMSMigrator(object):
         all_fields.update(self.fields)
         return all_fields
 
+    def build_select_fields(self):
+        """
+        Returns the list of cdms fields to request ($select) when reading cdms objs:
+        the mapped ones + id, ModifiedOn and CreatedOn.
+        """
+        select_fields = {self.get_cdms_pk_name(), 'ModifiedOn', 'CreatedOn'}
+        select_fields.update(
+            cdms_field.cdms_name for cdms_field in self.all_fields.values()
+        )
+        return sorted(select_fields)
+
+    def get_row_class(self, model):
+        row_class = self.row_classes.get(model)
+        if row_class is None:
+            plan = {field_plan.name: field_plan for field_plan in self.get_plan(model)}
+            for name, cdms_field in (
+                ('cdms_pk', cdms_fields.BaseField(self.get_cdms_pk_name())),
+                ('created', cdms_fields.DateTimeField('CreatedOn'))
+            ):
+                plan.setdefault(name, FieldPlan(
+                    name, cdms_field.cdms_name, cdms_field.from_cdms_value, cdms_field.to_cdms_value, cdms_field
+                ))
+
+            row_class = self.row_classes[model] = type(
+                '{0}Row'.format(model.__name__), (CDMSRow,), {'__slots__': tuple(plan), 'plan': plan}
+            )
+        return row_class
+
+    def get_rows(self, model, cdms_data_list):
+        """
+        Wraps each cdms data of `cdms_data_list` into a CDMSRow of `model` without converting anything.
+        """
+        row_class = self.get_row_class(model)
+        return [row_class(cdms_data) for cdms_data in cdms_data_list]
+
+    def get_cdms_pk_name(self):
+        return '{service}Id'.format(service=self.service)
+
     def get_cdms_pk(self, cdms_data):
-        return cdms_data['{service}Id'.format(service=self.service)]
+        return cdms_data[self.get_cdms_pk_name()]
+
+    def get_etag(self, cdms_data):
+        """
+        Returns the etag of the cdms obj or '' if not available.
+        """
+        return (cdms_data.get('__metadata') or {}).get('etag') or ''
 
     def get_modified_on(self, cdms_data):
         return cdms_datetime_to_datetime(cdms_data['ModifiedOn'])
 
+    def get_created_on(self, cdms_data):
+        return cdms_datetime_to_datetime(cdms_data['CreatedOn'])
+
     def clean_up_cdms_data_before_changes(self, data):
         data.pop('optevia_LastVerified', None)
         data.pop('ModifiedOn', None)
@@ -32,7 +161,7 @@ class BaseCDMSMigrator(object):
 
     def has_cdms_obj_changed(self, local_obj, cdms_data):
         cdms_modified_on = self.get_modified_on(cdms_data)
-        cdms_created_on = cdms_datetime_to_datetime(cdms_data['CreatedOn'])
+        cdms_created_on = self.get_created_on(cdms_data)
 
         change_delta = (cdms_modified_on - local_obj.modified).total_seconds()
 
@@ -43,6 +172,19 @@ class BaseCDMSMigrator(object):
 
         return change_delta, cdms_modified_on, cdms_created_on
 
+    def has_row_changed(self, local_obj, row):
+        """
+        Same as has_cdms_obj_changed for a CDMSRow, only its modified value gets converted.
+        """
+        change_delta = (row.modified - local_obj.modified).total_seconds()
+
+        if change_delta < 0:
+            raise ObjectsNotInSyncException(
+                'Django Model changed without being syncronised to CDMS, this should not happen'
+            )
+
+        return change_delta > 0
+
     def get_cdms_field(self, field_name):
         cdms_field = self.all_fields.get(field_name)
         if not cdms_field:
@@ -53,54 +195,53 @@ class BaseCDMSMigrator(object):
         return cdms_field
 
     def update_cdms_data_from_local(self, local_obj, cdms_data):
-        values = [
-            (field.name, getattr(local_obj, field.name)) for field in local_obj._meta.fields
-        ]
-        return self.update_cdms_data_from_values(values, cdms_data)
+        for field_plan in self.get_plan(local_obj.__class__):
+            cdms_data[field_plan.cdms_name] = field_plan.to_cdms_value(getattr(local_obj, field_plan.name))
+        return cdms_data
 
     def update_cdms_data_from_values(self, values, cdms_data):
+        all_fields = self.all_fields
         for field_name, value in values:
-            try:
-                cdms_field = self.get_cdms_field(field_name)
-            except NotMappingFieldException:
-                continue
-
-            value = cdms_field.to_cdms_value(value)
-            cdms_data[cdms_field.cdms_name] = value
+            cdms_field = all_fields.get(field_name)
+            if cdms_field:
+                cdms_data[cdms_field.cdms_name] = cdms_field.to_cdms_value(value)
         return cdms_data
 
     def update_local_from_cdms_data(self, local_obj, cdms_data, cdms_known_related_objects={}):
-        for field in local_obj._meta.fields:
-            field_name = field.name
-            try:
-                cdms_field = self.get_cdms_field(field_name)
-            except NotMappingFieldException:
-                continue
-
-            value = cdms_field.from_cdms_value(cdms_data[cdms_field.cdms_name])
+        for field_name, cdms_name, from_cdms_value, _, _ in self.get_plan(local_obj.__class__):
+            value = from_cdms_value(cdms_data[cdms_name])
             if field_name in cdms_known_related_objects:
-                related_obj = cdms_known_related_objects.get(field_name, {}).get(value.cdms_pk)
+                value = self.get_known_related_obj(field_name, value, cdms_known_related_objects)
+
+            setattr(local_obj, field_name, value)
 
-                if related_obj:
-                    value = related_obj
+        return local_obj
+
+    def update_local_from_row(self, local_obj, row, cdms_known_related_objects={}):
+        """
+        Same as update_local_from_cdms_data with the values of a CDMSRow.
+        """
+        for field_plan in self.get_plan(local_obj.__class__):
+            field_name = field_plan.name
+            value = getattr(row, field_name)
+            if field_name in cdms_known_related_objects:
+                value = self.get_known_related_obj(field_name, value, cdms_known_related_objects)
 
             setattr(local_obj, field_name, value)
 
         return local_obj
 
+    def get_known_related_obj(self, field_name, value, cdms_known_related_objects):
+        related_obj = cdms_known_related_objects.get(field_name, {}).get(value.cdms_pk)
+        return related_obj or value
+
     def get_conflicting_fields(self, local_obj, cdms_data):
         """
         Returns the list of fields conflicting between local_obj and cdms_data.
         """
         conflicting_fields = {}
-        for field in local_obj._meta.fields:
-            field_name = field.name
-            try:
-                cdms_field = self.get_cdms_field(field_name)
-            except NotMappingFieldException:
-                continue
-
-            cdms_value = cdms_field.from_cdms_value(cdms_data[cdms_field.cdms_name])
+        for field_name, cdms_name, from_cdms_value, _, _ in self.get_plan(local_obj.__class__):
+            cdms_value = from_cdms_value(cdms_data[cdms_name])
             local_value = getattr(local_obj, field_name)
 
             if cdms_value != local_value:
@@ -4,3 +4,7 @@ class NotMappingFieldException(Exception):
 
 class ObjectsNotInSyncException(Exception):
     pass
+
+
+class DuplicateCDMSPkException(Exception):
+    pass
@@ -53,6 +53,14 @@ class Lookup(object):
         return cdms_expr.format(field=self.field, value=self.convert_value(self.value))
 
 
+class GuidLookup(Lookup):
+    """
+    Lookup on cdms guid fields, e.g. {service}Id eq guid'...'.
+    """
+    def convert_value(self, value):
+        return "guid'{value}'".format(value=value)
+
+
 class FilterNode(tree.Node):
     """
     Node subclass which can be used to construct cdms filter queries.
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from migrator.audit import ModelAudit
+from migrator.sync import get_cdms_models
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the cdms objs with the local ones and reports the number of '
+        'missing and drifted objs per field.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model_labels', nargs='*', metavar='app_label.ModelName',
+            help='Models to audit, all the cdms models if not specified.'
+        )
+        parser.add_argument(
+            '--sample-rate', type=float, dest='sample_rate', default=1,
+            help='Fraction of the cdms pages to compare, e.g. 0.1 for 10%%.'
+        )
+        parser.add_argument(
+            '--page-size', type=int, dest='page_size', default=None,
+            help='Number of cdms objs requested per page.'
+        )
+
+    def handle(self, *args, **options):
+        if not 0 < options['sample_rate'] <= 1:
+            raise CommandError('--sample-rate must be between 0 and 1')
+
+        try:
+            models = get_cdms_models(options['model_labels'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for model in models:
+            report = ModelAudit(
+                model, sample_rate=options['sample_rate'], page_size=options['page_size']
+            ).run()
+            self.stdout.write(str(report))
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from migrator.outbox import OutboxWorker
+
+
+class Command(BaseCommand):
+    help = 'Sends the local changes saved with write-behind (settings.CDMS_WRITE_BEHIND) to cdms.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--loop', action='store_true', dest='loop', default=False,
+            help='Keep running, checking for new changes every --interval seconds.'
+        )
+        parser.add_argument(
+            '--interval', type=float, dest='interval', default=1,
+            help='Seconds to wait between checks when using --loop.'
+        )
+
+    def handle(self, *args, **options):
+        worker = OutboxWorker()
+        while True:
+            tot = worker.drain()
+            if tot or not options['loop']:
+                self.stdout.write(
+                    '{0} changes sent to cdms ({1} writes saved by coalescing)'.format(tot, worker.coalesced)
+                )
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
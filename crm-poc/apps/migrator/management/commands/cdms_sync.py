@@ -0,0 +1,88 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from migrator.sync import ModelSync, ModelBackfill, ModelReconcile, get_cdms_models
+
+
+class Command(BaseCommand):
+    help = (
+        'Pulls the cdms objs modified since the last run into the local tables '
+        'so that they can be read with skip_cdms().'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'model_labels', nargs='*', metavar='app_label.ModelName',
+            help='Models to sync, all the cdms models if not specified.'
+        )
+        parser.add_argument(
+            '--reset', action='store_true', dest='reset', default=False,
+            help='Forget the previous progress and sync everything from scratch.'
+        )
+        parser.add_argument(
+            '--backfill', action='store_true', dest='backfill', default=False,
+            help='Initial full import, pulls CreatedOn ranges of all the cdms objs concurrently.'
+        )
+        parser.add_argument(
+            '--workers', type=int, dest='workers', default=None,
+            help='Number of concurrent workers used by --backfill.'
+        )
+        parser.add_argument(
+            '--partitions', type=int, dest='partitions', default=None,
+            help='Number of CreatedOn ranges used by --backfill, 4 per worker by default.'
+        )
+        parser.add_argument(
+            '--reconcile', action='store_true', dest='reconcile', default=False,
+            help='Delete the local objs whose cdms obj has been deleted directly in cdms.'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run', default=False,
+            help='With --reconcile, only list the local objs deleted in cdms.'
+        )
+        parser.add_argument(
+            '--page-size', type=int, dest='page_size', default=None,
+            help='Number of cdms objs requested per page.'
+        )
+
+    def get_models(self, model_labels):
+        try:
+            return get_cdms_models(model_labels)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+    def backfill(self, model, options):
+        model_backfill = ModelBackfill(
+            model, workers=options['workers'],
+            partitions=options['partitions'], page_size=options['page_size']
+        )
+        tot, seconds = model_backfill.run()
+        self.stdout.write(
+            '{0}: {1} objs backfilled in {2:.1f}s ({3:.1f} objs/s)'.format(
+                model._meta.label, tot, seconds, tot / seconds if seconds else 0
+            )
+        )
+
+    def reconcile(self, model, options):
+        orphans = ModelReconcile(model).run(dry_run=options['dry_run'])
+        if options['dry_run']:
+            for pk, cdms_pk in orphans:
+                self.stdout.write('{0}: {1} (cdms_pk {2}) deleted in cdms'.format(model._meta.label, pk, cdms_pk))
+            return
+
+        self.stdout.write('{0}: {1} objs deleted in cdms removed'.format(model._meta.label, len(orphans)))
+
+    def handle(self, *args, **options):
+        for model in self.get_models(options['model_labels']):
+            if options['backfill']:
+                self.backfill(model, options)
+                continue
+
+            if options['reconcile']:
+                self.reconcile(model, options)
+                continue
+
+            model_sync = ModelSync(model, page_size=options['page_size'])
+            if options['reset']:
+                model_sync.reset()
+
+            tot = model_sync.run()
+            self.stdout.write('{0}: {1} objs synced'.format(model._meta.label, tot))
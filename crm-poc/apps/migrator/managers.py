@@ -1,5 +1,6 @@
-from django.db import models, connections
+from django.db import models, connections, transaction
 from django.db.models.query_utils import Q
+from django.db.models.constants import LOOKUP_SEP
 
 from django.core.exceptions import ObjectDoesNotExist
 
@@ -7,7 +8,7 @@ from cdms_api.exceptions import CDMSNotFoundException
 
 from .decorators import only_with_cdms_skip
 from .query import CDMSQuery, CDMSModelIterable, RefreshQuery, \
-    InsertQuery, UpdateQuery
+    InsertQuery, UpdateQuery, CDMSCountCompiler, CDMSSelectCompiler
 
 
 class CDMSQuerySet(models.QuerySet):
@@ -17,6 +18,7 @@ class CDMSQuerySet(models.QuerySet):
 
         self.cdms_query = CDMSQuery(model)
         self._cdms_known_related_objects = {}  # {rel_field_name, {cdms_pk: rel_obj}}
+        self._cdms_local_only_filters = False  # True if filtered by id/pk which don't exist in cdms
         self._iterable_class = CDMSModelIterable
 
     def skip_cdms(self):
@@ -29,6 +31,7 @@ class CDMSQuerySet(models.QuerySet):
         clone.cdms_skip = self.cdms_skip
 
         clone._cdms_known_related_objects = self._cdms_known_related_objects
+        clone._cdms_local_only_filters = self._cdms_local_only_filters
         return clone
 
     def none(self):
@@ -96,16 +99,27 @@ class CDMSQuerySet(models.QuerySet):
                         'Cannot yet get all objects, not implemented yet'
                     )
 
-            if not (len(kwargs.keys()) == 1 and list(kwargs)[0] in ('id', 'pk')):
+            # id/pk only exist locally so they are left out of the cdms query, which can only
+            # be broader than the local one as long as they are in AND
+            cdms_kwargs = {
+                key: value for key, value in kwargs.items()
+                if key.split(LOOKUP_SEP)[0] not in ('id', 'pk')
+            }
+            local_only = len(cdms_kwargs) != len(kwargs)
+            if (args or cdms_kwargs) and not (local_only and negate):
                 clone = self._clone()
 
-                q = Q(*args, **kwargs)
+                q = Q(*args, **cdms_kwargs)
                 if negate:
                     clone.query.add_q(~q)
                     clone.cdms_query.add_q(~q)
                 else:
                     clone.query.add_q(q)
                     clone.cdms_query.add_q(q)
+
+            ret = super(CDMSQuerySet, self)._filter_or_exclude(negate, *args, **kwargs)
+            ret._cdms_local_only_filters = self._cdms_local_only_filters or local_only
+            return ret
         return super(CDMSQuerySet, self)._filter_or_exclude(negate, *args, **kwargs)
 
     def _batched_insert(self, objs, fields, batch_size):
@@ -140,13 +154,15 @@ class CDMSQuerySet(models.QuerySet):
             obj = objs[0]
             query = InsertQuery(self.model)
             query.insert_value(obj)
-            cdms_pk, modified_on = query.get_compiler().execute()
+            compiler = query.get_compiler()
+            cdms_pk, modified_on = compiler.execute()
 
             # update cdms_pk local
             obj.cdms_pk = cdms_pk
             obj.modified = modified_on
+            obj.cdms_etag = compiler.etag
             self._clone().skip_cdms().filter(pk=return_val).update(
-                cdms_pk=cdms_pk, modified=modified_on
+                cdms_pk=cdms_pk, modified=modified_on, cdms_etag=compiler.etag
             )
 
         return return_val
@@ -154,24 +170,29 @@ class CDMSQuerySet(models.QuerySet):
     def _update(self, values):
         raise NotImplementedError()
 
-    def _update_with_modified(self, values):
+    def _update_with_modified(self, values, cdms_field_names=None):
         """
-        The same as _update but returns the modified_on date from cdms as well if the update
-        happened. I preferred not to override _update as I'm changing the return values from int to tuple (int, dt).
+        The same as _update but returns the modified_on date and etag from cdms as well if the update
+        happened. I preferred not to override _update as I'm changing the return values from int to
+        tuple (int, dt, etag).
 
         This is not ideal but we need to update the model based on the new modified_on value and Django really
         doesn't help you in this case.
+
+        If `cdms_field_names` is given, only those fields are sent to cdms.
         """
-        modified_on = None
+        modified_on, etag = None, None
         return_val = super(CDMSQuerySet, self)._update(values)
 
         if not self.cdms_skip:
             model_values = []
-            cdms_pk = None
+            cdms_pk, etag = None, None
             for field, _, value in values:
                 if field.name == 'cdms_pk':
                     cdms_pk = value
-                else:
+                elif field.name == 'cdms_etag':
+                    etag = value
+                elif cdms_field_names is None or field.name in cdms_field_names:
                     model_values.append(
                         (field.name, value)
                     )
@@ -179,14 +200,17 @@ class CDMSQuerySet(models.QuerySet):
             assert cdms_pk, 'Cannot update without cdms pk'
 
             query = UpdateQuery(self.model)
-            query.add_update_fields(cdms_pk, model_values)
-            modified_on = query.get_compiler().execute()
+            query.add_update_fields(cdms_pk, model_values, etag=etag)
+            compiler = query.get_compiler()
+            modified_on = compiler.execute()
+            etag = compiler.etag
 
             super(CDMSQuerySet, self)._update([
-                (self.model._meta.get_field('modified'), None, modified_on)
+                (self.model._meta.get_field('modified'), None, modified_on),
+                (self.model._meta.get_field('cdms_etag'), None, etag)
             ])
 
-        return return_val, modified_on
+        return return_val, modified_on, etag
 
     @only_with_cdms_skip
     def annotate(self, *args, **kwargs):
@@ -246,37 +270,137 @@ class CDMSQuerySet(models.QuerySet):
     def update_or_create(self, *args, **kwargs):
         return super(CDMSQuerySet, self).update_or_create(*args, **kwargs)
 
-    @only_with_cdms_skip
-    def count(self, *args, **kwargs):
-        return super(CDMSQuerySet, self).count(*args, **kwargs)
+    def count(self):
+        """
+        Counts the cdms objs matching the filters without getting them so
+        local objs do NOT get refreshed.
+        """
+        if self.cdms_skip or self._result_cache is not None:
+            return super(CDMSQuerySet, self).count()
+
+        if self._has_local_only_filters():
+            return self._clone().skip_cdms().count()
+
+        count = CDMSCountCompiler(self.cdms_query).execute()
+
+        # apply slicing like django does
+        if self.query.high_mark is not None:
+            count = min(count, self.query.high_mark)
+        return max(0, count - self.query.low_mark)
 
     @only_with_cdms_skip
     def in_bulk(self, *args, **kwargs):
         return super(CDMSQuerySet, self).in_bulk(*args, **kwargs)
 
-    @only_with_cdms_skip
-    def earliest(self, *args, **kwargs):
-        return super(CDMSQuerySet, self).earliest(*args, **kwargs)
+    def _has_local_only_filters(self):
+        """
+        True if filtering by id/pk which exist just locally and
+        are therefore not part of the cdms query.
+        """
+        return self._cdms_local_only_filters or (self.query.has_filters() and not self.cdms_query.filters)
 
-    @only_with_cdms_skip
-    def latest(self, *args, **kwargs):
-        return super(CDMSQuerySet, self).latest(*args, **kwargs)
+    def _refresh_local_obj(self, obj):
+        if obj is None:
+            return obj
 
-    @only_with_cdms_skip
-    def first(self, *args, **kwargs):
-        return super(CDMSQuerySet, self).first(*args, **kwargs)
+        query = RefreshQuery(self.model)
+        query.set_local_obj(obj)
+        return query.get_compiler().execute()
 
-    @only_with_cdms_skip
-    def last(self, *args, **kwargs):
-        return super(CDMSQuerySet, self).last(*args, **kwargs)
+    def _get_first_from_cdms(self, order_by=None, reverse=False):
+        """
+        Gets the first cdms obj matching the filters with one $top=1 call,
+        refreshes the related local obj and returns it or None if no obj was found.
+        """
+        cdms_query = self.cdms_query.clone()
+        if order_by:
+            cdms_query.clear_ordering()
+            cdms_query.add_ordering(*order_by)
+        if reverse:
+            cdms_query.reverse_ordering()
+        cdms_query.set_limits(0, 1)
+
+        results = list(CDMSSelectCompiler(cdms_query).execute())
+        if not results:
+            return None
+
+        with transaction.atomic():
+            query = RefreshQuery(self.model)
+            query.set_cdms_known_related_objects(self._cdms_known_related_objects)
+            query.set_cdms_data(results[0])
+            return query.get_compiler().execute()
+
+    def _get_earliest_or_latest_from_cdms(self, field_name=None, reverse=False):
+        order_by = field_name or self.model._meta.get_latest_by
+        assert bool(order_by), "earliest() and latest() require either a "\
+            "field_name parameter or 'get_latest_by' in the model"
+
+        obj = self._get_first_from_cdms(order_by=[order_by], reverse=reverse)
+        if obj is None:
+            raise self.model.DoesNotExist(
+                "%s matching query does not exist." % self.model._meta.object_name
+            )
+        return obj
+
+    def earliest(self, field_name=None):
+        if self.cdms_skip:
+            return super(CDMSQuerySet, self).earliest(field_name=field_name)
+
+        if self._has_local_only_filters():
+            return self._refresh_local_obj(
+                super(CDMSQuerySet, self._clone().skip_cdms()).earliest(field_name=field_name)
+            )
+        return self._get_earliest_or_latest_from_cdms(field_name=field_name)
+
+    def latest(self, field_name=None):
+        if self.cdms_skip:
+            return super(CDMSQuerySet, self).latest(field_name=field_name)
+
+        if self._has_local_only_filters():
+            return self._refresh_local_obj(
+                super(CDMSQuerySet, self._clone().skip_cdms()).latest(field_name=field_name)
+            )
+        return self._get_earliest_or_latest_from_cdms(field_name=field_name, reverse=True)
+
+    def first(self):
+        if self.cdms_skip:
+            return super(CDMSQuerySet, self).first()
+
+        if self._has_local_only_filters():
+            return self._refresh_local_obj(
+                super(CDMSQuerySet, self._clone().skip_cdms()).first()
+            )
+        return self._get_first_from_cdms()
+
+    def last(self):
+        if self.cdms_skip:
+            return super(CDMSQuerySet, self).last()
+
+        if self._has_local_only_filters():
+            return self._refresh_local_obj(
+                super(CDMSQuerySet, self._clone().skip_cdms()).last()
+            )
+        return self._get_first_from_cdms(reverse=True)
 
     @only_with_cdms_skip
     def aggregate(self, *args, **kwargs):
         return super(CDMSQuerySet, self).aggregate(*args, **kwargs)
 
-    @only_with_cdms_skip
-    def exists(self, *args, **kwargs):
-        return super(CDMSQuerySet, self).exists(*args, **kwargs)
+    def exists(self):
+        """
+        Checks if any cdms obj matches the filters with one $top=1 call requesting the id only.
+        Local objs do NOT get refreshed.
+        """
+        if self.cdms_skip or self._result_cache is not None:
+            return super(CDMSQuerySet, self).exists()
+
+        if self._has_local_only_filters():
+            return self._clone().skip_cdms().exists()
+
+        cdms_query = self.cdms_query.clone()
+        cdms_query.set_select([self.model.cdms_migrator.get_cdms_pk_name()])
+        cdms_query.set_limits(0, 1)
+        return bool(list(CDMSSelectCompiler(cdms_query).execute()))
 
     @only_with_cdms_skip
     def bulk_create(self, *args, **kwargs):
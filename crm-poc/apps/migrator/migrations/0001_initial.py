@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncState',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_label', models.CharField(max_length=255, unique=True)),
+                ('high_water_mark', models.DateTimeField(null=True)),
+                ('last_cdms_pk', models.CharField(blank=True, max_length=255)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
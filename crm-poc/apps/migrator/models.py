@@ -1,9 +1,22 @@
+import logging
+
+from collections import Counter
 from contextlib import ContextDecorator
 
+from django.conf import settings
 from django.db import models, transaction
+from django.utils import timezone
 
 from core.lib_models import TimeStampedModel
 
+from cdms_api.exceptions import CDMSConflictException
+
+logger = logging.getLogger('migrator')
+
+
+# number of cdms writes sent ('sent') and skipped as no mapped field changed ('avoided')
+cdms_write_counters = Counter()
+
 
 class override_skip_cdms(ContextDecorator):
     """
@@ -27,22 +40,113 @@ class override_skip_cdms(ContextDecorator):
 
 class CDMSModel(TimeStampedModel):
     cdms_pk = models.CharField(max_length=255, blank=True)
+    cdms_etag = models.CharField(max_length=255, blank=True)  # etag of the cdms obj when last refreshed
 
     cdms_migrator = None  # should be subclass of migrator.cdms_migrator.BaseCDMSMigrator
 
     def __init__(self, *args, **kwargs):
         super(CDMSModel, self).__init__(*args, **kwargs)
         self._cdms_skip = False
+        self._cdms_originals = None
+        self._cdms_noop_save = False
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        obj = super(CDMSModel, cls).from_db(db, field_names, values)
+        obj._set_cdms_originals()
+        return obj
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(CDMSModel, self).refresh_from_db(*args, **kwargs)
+        self._set_cdms_originals()
+
+    @classmethod
+    def _get_cdms_tracked_fields(cls):
+        """
+        Returns the list of (name, attname) of the mapped fields, modified excluded
+        as it changes on every save.
+        """
+        tracked_fields = cls.__dict__.get('_cdms_tracked_fields')
+        if tracked_fields is None:
+            tracked_fields = tuple(
+                (field_plan.name, cls._meta.get_field(field_plan.name).attname)
+                for field_plan in cls.cdms_migrator.get_plan(cls)
+                if field_plan.name != 'modified'
+            )
+            cls._cdms_tracked_fields = tracked_fields
+        return tracked_fields
+
+    def _set_cdms_originals(self):
+        # deferred fields are not loaded and so not tracked
+        self._cdms_originals = {
+            name: self.__dict__[attname]
+            for name, attname in self._get_cdms_tracked_fields()
+            if attname in self.__dict__
+        }
+
+    def get_dirty_fields(self):
+        """
+        Returns the dict of mapped field name -> original value of the mapped fields changed since
+        the obj was loaded or last saved, all of them (with original value None) if it was never saved.
+        """
+        tracked_fields = self._get_cdms_tracked_fields()
+        if self._cdms_originals is None:
+            return {name: None for name, _ in tracked_fields}
+
+        dirty_fields = {}
+        for name, attname in tracked_fields:
+            if attname not in self.__dict__:
+                continue
+            original = self._cdms_originals.get(name)
+            if name not in self._cdms_originals or original != self.__dict__[attname]:
+                dirty_fields[name] = original
+        return dirty_fields
 
     def save(self, *args, **kwargs):
         overriding_skip_cdms = kwargs.pop('skip_cdms', self._cdms_skip)
         with override_skip_cdms(self, overriding_skip_cdms):
-            return super(CDMSModel, self).save(*args, **kwargs)
+            # nothing to send to cdms if no mapped field changed
+            self._cdms_noop_save = (
+                not self._cdms_skip and not self._state.adding and
+                self._cdms_originals is not None and not self.get_dirty_fields()
+            )
+            self._modified_before_save = self.modified
+            try:
+                ret = super(CDMSModel, self).save(*args, **kwargs)
+            except CDMSConflictException as e:
+                try:
+                    e.conflicting_fields = self._get_cdms_conflicting_fields()
+                except Exception:
+                    # e.g. deleted in cdms meanwhile, the conflict is still what the caller needs to know
+                    logger.exception('Could not get the conflicting fields of %s' % self)
+                    e.conflicting_fields = None
+                raise
+            finally:
+                self._cdms_noop_save = False
+            self._set_cdms_originals()
+            return ret
+
+    def _get_cdms_conflicting_fields(self):
+        from .query import GetQuery
+
+        query = GetQuery(self.__class__)
+        query.set_cdms_pk(self.cdms_pk)
+        cdms_data = query.get_compiler().execute()
+        return self.cdms_migrator.get_conflicting_fields(self, cdms_data)
+
+    def _is_write_behind(self):
+        return not self._cdms_skip and settings.CDMS_WRITE_BEHIND
 
     def _do_insert(self, manager, using, fields, update_pk, raw):
-        if self._cdms_skip:
+        write_behind = self._is_write_behind()
+        if self._cdms_skip or write_behind:
             manager = manager.skip_cdms()
-        return super(CDMSModel, self)._do_insert(manager, using, fields, update_pk, raw)
+        ret = super(CDMSModel, self)._do_insert(manager, using, fields, update_pk, raw)
+
+        if write_behind:
+            from .outbox import enqueue
+            enqueue(self.__class__, OutboxEntry.CREATE, ret)
+        return ret
 
     def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
         """
@@ -53,10 +157,26 @@ class CDMSModel(TimeStampedModel):
         NOTE: this is copy/paste from Django +
         - cmd_skip if requested
         - call to _update_with_modified instead of _update to make clear that it's a new method not the
-            django one
+            django one, only the dirty mapped fields are sent to cdms
+        - outbox entry if using write-behind
+        - no cdms call nor outbox entry if no mapped field changed
         """
-        if self._cdms_skip:
+        write_behind = self._is_write_behind()
+        if self._cdms_noop_save:
+            # local only fields can still have changed but modified has to stay the cdms one
+            cdms_write_counters['avoided'] += 1
+            write_behind = False
+            base_qs = base_qs.skip_cdms()
+            values = [value for value in values if value[0].name != 'modified']
+            self.modified = self._modified_before_save
+        elif self._cdms_skip or write_behind:
             base_qs = base_qs.skip_cdms()
+        else:
+            cdms_write_counters['sent'] += 1
+
+        cdms_field_names = None
+        if self._cdms_originals is not None:
+            cdms_field_names = set(self.get_dirty_fields())
 
         filtered = base_qs.filter(pk=pk_val)
         if not values:
@@ -75,16 +195,26 @@ class CDMSModel(TimeStampedModel):
                 # successfully (a row is matched and updated). In order to
                 # distinguish these two cases, the object's existence in the
                 # database is again checked for if the UPDATE query returns 0.
-                n_records, modified = filtered._update_with_modified(values)
+                n_records, modified, etag = filtered._update_with_modified(values, cdms_field_names)
                 if modified:
                     self.modified = modified
+                    self.cdms_etag = etag
+
+                if write_behind and n_records:
+                    from .outbox import enqueue
+                    enqueue(self.__class__, OutboxEntry.UPDATE, pk_val)
                 return n_records > 0 or filtered.exists()
             else:
                 return False
 
-        n_records, modified = filtered._update_with_modified(values)
+        n_records, modified, etag = filtered._update_with_modified(values, cdms_field_names)
         if modified:
             self.modified = modified
+            self.cdms_etag = etag
+
+        if write_behind and n_records:
+            from .outbox import enqueue
+            enqueue(self.__class__, OutboxEntry.UPDATE, pk_val)
         return n_records > 0
 
     def _do_delete_cdms_obj(self):
@@ -105,12 +235,98 @@ class CDMSModel(TimeStampedModel):
         overriding_skip_cdms = kwargs.pop('skip_cdms', self._cdms_skip)
         with override_skip_cdms(self, overriding_skip_cdms):
             with transaction.atomic():
+                pk = self.pk
+                cdms_pk = self.cdms_pk
+                if self._is_write_behind() and not cdms_pk:
+                    # the outbox worker might be creating the cdms obj right now, locking the row
+                    # makes it write back the cdms_pk either before this read or after the delete
+                    # entry is queued (see OutboxWorker.write_back)
+                    cdms_pk = self.__class__.objects.skip_cdms().select_for_update().filter(
+                        pk=pk
+                    ).values_list('cdms_pk', flat=True).first() or ''
+
                 ret = super(CDMSModel, self).delete(*args, **kwargs)
 
-                if not self._cdms_skip:
+                if self._is_write_behind():
+                    from .outbox import enqueue
+                    enqueue(self.__class__, OutboxEntry.DELETE, pk, cdms_pk=cdms_pk)
+                elif not self._cdms_skip:
                     self._do_delete_cdms_obj()
 
         return ret
 
     class Meta:
         abstract = True
+
+
+class SyncState(models.Model):
+    """
+    Progress of the cdms_sync management command for one CDMSModel subclass.
+
+    All the cdms objs ordered by (ModifiedOn, id) up to (`high_water_mark`, `last_cdms_pk`)
+    have been synced.
+    """
+    model_label = models.CharField(max_length=255, unique=True)
+    high_water_mark = models.DateTimeField(null=True)
+    last_cdms_pk = models.CharField(max_length=255, blank=True)
+
+    modified = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.model_label
+
+
+class OutboxEntry(models.Model):
+    """
+    CDMS change not sent yet when using write-behind (settings.CDMS_WRITE_BEHIND).
+
+    Entries are created in the same transaction as the local change and sent to CDMS
+    by the cdms_outbox management command, in order for each local obj.
+
+    As the local obj is only read when sending, updates following a pending create/update
+    of the same obj are merged into that entry instead of creating new ones.
+    """
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    VERB_CHOICES = (
+        (CREATE, 'Create'),
+        (UPDATE, 'Update'),
+        (DELETE, 'Delete'),
+    )
+
+    model_label = models.CharField(max_length=255)
+    object_id = models.IntegerField()
+    cdms_pk = models.CharField(max_length=255, blank=True)  # only needed for deletes
+    verb = models.CharField(max_length=10, choices=VERB_CHOICES)
+
+    coalesced = models.PositiveIntegerField(default=0)  # number of later changes merged into this one
+
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_on = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        index_together = [('model_label', 'object_id')]
+
+    def __str__(self):
+        return '{0} {1} {2}'.format(self.verb, self.model_label, self.object_id)
+
+    @classmethod
+    def get_pending_object_ids(cls, model, object_ids):
+        """
+        Returns the set of `object_ids` with changes not sent to cdms yet.
+        Used by the refresh logic so that pending local changes don't get
+        overridden by older cdms values.
+        """
+        if not settings.CDMS_WRITE_BEHIND or not object_ids:
+            return set()
+
+        return set(
+            cls.objects.filter(
+                model_label=model._meta.label, object_id__in=object_ids
+            ).values_list('object_id', flat=True)
+        )
@@ -0,0 +1,87 @@
+from django.db.migrations.operations.base import Operation
+
+from migrator.exceptions import DuplicateCDMSPkException
+
+
+DUPLICATE_CDMS_PKS_SQL = (
+    "SELECT {column} FROM {table} WHERE {column} <> '' "
+    "GROUP BY {column} HAVING COUNT(*) > 1 ORDER BY {column}"
+)
+CREATE_CDMS_PK_INDEX_SQL = "CREATE UNIQUE INDEX {name} ON {table} ({column}) WHERE {column} <> ''"
+DELETE_CDMS_PK_INDEX_SQL = "DROP INDEX IF EXISTS {name}"
+
+
+def _get_cdms_pk_index_params(schema_editor, model):
+    return {
+        'name': schema_editor.quote_name('{0}_cdms_pk_uniq'.format(model._meta.db_table)),
+        'table': schema_editor.quote_name(model._meta.db_table),
+        'column': schema_editor.quote_name(model._meta.get_field('cdms_pk').column),
+    }
+
+
+def get_duplicate_cdms_pks(schema_editor, model):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            DUPLICATE_CDMS_PKS_SQL.format(**_get_cdms_pk_index_params(schema_editor, model))
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def create_cdms_pk_index(schema_editor, model):
+    """
+    Raises DuplicateCDMSPkException listing the duplicate cdms_pks if more than one local
+    obj points to the same cdms obj as the index could not be created.
+    They are not deleted automatically as other objs might reference them, they have to be
+    merged by hand before running the migration again.
+    """
+    duplicate_cdms_pks = get_duplicate_cdms_pks(schema_editor, model)
+    if duplicate_cdms_pks:
+        raise DuplicateCDMSPkException(
+            'Cannot add the unique index on {0}.cdms_pk, these cdms_pks are used by more than one '
+            'obj: {1}'.format(model._meta.label, ', '.join(duplicate_cdms_pks))
+        )
+
+    schema_editor.execute(
+        CREATE_CDMS_PK_INDEX_SQL.format(**_get_cdms_pk_index_params(schema_editor, model))
+    )
+
+
+def delete_cdms_pk_index(schema_editor, model):
+    schema_editor.execute(
+        DELETE_CDMS_PK_INDEX_SQL.format(**_get_cdms_pk_index_params(schema_editor, model))
+    )
+
+
+class AddCDMSPkUniqueIndex(Operation):
+    """
+    Adds a unique index on cdms_pk ignoring empty values as local objs
+    not saved to cdms yet don't have any.
+
+    It's used by all the lookups by cdms_pk and it's required by the upsert
+    refresh path (see settings.CDMS_REFRESH_UPSERT).
+    Only postgres supports partial indexes so this is a noop on other dbs.
+    The migration aborts listing the duplicate cdms_pks if there are any,
+    see create_cdms_pk_index.
+    """
+    reversible = True
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def state_forwards(self, app_label, state):
+        pass
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor == 'postgresql' and \
+                self.allow_migrate_model(schema_editor.connection.alias, model):
+            create_cdms_pk_index(schema_editor, model)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if schema_editor.connection.vendor == 'postgresql' and \
+                self.allow_migrate_model(schema_editor.connection.alias, model):
+            delete_cdms_pk_index(schema_editor, model)
+
+    def describe(self):
+        return 'Add unique index on cdms_pk to {0}'.format(self.model_name)
@@ -0,0 +1,185 @@
+import logging
+import datetime
+import traceback
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from cdms_api.exceptions import CDMSNotFoundException
+
+from .models import OutboxEntry
+from .query import InsertQuery, UpdateQuery, DeleteQuery
+
+logger = logging.getLogger('migrator')
+
+
+def enqueue(model, verb, object_id, cdms_pk=''):
+    """
+    Adds an outbox entry for the local obj `object_id` of `model` and returns it.
+
+    Updates get merged into the last pending create/update of the same obj if present,
+    new entries are due after settings.CDMS_OUTBOX_COALESCE_WINDOW seconds so that
+    changes in quick succession get sent once.
+    """
+    model_label = model._meta.label
+    if verb == OutboxEntry.UPDATE:
+        last_entry = OutboxEntry.objects.filter(model_label=model_label, object_id=object_id).last()
+        if last_entry and last_entry.verb in (OutboxEntry.CREATE, OutboxEntry.UPDATE):
+            merged = OutboxEntry.objects.filter(pk=last_entry.pk).update(coalesced=F('coalesced') + 1)
+            if merged:
+                return last_entry
+            # sent and deleted by the worker in the meantime
+
+    return OutboxEntry.objects.create(
+        model_label=model_label,
+        object_id=object_id,
+        cdms_pk=cdms_pk or '',
+        verb=verb,
+        next_attempt_on=timezone.now() + datetime.timedelta(seconds=settings.CDMS_OUTBOX_COALESCE_WINDOW)
+    )
+
+
+class OutboxWorker(object):
+    """
+    Sends the outbox entries to cdms.
+
+    Entries of the same local obj are sent in order: only the oldest one is considered
+    and if that fails, it's retried later with exponential backoff (max
+    settings.CDMS_OUTBOX_MAX_BACKOFF seconds) and the following ones wait.
+
+    The cdms calls happen outside of db transactions, the local obj (cdms_pk, modified and
+    cdms_etag) is then updated and the entry deleted in the same transaction unless other
+    changes got merged into it in the meantime, in which case it's kept and sent again as update.
+
+    `coalesced` counts the cdms writes saved by merging entries.
+
+    NOTE: only one worker should run at any time.
+    """
+    def __init__(self):
+        self.coalesced = 0
+
+    def get_next_entries(self):
+        """
+        Returns the oldest entry of each local obj if due, settings.CDMS_OUTBOX_BATCH_SIZE max.
+        """
+        heads = OutboxEntry.objects.order_by(
+            'model_label', 'object_id', 'pk'
+        ).distinct('model_label', 'object_id').values('pk')
+
+        return list(
+            OutboxEntry.objects.filter(
+                pk__in=heads, next_attempt_on__lte=timezone.now()
+            ).order_by('pk')[:settings.CDMS_OUTBOX_BATCH_SIZE]
+        )
+
+    def get_local_obj(self, model, entry):
+        return model.objects.skip_cdms().filter(pk=entry.object_id).first()
+
+    def write_back(self, model, entry, **values):
+        with transaction.atomic():
+            if values:
+                model.objects.skip_cdms().filter(pk=entry.object_id).update(**values)
+
+            if values.get('cdms_pk'):
+                # the obj got deleted while creating the cdms obj, the delete needs its cdms_pk
+                OutboxEntry.objects.filter(
+                    model_label=entry.model_label, object_id=entry.object_id, cdms_pk=''
+                ).exclude(pk=entry.pk).update(cdms_pk=values['cdms_pk'])
+
+            deleted, _ = OutboxEntry.objects.filter(pk=entry.pk, coalesced=entry.coalesced).delete()
+            if not deleted:
+                # changes merged in the meantime still to be sent
+                OutboxEntry.objects.filter(pk=entry.pk).update(verb=OutboxEntry.UPDATE)
+
+    def process_create(self, model, entry):
+        obj = self.get_local_obj(model, entry)
+        if not obj:
+            # deleted in the meantime
+            self.write_back(model, entry)
+            return
+
+        if obj.cdms_pk:
+            # already in cdms, only the changes merged into this entry need sending
+            self.process_update(model, entry)
+            return
+
+        query = InsertQuery(model)
+        query.insert_value(obj)
+        compiler = query.get_compiler()
+        cdms_pk, modified_on = compiler.execute()
+
+        self.write_back(model, entry, cdms_pk=cdms_pk, modified=modified_on, cdms_etag=compiler.etag)
+
+    def process_update(self, model, entry):
+        obj = self.get_local_obj(model, entry)
+        if not obj:
+            self.write_back(model, entry)
+            return
+
+        if not obj.cdms_pk:
+            # created before write-behind got enabled
+            self.process_create(model, entry)
+            return
+
+        query = UpdateQuery(model)
+        query.add_update_fields(
+            obj.cdms_pk,
+            [(field.name, getattr(obj, field.name)) for field in obj._meta.fields]
+        )
+        compiler = query.get_compiler()
+        modified_on = compiler.execute()
+
+        self.write_back(model, entry, modified=modified_on, cdms_etag=compiler.etag)
+
+    def process_delete(self, model, entry):
+        if entry.cdms_pk:
+            query = DeleteQuery(model)
+            query.set_cdms_pk(entry.cdms_pk)
+            try:
+                query.get_compiler().execute()
+            except CDMSNotFoundException:
+                pass
+
+        self.write_back(model, entry)
+
+    def process(self, entry):
+        """
+        Sends `entry` to cdms and returns True if it succeeded.
+        """
+        model = apps.get_model(entry.model_label)
+        try:
+            getattr(self, 'process_{0}'.format(entry.verb))(model, entry)
+        except Exception:
+            logger.exception('Could not send %s to cdms' % entry)
+
+            entry.attempts += 1
+            entry.last_error = traceback.format_exc()
+            entry.next_attempt_on = timezone.now() + datetime.timedelta(
+                seconds=min(2 ** entry.attempts, settings.CDMS_OUTBOX_MAX_BACKOFF)
+            )
+            # not save() as it would override `coalesced` if changes got merged in the meantime
+            OutboxEntry.objects.filter(pk=entry.pk).update(
+                attempts=entry.attempts,
+                last_error=entry.last_error,
+                next_attempt_on=entry.next_attempt_on
+            )
+            return False
+
+        self.coalesced += entry.coalesced
+        return True
+
+    def drain(self):
+        """
+        Sends all the due entries and returns the number of the ones sent successfully.
+        """
+        tot = 0
+        while True:
+            entries = self.get_next_entries()
+            sent = sum(self.process(entry) for entry in entries)
+            tot += sent
+            if not sent:
+                break
+        return tot
@@ -1,8 +1,17 @@
 import sys
+import copy
+import collections
+import itertools
+import time
+import logging
 import warnings
 import datetime
 
-from django.db import transaction, models
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import transaction, models, connections, IntegrityError
+from django.db.models import Case, When, Value, F, Q, AutoField
 from django.db.models.sql.query import get_field_names_from_opts, get_order_dir
 from django.db.models.constants import LOOKUP_SEP
 from django.utils.tree import Node
@@ -10,10 +19,29 @@ from django.utils import timezone
 from django.core.exceptions import FieldDoesNotExist, FieldError
 
 from cdms_api import api as cdms_conn
+from cdms_api.utils import cdms_datetimes_to_datetimes
 
-from .models import CDMSModel
+from .models import CDMSModel, OutboxEntry
 from .exceptions import NotMappingFieldException
-from .lookups import FilterNode, Lookup
+from .lookups import FilterNode, Lookup, GuidLookup
+
+logger = logging.getLogger('migrator')
+
+
+@contextmanager
+def timed_atomic(name):
+    """
+    Same as transaction.atomic() but logs for how long the transaction stayed open,
+    the seconds are also passed as `transaction_seconds` in the log record.
+    """
+    started_at = time.time()
+    with transaction.atomic():
+        yield
+    seconds = time.time() - started_at
+    logger.debug(
+        '%s transaction open for %.3fs' % (name, seconds),
+        extra={'transaction_seconds': seconds}
+    )
 
 
 class CDMSCompiler(object):
@@ -26,14 +54,37 @@ class CDMSCompiler(object):
     def get_migrator(self):
         return self.query.model.cdms_migrator
 
+    def get_select(self):
+        """
+        Returns the list of cdms fields to request or None if all of them are needed.
+        """
+        if self.query.select_all:
+            return None
+        if self.query.select:
+            return self.query.select
+        return self.get_migrator().select_fields
+
     def execute(self):
         raise NotImplementedError()
 
 
 class CDMSSelectCompiler(CDMSCompiler):
+    page_size = 50  # max number of results returned by CDMS in one page
+
     def get_filters(self):
         return self.query.filters.as_filter_string()
 
+    def get_cdms_name(self, field_name):
+        """
+        Returns the cdms name of `field_name`, cdms_pk and created included even if not mapped.
+        """
+        migrator = self.get_migrator()
+        if field_name == 'cdms_pk':
+            return migrator.get_cdms_pk_name()
+        if field_name == 'created':
+            return 'CreatedOn'
+        return migrator.get_cdms_field(field_name).cdms_name
+
     def get_order_by(self):
         cdms_orderby = []
 
@@ -49,37 +100,154 @@ class CDMSSelectCompiler(CDMSCompiler):
                 )
                 ordering = ['modified']
 
+        default_order = 'ASC' if self.query.standard_ordering else 'DESC'
         for field in ordering:
-            col, order = get_order_dir(field, 'ASC')
+            col, order = get_order_dir(field, default_order)
             try:
-                cdms_field = self.get_migrator().get_cdms_field(col)
+                cdms_name = self.get_cdms_name(col)
             except NotMappingFieldException:
                 raise NotImplementedError(
                     'Cannot order by {0}, only ordering by direct fields currently implemented'.format(col)
                 )
 
             cdms_orderby.append(
-                '{0} {1}'.format(cdms_field.cdms_name, order.lower())
+                '{0} {1}'.format(cdms_name, order.lower())
             )
         return cdms_orderby
 
+    def get_prefetch(self):
+        return settings.CDMS_LIST_PREFETCH
+
     def execute(self):
         if self.query.empty:
             return []
 
-        return cdms_conn.list(
+        limit = None
+        if self.query.high_mark is not None:
+            limit = self.query.high_mark - self.query.low_mark
+            if limit <= 0:
+                return []
+
+            if limit <= self.page_size:
+                # the whole window fits in one single page
+                return cdms_conn.list(
+                    self.get_service(),
+                    top=limit,
+                    skip=self.query.low_mark,
+                    select=self.get_select(),
+                    filters=self.get_filters(),
+                    order_by=self.get_order_by()
+                )
+
+        return cdms_conn.iter_list(
             self.get_service(),
+            skip=self.query.low_mark,
+            limit=limit,
+            select=self.get_select(),
             filters=self.get_filters(),
-            order_by=self.get_order_by()
+            order_by=self.get_order_by(),
+            prefetch=self.get_prefetch()
+        )
+
+
+class CDMSProbeSelectCompiler(CDMSSelectCompiler):
+    """
+    Two-phase version of CDMSSelectCompiler used to refresh the local objs:
+        1. only the id and ModifiedOn of the cdms objs matching the query are requested
+        2. the full data is requested, `chunk_size` guids at a time, only for
+           the cdms objs new or more recent than the local ones
+
+    Returns the cdms data of the cdms objs to refresh only, in the query order.
+    """
+    chunk_size = 25  # guids per request, keeps the url length reasonable
+
+    def get_probes(self):
+        migrator = self.get_migrator()
+        probe_query = self.query.clone()
+        probe_query.set_select([migrator.get_cdms_pk_name(), 'ModifiedOn'])
+        page = list(CDMSSelectCompiler(probe_query).execute())
+        return list(zip(
+            [migrator.get_cdms_pk(cdms_data) for cdms_data in page],
+            cdms_datetimes_to_datetimes(cdms_data['ModifiedOn'] for cdms_data in page)
+        ))
+
+    def get_stale_cdms_pks(self, probes):
+        local_modified_ons = dict(
+            self.query.model.objects.skip_cdms().filter(
+                cdms_pk__in=[cdms_pk for cdms_pk, _ in probes]
+            ).values_list('cdms_pk', 'modified')
+        )
+
+        stale_cdms_pks = []
+        for cdms_pk, modified_on in probes:
+            local_modified_on = local_modified_ons.get(cdms_pk)
+            if local_modified_on is None or local_modified_on < modified_on:
+                stale_cdms_pks.append(cdms_pk)
+        return stale_cdms_pks
+
+    def get_chunk(self, cdms_pks):
+        migrator = self.get_migrator()
+
+        query = CDMSQuery(self.query.model)
+        query.set_select(self.query.select)
+        query.select_all = self.query.select_all
+        filters = FilterNode(connector=Lookup.OR)
+        for cdms_pk in cdms_pks:
+            filters.add(GuidLookup(migrator.get_cdms_pk_name(), 'exact', cdms_pk), Lookup.OR)
+        query.filters.add(filters, Lookup.AND)
+        query.add_ordering('cdms_pk')
+        query.set_limits(0, len(cdms_pks))
+        return CDMSSelectCompiler(query).execute()
+
+    def execute(self):
+        """
+        The ids of all the cdms objs matching the query, stale or not, are available
+        as `self.cdms_pks` afterwards.
+        """
+        self.cdms_pks = []
+        if self.query.empty:
+            return []
+
+        probes = self.get_probes()
+        self.cdms_pks = [cdms_pk for cdms_pk, _ in probes]
+        if not probes:
+            return []
+
+        return self.iter_stale_cdms_data(self.get_stale_cdms_pks(probes))
+
+    def iter_stale_cdms_data(self, stale_cdms_pks):
+        migrator = self.get_migrator()
+        for index in range(0, len(stale_cdms_pks), self.chunk_size):
+            chunk = stale_cdms_pks[index:index + self.chunk_size]
+            cdms_data_by_pk = {
+                migrator.get_cdms_pk(cdms_data): cdms_data for cdms_data in self.get_chunk(chunk)
+            }
+            for cdms_pk in chunk:
+                if cdms_pk in cdms_data_by_pk:
+                    yield cdms_data_by_pk[cdms_pk]
+
+
+class CDMSCountCompiler(CDMSSelectCompiler):
+    def execute(self):
+        if self.query.empty:
+            return 0
+
+        return cdms_conn.count(
+            self.get_service(),
+            filters=self.get_filters()
         )
 
 
 class CDMSInsertCompiler(CDMSCompiler):
     def execute(self):
+        """
+        Returns the cdms_pk and ModifiedOn of the new cdms obj, its etag is available as `self.etag`.
+        """
         data = self.get_migrator().clean_up_cdms_data_before_changes(self.query.cdms_data)
         results = cdms_conn.create(
             self.get_service(), data=data
         )
+        self.etag = self.get_migrator().get_etag(results)
         return (
             self.get_migrator().get_cdms_pk(results),
             self.get_migrator().get_modified_on(results)
@@ -90,18 +258,33 @@ class CDMSGetCompiler(CDMSCompiler):
     def execute(self):
         return cdms_conn.get(
             self.get_service(),
-            guid=self.query.cdms_pk
+            guid=self.query.cdms_pk,
+            select=self.get_select()
         )
 
 
 class CDMSUpdateCompiler(CDMSCompiler):
     def execute(self):
+        """
+        Returns the new ModifiedOn of the cdms obj, its new etag is available as `self.etag`.
+        """
         data = self.get_migrator().clean_up_cdms_data_before_changes(self.query.cdms_data)
-        results = cdms_conn.update(
-            self.get_service(),
-            guid=self.query.cdms_pk,
-            data=data
-        )
+        if self.query.etag:
+            # conditional MERGE, raises CDMSConflictException if the cdms obj changed in the meantime
+            results = cdms_conn.partial_update(
+                self.get_service(),
+                guid=self.query.cdms_pk,
+                data=data,
+                if_match=self.query.etag
+            )
+        else:
+            update = cdms_conn.partial_update if self.query.partial else cdms_conn.update
+            results = update(
+                self.get_service(),
+                guid=self.query.cdms_pk,
+                data=data
+            )
+        self.etag = self.get_migrator().get_etag(results)
         return self.get_migrator().get_modified_on(results)
 
 
@@ -130,6 +313,10 @@ class CDMSRefreshCompiler(CDMSGetCompiler):
         cdms_data = self.get_cdms_data()
         obj, new_obj = self.get_local_obj()
 
+        # local changes not sent to cdms yet win
+        if not new_obj and OutboxEntry.get_pending_object_ids(self.query.model, [obj.pk]):
+            return obj
+
         # check if local obj has to be updated
         changed, modified_on, created_on = migrator.has_cdms_obj_changed(obj, cdms_data)
         if changed:
@@ -144,6 +331,8 @@ class CDMSRefreshCompiler(CDMSGetCompiler):
             update_fields = {}
             obj.modified = modified_on
             update_fields['modified'] = modified_on
+            obj.cdms_etag = migrator.get_etag(cdms_data)
+            update_fields['cdms_etag'] = obj.cdms_etag
 
             if new_obj:
                 obj.created = created_on
@@ -155,6 +344,287 @@ class CDMSRefreshCompiler(CDMSGetCompiler):
         return obj
 
 
+class CDMSBulkRefreshCompiler(CDMSCompiler):
+    """
+    Set-based version of CDMSRefreshCompiler, refreshes the local objs of a list of cdms objs
+    with a constant number of local queries instead of 3 per obj:
+        - one select of the existing local objs by cdms_pk
+        - one bulk insert of the new local objs + one select to get their pks, within a savepoint
+        - one update of all the changed local objs, new ones included as
+          their modified values get overridden by the insert
+    """
+    def get_local_objs(self, cdms_pks):
+        local_objs = {}
+        for obj in self.query.model.objects.skip_cdms().filter(cdms_pk__in=cdms_pks):
+            local_objs.setdefault(obj.cdms_pk, obj)  # as CDMSRefreshCompiler, the first one wins
+        return local_objs
+
+    def check_related_objs(self, obj):
+        """
+        Same check as Model.save, bulk_create and the bulk UPDATE would otherwise
+        silently write NULL for related objs not existing locally.
+        """
+        for field in obj._meta.concrete_fields:
+            if field.is_relation:
+                related_obj = getattr(obj, field.name, None)
+                if related_obj and related_obj.pk is None:
+                    raise ValueError(
+                        "save() prohibited to prevent data loss due to "
+                        "unsaved related object '%s'." % field.name
+                    )
+
+    def bulk_insert(self, objs):
+        manager = self.query.model.objects
+
+        # bulk_create doesn't set the pks and overrides the modified values
+        modified_ons = [obj.modified for obj in objs]
+        try:
+            manager.skip_cdms().bulk_create(objs)
+        finally:
+            for obj, modified_on in zip(objs, modified_ons):
+                obj.modified = modified_on
+
+        pks = dict(
+            manager.skip_cdms().filter(
+                cdms_pk__in=[obj.cdms_pk for obj in objs]
+            ).values_list('cdms_pk', 'pk')
+        )
+        for obj in objs:
+            self.set_pk(obj, pks[obj.cdms_pk])
+
+    def set_pk(self, obj, pk):
+        obj.pk = pk
+        obj._state.adding = False
+        obj._state.db = self.query.model.objects.db
+
+    def insert_new_objs(self):
+        """
+        Inserts the new objs, the ones inserted by somebody else since `prepare` are
+        updated instead (see `bulk_update`).
+        """
+        try:
+            with transaction.atomic():
+                self.bulk_insert(self.new_objs)
+        except IntegrityError:
+            local_objs = self.get_local_objs([obj.cdms_pk for obj in self.new_objs])
+            new_objs = []
+            for obj in self.new_objs:
+                local_obj = local_objs.get(obj.cdms_pk)
+                if local_obj:
+                    self.set_pk(obj, local_obj.pk)
+                    self.changed_objs.append(obj)
+                else:
+                    new_objs.append(obj)
+            self.new_objs = new_objs
+            if new_objs:
+                self.bulk_insert(new_objs)
+
+    def bulk_update(self, objs, new_objs=()):
+        """
+        Updates the mapped fields and the modified value of `objs` with one single UPDATE query
+        (UPDATE ... SET field = CASE WHEN id = ... THEN ... END WHERE id IN (...)).
+
+        Objs not in `new_objs` are only updated if their local modified is still older than the
+        cdms one so that local changes saved since `prepare` don't get overridden.
+        """
+        model = self.query.model
+        migrator = self.get_migrator()
+        fields = [
+            field for field in model._meta.concrete_fields
+            if field.name in migrator.all_fields or field.name == 'cdms_etag'
+        ]
+
+        new_pks = {obj.pk for obj in new_objs}
+        conditions = [
+            Q(pk=obj.pk) if obj.pk in new_pks else Q(pk=obj.pk, modified__lt=obj.modified)
+            for obj in objs
+        ]
+        model.objects.skip_cdms().filter(pk__in=[obj.pk for obj in objs]).update(**{
+            field.name: Case(
+                *[
+                    When(condition, then=Value(getattr(obj, field.attname)))
+                    for obj, condition in zip(objs, conditions)
+                ],
+                default=F(field.name),
+                output_field=field
+            )
+            for field in fields
+        })
+
+    def prepare(self):
+        """
+        Reads the local objs and converts the cdms data without writing anything,
+        returns the list of local objs. The changes get written by `apply`.
+        """
+        model = self.query.model
+        migrator = self.get_migrator()
+        cdms_data_list = self.query.cdms_data_list
+        self.new_objs, self.changed_objs = [], []
+        if not cdms_data_list:
+            return []
+
+        # fields only get converted when read, i.e. all of them for changed objs only
+        rows = migrator.get_rows(model, cdms_data_list)
+        local_objs = self.get_local_objs([row.cdms_pk for row in rows])
+
+        # local changes not sent to cdms yet win
+        pending_object_ids = OutboxEntry.get_pending_object_ids(
+            model, [obj.pk for obj in local_objs.values()]
+        )
+
+        objs, new_objs, changed_objs = [], self.new_objs, self.changed_objs
+        for row in rows:
+            cdms_pk = row.cdms_pk
+            obj = local_objs.get(cdms_pk)
+            new_obj = obj is None
+            if not new_obj and obj.pk in pending_object_ids:
+                objs.append(obj)
+                continue
+
+            if new_obj:
+                obj = model()
+                obj.modified = timezone.now() - datetime.timedelta(days=(50 * 365))
+                obj.created = obj.modified
+
+            # check if local obj has to be updated
+            if migrator.has_row_changed(obj, row):
+                migrator.update_local_from_row(
+                    obj, row,
+                    cdms_known_related_objects=self.query.cdms_known_related_objects
+                )
+                obj.cdms_etag = migrator.get_etag(row.cdms_data)
+                self.check_related_objs(obj)
+
+                if new_obj:
+                    obj.created = row.created
+                    obj.cdms_pk = cdms_pk
+                    local_objs[cdms_pk] = obj
+                    new_objs.append(obj)
+                elif not any(obj is changed_obj for changed_obj in changed_objs):
+                    changed_objs.append(obj)
+            objs.append(obj)
+        return objs
+
+    def discard(self, cdms_pk):
+        """
+        Drops the changes prepared for the cdms obj `cdms_pk`, e.g. because a more recent
+        version of it gets written after.
+        """
+        self.new_objs = [obj for obj in self.new_objs if obj.cdms_pk != cdms_pk]
+        self.changed_objs = [obj for obj in self.changed_objs if obj.cdms_pk != cdms_pk]
+
+    def apply(self):
+        if self.new_objs:
+            self.insert_new_objs()
+        if self.new_objs or self.changed_objs:
+            self.bulk_update(self.new_objs + self.changed_objs, new_objs=self.new_objs)
+
+    def execute(self):
+        objs = self.prepare()
+        with transaction.atomic():
+            self.apply()
+        return objs
+
+
+class CDMSUpsertRefreshCompiler(CDMSBulkRefreshCompiler):
+    """
+    Refreshes the local objs of a list of cdms objs with one single statement:
+
+        INSERT ... ON CONFLICT (cdms_pk) DO UPDATE SET ... WHERE modified < EXCLUDED.modified
+
+    so local objs already up-to-date don't get written at all.
+
+    NOTE: local objs more recent than the cdms ones are skipped instead of
+    raising ObjectsNotInSyncException as the other refresh compilers do.
+    """
+    sql = (
+        'INSERT INTO {table} ({columns}) VALUES {values} '
+        'ON CONFLICT ({cdms_pk}) WHERE {cdms_pk} <> \'\' '
+        'DO UPDATE SET {updates} '
+        'WHERE {table}.{modified} < EXCLUDED.{modified}'
+    )
+
+    def build_obj(self, cdms_data):
+        migrator = self.get_migrator()
+        obj = self.query.model()
+        migrator.update_local_from_cdms_data(
+            obj, cdms_data,
+            cdms_known_related_objects=self.query.cdms_known_related_objects
+        )
+        obj.modified = migrator.get_modified_on(cdms_data)
+        obj.created = migrator.get_created_on(cdms_data)
+        obj.cdms_pk = migrator.get_cdms_pk(cdms_data)
+        obj.cdms_etag = migrator.get_etag(cdms_data)
+
+        self.check_related_objs(obj)
+        return obj
+
+    def prepare(self):
+        """
+        Builds the statement without running it, see `apply`.
+        """
+        model = self.query.model
+        migrator = self.get_migrator()
+        connection = connections[model.objects.db]
+        quote_name = connection.ops.quote_name
+        self.statement = None
+
+        # the same row cannot be affected twice by the same statement so only keep the latest
+        objs = {}
+        for cdms_data in self.query.cdms_data_list:
+            obj = self.build_obj(cdms_data)
+            if obj.cdms_pk not in objs or objs[obj.cdms_pk].modified < obj.modified:
+                objs[obj.cdms_pk] = obj
+        if not objs:
+            return list(objs.values())
+
+        fields = [field for field in model._meta.concrete_fields if not isinstance(field, AutoField)]
+        update_fields = [
+            field for field in fields if field.name in migrator.all_fields or field.name == 'cdms_etag'
+        ]
+
+        params = []
+        for obj in objs.values():
+            params.extend(
+                field.get_db_prep_save(getattr(obj, field.attname), connection=connection)
+                for field in fields
+            )
+
+        sql = self.sql.format(
+            table=quote_name(model._meta.db_table),
+            columns=', '.join(quote_name(field.column) for field in fields),
+            values=', '.join(
+                ['({0})'.format(', '.join(['%s'] * len(fields)))] * len(objs)
+            ),
+            cdms_pk=quote_name(model._meta.get_field('cdms_pk').column),
+            updates=', '.join(
+                '{column} = EXCLUDED.{column}'.format(column=quote_name(field.column))
+                for field in update_fields
+            ),
+            modified=quote_name(model._meta.get_field('modified').column)
+        )
+
+        self.statement = (sql, params)
+        return list(objs.values())
+
+    def discard(self, cdms_pk):
+        # noop, the more recent version written after wins anyway as rows only get updated
+        # if older (see `sql`)
+        pass
+
+    def apply(self):
+        if not self.statement:
+            return 0
+
+        with connections[self.query.model.objects.db].cursor() as cursor:
+            cursor.execute(*self.statement)
+            return cursor.rowcount
+
+    def execute(self):
+        self.prepare()
+        return self.apply()
+
+
 class CDMSDeleteCompiler(CDMSGetCompiler):
     def execute(self):
         return cdms_conn.delete(
@@ -164,24 +634,117 @@ class CDMSDeleteCompiler(CDMSGetCompiler):
 
 
 class CDMSModelIterable(models.query.ModelIterable):
+    def iter_cdms_pages(self):
+        """
+        Yields the cdms data of the queryset one page at a time as cdms returns them.
+
+        The ids of the cdms objs in the window are available as `self.cdms_pks`
+        in the cdms order once all the pages have been consumed.
+        """
+        # only get the sliced window from cdms (e.g. qs[20:40] => $skip=20&$top=20)
+        cdms_query = self.queryset.cdms_query.clone()
+        cdms_query.set_limits(self.queryset.query.low_mark, self.queryset.query.high_mark)
+
+        migrator = self.queryset.model.cdms_migrator
+        probe = settings.CDMS_LIST_PROBE
+        compiler = (CDMSProbeSelectCompiler if probe else CDMSSelectCompiler)(cdms_query)
+        cdms_data_iter = iter(compiler.execute())
+
+        cdms_pks = collections.OrderedDict.fromkeys(compiler.cdms_pks if probe else [])
+        while True:
+            page = list(itertools.islice(cdms_data_iter, CDMSSelectCompiler.page_size))
+            if not page:
+                break
+            if not probe:
+                cdms_pks.update((migrator.get_cdms_pk(cdms_data), None) for cdms_data in page)
+            yield page
+        self.cdms_pks = list(cdms_pks)
+
+    def prepare_page(self, cdms_data_list):
+        query = BulkRefreshQuery(self.queryset.model)
+        query.set_cdms_known_related_objects(self.queryset._cdms_known_related_objects)
+        query.set_cdms_data_list(cdms_data_list)
+
+        compiler = query.get_compiler()
+        compiler.prepare()
+        return compiler
+
+    def apply_pages(self, compilers):
+        if not compilers:
+            return
+
+        with timed_atomic('{0} refresh'.format(self.queryset.model._meta.label)):
+            for compiler in compilers:
+                compiler.apply()
+
+    def refresh_local_objs(self):
+        """
+        1. fetches the cdms pages one by one and converts each of them into local changes
+           as soon as it arrives, no transaction open
+        2. writes the changes in one short transaction
+        so that slow cdms responses don't keep db connections and locks busy.
+
+        Only the prepared changes are kept until 2., not the cdms data. As they still grow with
+        the result set, they get written every settings.CDMS_REFRESH_BUFFER_SIZE objs
+        in separate transactions.
+        """
+        migrator = self.queryset.model.cdms_migrator
+
+        # an obj can be returned twice if pages shift while fetching them, only the latest is written
+        modified_ons = {}
+        compilers, buffered_compilers = [], {}
+        for page in self.iter_cdms_pages():
+            cdms_data_by_pk = collections.OrderedDict()
+            for cdms_data in page:
+                cdms_pk = migrator.get_cdms_pk(cdms_data)
+                modified_on = migrator.get_modified_on(cdms_data)
+                if cdms_pk in modified_ons:
+                    if modified_on <= modified_ons[cdms_pk]:
+                        continue
+                    if cdms_pk in buffered_compilers:
+                        buffered_compilers.pop(cdms_pk).discard(cdms_pk)
+                modified_ons[cdms_pk] = modified_on
+                cdms_data_by_pk[cdms_pk] = cdms_data
+
+            compiler = self.prepare_page(list(cdms_data_by_pk.values()))
+            compilers.append(compiler)
+            buffered_compilers.update(dict.fromkeys(cdms_data_by_pk, compiler))
+
+            if len(buffered_compilers) >= settings.CDMS_REFRESH_BUFFER_SIZE:
+                self.apply_pages(compilers)
+                compilers, buffered_compilers = [], {}
+
+        self.apply_pages(compilers)
+
     def __iter__(self):
 
         # NOTE: do keep the sys.exc_info check otherwise django
         # will keep calling this method over and over again when
         # trying to print the 500 error page which is NOT what we want
         if not self.queryset.cdms_skip and not sys.exc_info()[0]:
-            with transaction.atomic():
-                cdms_query = self.queryset.cdms_query
-                results = CDMSSelectCompiler(cdms_query).execute()
+            self.refresh_local_objs()
 
-                for result in results:
-                    query = RefreshQuery(self.queryset.model)
-                    query.set_cdms_known_related_objects(self.queryset._cdms_known_related_objects)
-                    query.set_cdms_data(result)
-                    query.get_compiler().execute()
+            query = self.queryset.query
+            if query.low_mark or query.high_mark is not None:
+                return self.iter_window()
 
         return super(CDMSModelIterable, self).__iter__()
 
+    def iter_window(self):
+        """
+        Returns the local objs of the cdms objs in the window of a sliced queryset,
+        in the cdms order, as cdms already applied $skip/$top and the same LIMIT/OFFSET
+        on the local table would return other objs.
+        """
+        queryset = self.queryset._clone().skip_cdms()
+        queryset.query.clear_limits()
+        queryset = queryset.filter(cdms_pk__in=self.cdms_pks)
+
+        positions = {cdms_pk: position for position, cdms_pk in enumerate(self.cdms_pks)}
+        return iter(sorted(
+            models.query.ModelIterable(queryset), key=lambda obj: positions[obj.cdms_pk]
+        ))
+
 
 class CDMSQuery(object):
     compiler = CDMSCompiler
@@ -194,12 +757,50 @@ class CDMSQuery(object):
         self.cdms_known_related_objects = {}
         self.order_by = []
 
+        self.standard_ordering = True
+        self.low_mark, self.high_mark = 0, None
+
+        # by default only the mapped fields are requested, see CDMSCompiler.get_select
+        self.select_all = False
+        self.select = None
+
+    def clone(self):
+        obj = copy.copy(self)
+        obj.filters = FilterNode(connector=self.filters.connector, negated=self.filters.negated)
+        obj.filters.children = self.filters.children[:]
+        obj.order_by = self.order_by[:]
+        return obj
+
     def set_cdms_known_related_objects(self, cdms_known_related_objects):
         self.cdms_known_related_objects = cdms_known_related_objects
 
     def set_empty(self):
         self.empty = True
 
+    def set_select_all(self):
+        self.select_all = True
+
+    def set_select(self, select):
+        self.select = select
+
+    def set_limits(self, low=None, high=None):
+        """
+        Same as django Query.set_limits, translated into $skip/$top.
+        """
+        if high is not None:
+            if self.high_mark is not None:
+                self.high_mark = min(self.high_mark, self.low_mark + high)
+            else:
+                self.high_mark = self.low_mark + high
+        if low is not None:
+            if self.high_mark is not None:
+                self.low_mark = min(self.high_mark, self.low_mark + low)
+            else:
+                self.low_mark = self.low_mark + low
+
+    def reverse_ordering(self):
+        self.standard_ordering = not self.standard_ordering
+
     def add_q(self, q_object):
         clause = self._add_q(q_object)
         if clause:
@@ -403,14 +1004,25 @@ class UpdateQuery(CDMSQuery):
         self.cdms_pk = None
         self.cdms_data = {}
 
+        # if True, only the mapped values are sent (MERGE) without getting the cdms obj first
+        self.partial = settings.CDMS_PARTIAL_UPDATES
+
+        # if CDMS_CONDITIONAL_UPDATES and the etag of the cdms obj is known, only the mapped values
+        # are sent (MERGE) with If-Match: etag without getting the cdms obj first
+        self.etag = None
+
     def get_cdms_obj(self):
+        # the whole record is needed as it gets PUT back
         query = GetQuery(self.model)
         query.set_cdms_pk(self.cdms_pk)
+        query.set_select_all()
         return query.get_compiler().execute()
 
-    def add_update_fields(self, cdms_pk, values):
+    def add_update_fields(self, cdms_pk, values, etag=None):
         self.cdms_pk = cdms_pk
-        cdms_data = self.get_cdms_obj()
+        if settings.CDMS_CONDITIONAL_UPDATES and etag:
+            self.etag = etag
+        cdms_data = {} if self.partial or self.etag else self.get_cdms_obj()
         self.cdms_data = self.model.cdms_migrator.update_cdms_data_from_values(values, cdms_data)
 
 
@@ -435,5 +1047,24 @@ class RefreshQuery(GetQuery):
         self.cdms_data = cdms_data
 
 
+class BulkRefreshQuery(CDMSQuery):
+    compiler = CDMSBulkRefreshCompiler
+
+    def __init__(self, *args, **kwargs):
+        super(BulkRefreshQuery, self).__init__(*args, **kwargs)
+        self.cdms_data_list = []
+
+        # if True, local objs are written with one single INSERT ... ON CONFLICT statement
+        self.upsert = settings.CDMS_REFRESH_UPSERT
+
+    def set_cdms_data_list(self, cdms_data_list):
+        self.cdms_data_list = cdms_data_list
+
+    def get_compiler(self):
+        if self.upsert:
+            return CDMSUpsertRefreshCompiler(query=self)
+        return super(BulkRefreshQuery, self).get_compiler()
+
+
 class DeleteQuery(GetQuery):
     compiler = CDMSDeleteCompiler
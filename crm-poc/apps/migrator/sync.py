@@ -0,0 +1,308 @@
+import math
+import time
+import logging
+import datetime
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction, connection
+from django.db.models.query_utils import Q
+from django.utils import timezone
+
+from cdms_api.exceptions import CDMSNotFoundException
+
+from .models import CDMSModel, SyncState, OutboxEntry
+from .lookups import Lookup, GuidLookup, FilterNode
+from .query import CDMSQuery, CDMSSelectCompiler, BulkRefreshQuery, GetQuery
+
+logger = logging.getLogger('migrator')
+
+
+def get_cdms_models(model_labels=None):
+    """
+    Returns all the installed CDMSModel subclasses with a cdms migrator or only the
+    ones of `model_labels` ('app_label.ModelName') if given.
+    Raises ValueError if a label is not the one of an installed cdms model.
+    """
+    cdms_models = [
+        model for model in apps.get_models()
+        if issubclass(model, CDMSModel) and model.cdms_migrator
+    ]
+    if not model_labels:
+        return cdms_models
+
+    models = []
+    for model_label in model_labels:
+        try:
+            model = apps.get_model(model_label)
+        except LookupError as e:
+            raise ValueError(str(e))
+
+        if model not in cdms_models:
+            raise ValueError('{0} is not a cdms model'.format(model_label))
+        models.append(model)
+    return models
+
+
+class ModelSync(object):
+    """
+    Pulls all the cdms objs of `model` modified since the last run into the local table.
+
+    Objs are requested one page at a time ordered by ModifiedOn and id.
+    Pages are keyed on (ModifiedOn, id) of the last synced obj instead of using $skip so that
+    objs modified or deleted while syncing or between runs don't shift the following pages.
+    Progress is checkpointed in SyncState after every page so that a killed run
+    resumes where it stopped.
+    """
+    def __init__(self, model, page_size=None):
+        self.model = model
+        self.page_size = page_size or settings.CDMS_SYNC_PAGE_SIZE
+
+    def get_state(self):
+        state, _ = SyncState.objects.get_or_create(model_label=self.model._meta.label)
+        return state
+
+    def reset(self):
+        SyncState.objects.filter(model_label=self.model._meta.label).delete()
+
+    def get_page(self, state):
+        query = CDMSQuery(self.model)
+        if state.high_water_mark and state.last_cdms_pk:
+            # (ModifiedOn, id) > (high-water mark, last id)
+            query.filters.add(
+                FilterNode([
+                    Lookup('ModifiedOn', 'gt', state.high_water_mark),
+                    FilterNode([
+                        Lookup('ModifiedOn', 'exact', state.high_water_mark),
+                        GuidLookup(self.model.cdms_migrator.get_cdms_pk_name(), 'gt', state.last_cdms_pk)
+                    ], Lookup.AND)
+                ], Lookup.OR),
+                Lookup.AND
+            )
+        elif state.high_water_mark:
+            query.add_q(Q(modified__gte=state.high_water_mark))
+        query.add_ordering('modified', 'cdms_pk')
+        query.set_limits(0, self.page_size)
+        return list(CDMSSelectCompiler(query).execute())
+
+    def advance_state(self, state, page):
+        """
+        Moves the high-water mark to the ModifiedOn (truncated to seconds as CDMS filters by
+        seconds only) and id of the last obj in `page`.
+        """
+        migrator = self.model.cdms_migrator
+        state.high_water_mark = migrator.get_modified_on(page[-1]).replace(microsecond=0)
+        state.last_cdms_pk = migrator.get_cdms_pk(page[-1])
+        state.save()
+
+    def sync_page(self, state, page):
+        with transaction.atomic():
+            query = BulkRefreshQuery(self.model)
+            query.set_cdms_data_list(page)
+            query.get_compiler().execute()
+
+            self.advance_state(state, page)
+
+    def run(self):
+        """
+        Syncs all the pages and returns the number of cdms objs processed.
+        """
+        state = self.get_state()
+        tot = 0
+        while True:
+            page = self.get_page(state)
+            if page:
+                self.sync_page(state, page)
+                tot += len(page)
+                logger.debug('Synced %s %s objs' % (tot, self.model._meta.label))
+
+            if len(page) < self.page_size:
+                break
+        return tot
+
+
+class ModelBackfill(object):
+    """
+    Initial full import of all the cdms objs of `model`.
+
+    The CreatedOn range of the cdms objs is split into `partitions` time ranges which are
+    pulled concurrently by a pool of `workers` threads. Each page goes through the same
+    BulkRefreshQuery used by the online refresh (mapping via
+    BaseCDMSMigrator.update_local_from_cdms_data and batched inserts).
+
+    When done, the SyncState high-water mark is moved to the start of the backfill
+    (minus `clock_skew_margin`) so that cdms_sync only pulls the later changes.
+    """
+    clock_skew_margin = datetime.timedelta(hours=1)
+
+    def __init__(self, model, workers=None, partitions=None, page_size=None):
+        self.model = model
+        self.workers = workers or settings.CDMS_BACKFILL_WORKERS
+        self.partitions = partitions or self.workers * 4
+        self.page_size = page_size or settings.CDMS_SYNC_PAGE_SIZE
+
+    def get_created_on(self, ordering):
+        """
+        Returns the CreatedOn of the first cdms obj ordered by `ordering` or None if there are none.
+        """
+        query = CDMSQuery(self.model)
+        query.add_ordering(ordering)
+        query.set_select([self.model.cdms_migrator.get_cdms_pk_name(), 'CreatedOn'])
+        query.set_limits(0, 1)
+
+        results = list(CDMSSelectCompiler(query).execute())
+        if not results:
+            return None
+        return self.model.cdms_migrator.get_created_on(results[0])
+
+    def get_partitions(self):
+        """
+        Returns the list of (start, end) CreatedOn ranges, end excluded.
+        Boundaries are whole seconds as CDMS filters by seconds only.
+        """
+        first = self.get_created_on('created')
+        if not first:
+            return []
+        last = self.get_created_on('-created')
+
+        start = first.replace(microsecond=0)
+        end = last.replace(microsecond=0) + datetime.timedelta(seconds=1)
+
+        step = max(1, math.ceil((end - start).total_seconds() / self.partitions))
+        partitions = []
+        while start < end:
+            partition_end = min(end, start + datetime.timedelta(seconds=step))
+            partitions.append((start, partition_end))
+            start = partition_end
+        return partitions
+
+    def get_page(self, start, end, skip):
+        query = CDMSQuery(self.model)
+        query.filters.add(Lookup('CreatedOn', 'gte', start), Lookup.AND)
+        query.filters.add(Lookup('CreatedOn', 'lt', end), Lookup.AND)
+        query.add_ordering('cdms_pk')
+        query.set_limits(skip, skip + self.page_size)
+        return list(CDMSSelectCompiler(query).execute())
+
+    def backfill_partition(self, start, end):
+        """
+        Pulls all the cdms objs created between `start` (included) and `end` (excluded)
+        and returns their number.
+        """
+        tot = 0
+        try:
+            while True:
+                page = self.get_page(start, end, tot)
+                if page:
+                    with transaction.atomic():
+                        query = BulkRefreshQuery(self.model)
+                        query.set_cdms_data_list(page)
+                        query.get_compiler().execute()
+                    tot += len(page)
+
+                if len(page) < self.page_size:
+                    break
+        finally:
+            # each worker thread has its own db connection
+            connection.close()
+
+        logger.debug('Backfilled %s %s objs created in [%s, %s)' % (tot, self.model._meta.label, start, end))
+        return tot
+
+    def run(self):
+        """
+        Backfills all the cdms objs and returns (number of objs, seconds taken).
+        """
+        started_at = time.time()
+        started_on = timezone.now()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                executor.submit(self.backfill_partition, start, end)
+                for start, end in self.get_partitions()
+            ]
+            tot = sum(future.result() for future in futures)
+
+        state, _ = SyncState.objects.get_or_create(model_label=self.model._meta.label)
+        state.high_water_mark = (started_on - self.clock_skew_margin).replace(microsecond=0)
+        state.last_cdms_pk = ''
+        state.save()
+
+        return tot, time.time() - started_at
+
+
+class ModelReconcile(object):
+    """
+    Finds the local objs of `model` whose cdms obj has been deleted directly in cdms.
+
+    Only the ids of the cdms objs are streamed ($select of the id only, one page at a time)
+    and collected in a set which the local cdms_pks are checked against, read with
+    values_list so that no model instances are built. A set is used instead of a sorted
+    merge as CDMS doesn't order guids the same way the local db orders strings.
+
+    As pages could shift if cdms objs get deleted while streaming, each orphan is
+    confirmed with a get before being deleted. Objs with changes not sent to cdms yet
+    are left alone.
+    """
+    delete_batch_size = 500
+
+    def __init__(self, model):
+        self.model = model
+
+    def iter_cdms_pks(self):
+        migrator = self.model.cdms_migrator
+        query = CDMSQuery(self.model)
+        query.set_select([migrator.get_cdms_pk_name()])
+        query.add_ordering('cdms_pk')
+        for cdms_data in CDMSSelectCompiler(query).execute():
+            yield migrator.get_cdms_pk(cdms_data)
+
+    def is_deleted_in_cdms(self, cdms_pk):
+        query = GetQuery(self.model)
+        query.set_cdms_pk(cdms_pk)
+        query.set_select([self.model.cdms_migrator.get_cdms_pk_name()])
+        try:
+            query.get_compiler().execute()
+        except CDMSNotFoundException:
+            return True
+        return False
+
+    def get_orphans(self):
+        """
+        Returns the list of (pk, cdms_pk) of the local objs deleted in cdms.
+        """
+        cdms_pks = set(self.iter_cdms_pks())
+
+        candidates = [
+            (pk, cdms_pk)
+            for pk, cdms_pk in self.model.objects.skip_cdms().exclude(
+                cdms_pk=''
+            ).values_list('pk', 'cdms_pk').iterator()
+            if cdms_pk not in cdms_pks
+        ]
+        pending = OutboxEntry.get_pending_object_ids(self.model, [pk for pk, _ in candidates])
+
+        return [
+            (pk, cdms_pk) for pk, cdms_pk in candidates
+            if pk not in pending and self.is_deleted_in_cdms(cdms_pk)
+        ]
+
+    def delete_orphans(self, orphans):
+        pks = [pk for pk, _ in orphans]
+        for index in range(0, len(pks), self.delete_batch_size):
+            with transaction.atomic():
+                self.model.objects.skip_cdms().filter(
+                    pk__in=pks[index:index + self.delete_batch_size]
+                ).delete()
+
+    def run(self, dry_run=False):
+        """
+        Deletes the local orphans unless `dry_run` and returns them.
+        """
+        orphans = self.get_orphans()
+        if orphans and not dry_run:
+            self.delete_orphans(orphans)
+        logger.debug('%s %s objs deleted in cdms' % (len(orphans), self.model._meta.label))
+        return orphans
@@ -45,7 +45,7 @@ class BaseMockedCDMSApiTestCase(TransactionTestCase):
             )
 
     def assertNoAPICalled(self):
-        self.assertAPINotCalled(['create', 'list', 'update', 'delete', 'get'])
+        self.assertAPINotCalled(['create', 'iter_list', 'update', 'delete', 'get'])
 
     def assertAPICreateCalled(self, model, kwargs, tot=1):
         self.assertAPICalled(model, 'create', kwargs=kwargs, tot=tot)
@@ -54,13 +54,29 @@ class BaseMockedCDMSApiTestCase(TransactionTestCase):
         self.assertAPICalled(model, 'update', kwargs=kwargs, tot=tot)
 
     def assertAPIGetCalled(self, model, kwargs, tot=1):
+        # only the mapped fields are requested by default so just add them to kwargs if not present
+        if 'select' not in kwargs:
+            kwargs['select'] = model.cdms_migrator.select_fields
         self.assertAPICalled(model, 'get', kwargs=kwargs, tot=tot)
 
     def assertAPIListCalled(self, model, kwargs, tot=1):
         # 'ModifiedOn asc' is the default ordering so just add it to kwargs if not present
         if 'order_by' not in kwargs:
             kwargs['order_by'] = ['ModifiedOn asc']
-        self.assertAPICalled(model, 'list', kwargs=kwargs, tot=tot)
+
+        if 'select' not in kwargs:
+            kwargs['select'] = model.cdms_migrator.select_fields
+
+        # no slicing by default
+        if 'skip' not in kwargs:
+            kwargs['skip'] = 0
+        if 'limit' not in kwargs:
+            kwargs['limit'] = None
+
+        # prefetch disabled by default
+        if 'prefetch' not in kwargs:
+            kwargs['prefetch'] = 0
+        self.assertAPICalled(model, 'iter_list', kwargs=kwargs, tot=tot)
 
     def assertAPIDeleteCalled(self, model, kwargs, tot=1):
         self.assertAPICalled(model, 'delete', kwargs=kwargs, tot=tot)
@@ -1,11 +1,21 @@
+import re
 import datetime
 
+from unittest import mock
+
+from django.db import connection, transaction, IntegrityError
 from django.utils import timezone
+from django.test.utils import override_settings
 
-from migrator.tests.queries.models import SimpleObj
+from migrator.tests.queries.models import SimpleObj, ParentObj
 from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
 
-from cdms_api.tests.utils import mocked_cdms_list
+from migrator.operations import create_cdms_pk_index, delete_cdms_pk_index
+from migrator.query import BulkRefreshQuery
+
+from cdms_api import fields as cdms_fields
+from cdms_api.tests.utils import mocked_cdms_list, populate_data
+from cdms_api.utils import datetime_to_cdms_datetime
 
 
 class AllTestCase(BaseMockedCDMSApiTestCase):
@@ -55,7 +65,7 @@ class AllTestCase(BaseMockedCDMSApiTestCase):
                 'FKField': None
             },
         ]
-        self.mocked_cdms_api.list.side_effect = mocked_cdms_list(
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(
             list_data=mocked_list
         )
 
@@ -89,11 +99,206 @@ class AllTestCase(BaseMockedCDMSApiTestCase):
 
         self.assertAPINotCalled(['get', 'create', 'delete', 'update'])
 
+    def test_constant_number_of_local_queries(self):
+        """
+        Local objs are refreshed in bulk so the number of local queries doesn't depend on
+        the number of cdms objs:
+            - 1 select of the existing local objs
+            - 1 bulk insert of the new ones + 1 select of their pks, within a savepoint (2 queries)
+            - 1 update of the new and changed ones
+            - 1 final select of the local objs
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk0', name='name0')
+
+        mocked_list = [
+            {
+                'SimpleId': 'cdms-pk{0}'.format(index),
+                'Name': 'name{0}'.format(index),
+                'CreatedOn': obj.created,
+                'ModifiedOn': obj.modified + datetime.timedelta(days=1),
+                'DateTimeField': None,
+                'IntField': index,
+                'FKField': None
+            }
+            for index in range(20)
+        ]
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(
+            list_data=mocked_list
+        )
+
+        with self.assertNumQueries(7):
+            objs = list(SimpleObj.objects.all())
+
+        self.assertEqual(len(objs), 20)
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', 'int_field', 'modified')),
+            sorted(
+                (item['SimpleId'], item['IntField'], item['ModifiedOn']) for item in mocked_list
+            )
+        )
+
+    def get_cdms_data(self, cdms_pk, **kwargs):
+        cdms_data = {
+            'SimpleId': cdms_pk,
+            'Name': 'name',
+            'DateTimeField': None,
+            'IntField': None,
+            'FKField': None
+        }
+        cdms_data.update(kwargs)
+        return cdms_data
+
+    def test_no_transaction_open_while_calling_cdms(self):
+        """
+        All the cdms pages are fetched before opening the transaction which
+        writes the local changes, the time it stays open gets logged.
+        """
+        in_atomic_block = []
+
+        def iter_list(*args, **kwargs):
+            in_atomic_block.append(connection.in_atomic_block)
+            return mocked_cdms_list(list_data=[self.get_cdms_data('cdms-pk1')])(*args, **kwargs)
+        self.mocked_cdms_api.iter_list.side_effect = iter_list
+
+        with mock.patch('migrator.query.logger') as mocked_logger:
+            list(SimpleObj.objects.all())
+
+        self.assertEqual(in_atomic_block, [False])
+        self.assertEqual(SimpleObj.objects.skip_cdms().get().cdms_pk, 'cdms-pk1')
+
+        self.assertEqual(mocked_logger.debug.call_count, 1)
+        _, kwargs = mocked_logger.debug.call_args
+        self.assertTrue(kwargs['extra']['transaction_seconds'] >= 0)
+
+    def test_same_obj_in_different_pages(self):
+        """
+        If pages shift while fetching them, the same cdms obj could be returned twice,
+        only the latest version is kept.
+        """
+        now = timezone.now().replace(microsecond=0)
+        mocked_list = [
+            self.get_cdms_data('cdms-pk{0}'.format(index), ModifiedOn=now) for index in range(60)
+        ]
+        mocked_list.append(
+            self.get_cdms_data('cdms-pk0', ModifiedOn=now + datetime.timedelta(days=1), Name='new name')
+        )
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(list_data=mocked_list)
+
+        self.assertEqual(len(list(SimpleObj.objects.all())), 60)
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(cdms_pk='cdms-pk0').name, 'new name')
+
+    def test_pages_prepared_as_they_arrive(self):
+        """
+        Each cdms page gets converted as soon as it arrives and the changes get written
+        every CDMS_REFRESH_BUFFER_SIZE objs so the memory used doesn't grow with the result set.
+        """
+        now = timezone.now().replace(microsecond=0)
+        written = []
+
+        def iter_list(*args, **kwargs):
+            for index in range(120):
+                if not index % 50:
+                    written.append((connection.in_atomic_block, SimpleObj.objects.skip_cdms().count()))
+                yield populate_data('Simple', self.get_cdms_data('cdms-pk{0}'.format(index), ModifiedOn=now))
+            # more recent version of an obj already written
+            yield populate_data(
+                'Simple', self.get_cdms_data('cdms-pk0', ModifiedOn=now + datetime.timedelta(days=1), Name='new name')
+            )
+        self.mocked_cdms_api.iter_list.side_effect = iter_list
+
+        with override_settings(CDMS_REFRESH_BUFFER_SIZE=50):
+            self.assertEqual(len(list(SimpleObj.objects.all())), 120)
+
+        self.assertEqual(written, [(False, 0), (False, 50), (False, 100)])
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(cdms_pk='cdms-pk0').name, 'new name')
+
+    def test_up_to_date_objs_not_converted(self):
+        """
+        Only the id and ModifiedOn of cdms objs in sync with their local objs get read.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk1', name='name')
+
+        query = BulkRefreshQuery(SimpleObj)
+        query.set_cdms_data_list([
+            {'SimpleId': 'cdms-pk1', 'ModifiedOn': datetime_to_cdms_datetime(obj.modified)}
+        ])
+        objs = query.get_compiler().execute()
+
+        self.assertEqual(objs, [obj])
+
+    def test_local_changes_saved_while_preparing(self):
+        """
+        Local objs saved between prepare() and apply() are not overridden with the older cdms values.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk1', name='name')
+        modified_on = obj.modified + datetime.timedelta(days=1)
+
+        query = BulkRefreshQuery(SimpleObj)
+        query.set_cdms_data_list([
+            populate_data('Simple', self.get_cdms_data('cdms-pk1', Name='cdms name', ModifiedOn=modified_on))
+        ])
+        compiler = query.get_compiler()
+        compiler.prepare()
+
+        SimpleObj.objects.skip_cdms().filter(pk=obj.pk).update(
+            name='local name', modified=modified_on + datetime.timedelta(days=1)
+        )
+        compiler.apply()
+
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(pk=obj.pk).name, 'local name')
+
+    def test_local_obj_created_while_preparing(self):
+        """
+        If the local obj gets created between prepare() and apply(), it's updated instead.
+        """
+        with connection.schema_editor() as schema_editor:
+            create_cdms_pk_index(schema_editor, SimpleObj)
+
+        try:
+            query = BulkRefreshQuery(SimpleObj)
+            query.set_cdms_data_list([
+                populate_data('Simple', self.get_cdms_data(
+                    'cdms-pk{0}'.format(index), Name='cdms name',
+                    ModifiedOn=timezone.now() + datetime.timedelta(days=1)
+                ))
+                for index in range(2)
+            ])
+            compiler = query.get_compiler()
+            compiler.prepare()
+
+            obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk1', name='name')
+            with transaction.atomic():
+                compiler.apply()
+
+            self.assertEqual(
+                sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', 'name')),
+                [('cdms-pk0', 'cdms name'), ('cdms-pk1', 'cdms name')]
+            )
+            self.assertEqual(SimpleObj.objects.skip_cdms().get(cdms_pk='cdms-pk1').pk, obj.pk)
+        finally:
+            with connection.schema_editor() as schema_editor:
+                delete_cdms_pk_index(schema_editor, SimpleObj)
+
+    def test_select_mapped_fields_only(self):
+        """
+        Only the mapped fields + id, ModifiedOn and CreatedOn are requested from cdms.
+        """
+        list(SimpleObj.objects.filter(name='name'))
+
+        self.assertAPIListCalled(
+            SimpleObj, kwargs={
+                'filters': "Name eq 'name'",
+                'select': [
+                    'CreatedOn', 'DateTimeField', 'FKField', 'IntField', 'ModifiedOn', 'Name', 'SimpleId'
+                ]
+            }
+        )
+
     def test_exception(self):
         """
         In case of exceptions during cdms calls, the exception gets propagated.
         """
-        self.mocked_cdms_api.list.side_effect = Exception
+        self.mocked_cdms_api.iter_list.side_effect = Exception
         SimpleObj.objects.skip_cdms().create(
             cdms_pk='cdms-pk2', name='name2'
         )
@@ -104,9 +309,313 @@ class AllTestCase(BaseMockedCDMSApiTestCase):
         )
         self.assertAPINotCalled(['get', 'create', 'delete', 'update'])
 
+    @mock.patch.object(cdms_fields.ForeignKeyField, 'get_model', return_value=ParentObj)
+    def test_foreign_key(self, mocked_get_model):
+        """
+        Related objs are resolved through the known related objs and the fk gets written.
+        """
+        parent = ParentObj.objects.skip_cdms().create(cdms_pk='parent-pk', name='parent')
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(
+            list_data=[self.get_cdms_data('cdms-pk1', FKField={'Id': 'parent-pk'})]
+        )
+
+        objs = list(parent.simpleobj_set.all())
+
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(cdms_pk='cdms-pk1').fk_obj_id, parent.pk)
+
+    @mock.patch.object(cdms_fields.ForeignKeyField, 'get_model', return_value=ParentObj)
+    def test_unsaved_foreign_key(self, mocked_get_model):
+        """
+        If a related obj doesn't exist locally, ValueError is raised as Model.save would
+        instead of writing NULL, and nothing gets written.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk1', name='name')
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(
+            list_data=[
+                self.get_cdms_data('cdms-pk2', ModifiedOn=obj.modified + datetime.timedelta(days=1)),
+                self.get_cdms_data(
+                    'cdms-pk1', FKField={'Id': 'parent-pk'},
+                    ModifiedOn=obj.modified + datetime.timedelta(days=1)
+                )
+            ]
+        )
+
+        self.assertRaises(ValueError, list, SimpleObj.objects.all())
+        self.assertEqual(
+            list(SimpleObj.objects.skip_cdms().values_list('cdms_pk', 'fk_obj')),
+            [('cdms-pk1', None)]
+        )
+
     def test_all_skip_cdms(self):
         """
         Klass.objects.skip_cdms().all() should not hit cdms.
         """
         list(SimpleObj.objects.skip_cdms().all())
         self.assertNoAPICalled()
+
+
+class SlicingTestCase(BaseMockedCDMSApiTestCase):
+    def test_window_in_one_page(self):
+        """
+        Klass.objects.filter(...)[20:40] should only get the objs in that window from cdms.
+        """
+        list(SimpleObj.objects.filter(name='name')[20:40])
+
+        self.assertAPICalled(
+            SimpleObj, 'list', kwargs={
+                'top': 20, 'skip': 20,
+                'select': SimpleObj.cdms_migrator.select_fields,
+                'filters': "Name eq 'name'",
+                'order_by': ['ModifiedOn asc']
+            }
+        )
+        self.assertAPINotCalled('iter_list')
+
+    def test_window_objs(self):
+        """
+        The objs returned are the ones of the cdms window in the cdms order, not the
+        ones of the same window applied to the local table.
+        """
+        now = timezone.now().replace(microsecond=0)
+        list_data = [
+            populate_data('Simple', {
+                'SimpleId': 'cdms-pk{0}'.format(index),
+                'Name': 'name',
+                'ModifiedOn': now + datetime.timedelta(seconds=index),
+                'DateTimeField': None,
+                'IntField': index,
+                'FKField': None
+            })
+            for index in range(60)
+        ]
+
+        def list_(service, top=50, skip=0, select=None, filters=None, order_by=None):
+            return list_data[skip:skip + top]
+        self.mocked_cdms_api.list.side_effect = list_
+
+        objs = list(SimpleObj.objects.filter(name='name')[20:40])
+        self.assertEqual([obj.int_field for obj in objs], list(range(20, 40)))
+
+        # local objs ordered differently than cdms
+        SimpleObj.objects.skip_cdms().update(modified=now)
+        list_data.reverse()
+        objs = list(SimpleObj.objects.filter(name='name')[20:25])
+        self.assertEqual([obj.int_field for obj in objs], [39, 38, 37, 36, 35])
+        self.assertEqual(SimpleObj.objects.filter(name='name')[1].int_field, 58)
+
+    def test_window_bigger_than_one_page(self):
+        """
+        Windows bigger than one cdms page are paged through with a limit.
+        """
+        list(SimpleObj.objects.filter(name='name')[10:110])
+
+        self.assertAPIListCalled(
+            SimpleObj, kwargs={
+                'skip': 10, 'limit': 100,
+                'filters': "Name eq 'name'"
+            }
+        )
+        self.assertAPINotCalled('list')
+
+    def test_open_ended(self):
+        list(SimpleObj.objects.filter(name='name')[10:])
+
+        self.assertAPIListCalled(
+            SimpleObj, kwargs={
+                'skip': 10,
+                'filters': "Name eq 'name'"
+            }
+        )
+
+    def test_empty_window(self):
+        list(SimpleObj.objects.filter(name='name')[10:10])
+        self.assertAPINotCalled(['list', 'iter_list'])
+
+    def test_does_not_change_original_queryset(self):
+        qs = SimpleObj.objects.filter(name='name')
+        list(qs[0:10])
+        list(qs)
+
+        self.assertAPIListCalled(
+            SimpleObj, kwargs={
+                'filters': "Name eq 'name'"
+            }
+        )
+
+
+@override_settings(CDMS_REFRESH_UPSERT=True)
+class UpsertRefreshTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(UpsertRefreshTestCase, self).setUp()
+        with connection.schema_editor() as schema_editor:
+            create_cdms_pk_index(schema_editor, SimpleObj)
+
+    def tearDown(self):
+        with connection.schema_editor() as schema_editor:
+            delete_cdms_pk_index(schema_editor, SimpleObj)
+        super(UpsertRefreshTestCase, self).tearDown()
+
+    def test(self):
+        """
+        With CDMS_REFRESH_UPSERT, local objs are refreshed with one single statement:
+            - cdms-pk1 does not exist in local => local obj should get created
+            - cdms-pk2 is in sync with local obj => local obj should not change
+            - cdms-pk3 is more up-to-date than local => local obj should get updated
+        """
+        obj2 = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk2', name='name2', int_field=10
+        )
+        obj3 = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk3', name='name3', int_field=10
+        )
+
+        created_on = (timezone.now() - datetime.timedelta(days=2)).replace(microsecond=0)
+        mocked_list = [
+            {
+                'SimpleId': 'cdms-pk1',
+                'Name': 'name1',
+                'CreatedOn': created_on,
+                'ModifiedOn': created_on,
+                'DateTimeField': None,
+                'IntField': 20,
+                'FKField': None
+            },
+            {
+                'SimpleId': 'cdms-pk2',
+                'Name': 'name2',
+                'ModifiedOn': obj2.modified,
+                'DateTimeField': None,
+                'IntField': 20,
+                'FKField': None
+            },
+            {
+                'SimpleId': 'cdms-pk3',
+                'Name': 'name3',
+                'ModifiedOn': obj3.modified + datetime.timedelta(days=1),
+                'DateTimeField': None,
+                'IntField': 20,
+                'FKField': None
+            },
+        ]
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(
+            list_data=mocked_list
+        )
+
+        # 1 upsert + 1 final select
+        with self.assertNumQueries(2):
+            objs = list(SimpleObj.objects.all())
+        self.assertEqual(len(objs), 3)
+
+        objs_dict = {obj.cdms_pk: obj for obj in SimpleObj.objects.skip_cdms().all()}
+        self.assertEqual(objs_dict['cdms-pk1'].int_field, 20)
+        self.assertEqual(objs_dict['cdms-pk1'].created, created_on)
+        self.assertEqual(objs_dict['cdms-pk1'].modified, created_on)
+        self.assertEqual(objs_dict['cdms-pk2'].int_field, 10)  # not 20 as records in sync
+        self.assertEqual(objs_dict['cdms-pk3'].int_field, 20)  # updated from cdms
+        self.assertEqual(objs_dict['cdms-pk3'].modified, mocked_list[2]['ModifiedOn'])
+        self.assertEqual(objs_dict['cdms-pk3'].created, obj3.created)
+
+    def test_unique_cdms_pk(self):
+        """
+        Only one local obj per non-empty cdms_pk is allowed.
+        """
+        SimpleObj.objects.skip_cdms().create(cdms_pk='', name='name')
+        SimpleObj.objects.skip_cdms().create(cdms_pk='', name='name')
+        SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+
+        with transaction.atomic():
+            self.assertRaises(
+                IntegrityError,
+                SimpleObj.objects.skip_cdms().create, cdms_pk='cdms-pk', name='name'
+            )
+
+
+def mocked_cdms_guid_list(list_data):
+    """
+    Mocks cdms list so that it honours the (SimpleId eq guid'...' or ...) filters.
+    """
+    list_data = [populate_data('Simple', item) for item in list_data]
+
+    def internal(service, top=50, skip=0, select=None, filters=None, order_by=None):
+        cdms_pks = re.findall(r"SimpleId eq guid'([^']+)'", filters or '')
+        return [item for item in list_data if item['SimpleId'] in cdms_pks][skip:skip + top]
+    return internal
+
+
+@override_settings(CDMS_LIST_PROBE=True)
+class ProbeTestCase(BaseMockedCDMSApiTestCase):
+    def get_cdms_data(self, cdms_pk, modified_on):
+        return {
+            'SimpleId': cdms_pk,
+            'Name': 'new {0}'.format(cdms_pk),
+            'ModifiedOn': modified_on,
+            'DateTimeField': None,
+            'IntField': None,
+            'FKField': None
+        }
+
+    def test(self):
+        """
+        With CDMS_LIST_PROBE, only the id and ModifiedOn are requested first, then
+        the full data of the new and changed cdms objs only:
+            - cdms-pk1 does not exist in local => fetched and created
+            - cdms-pk2 is in sync with local obj => not fetched
+            - cdms-pk3 is more up-to-date than local => fetched and updated
+        """
+        obj2 = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk2', name='name2')
+        obj3 = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk3', name='name3')
+
+        mocked_list = [
+            self.get_cdms_data('cdms-pk1', obj2.modified),
+            self.get_cdms_data('cdms-pk2', obj2.modified),
+            self.get_cdms_data('cdms-pk3', obj3.modified + datetime.timedelta(days=1)),
+        ]
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(list_data=mocked_list)
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_guid_list(mocked_list)
+
+        objs = list(SimpleObj.objects.all())
+        self.assertEqual(len(objs), 3)
+
+        self.assertAPIListCalled(
+            SimpleObj, kwargs={
+                'filters': '',
+                'select': ['SimpleId', 'ModifiedOn']
+            }
+        )
+        self.assertAPICalled(
+            SimpleObj, 'list', kwargs={
+                'top': 2, 'skip': 0,
+                'select': SimpleObj.cdms_migrator.select_fields,
+                'filters': "(SimpleId eq guid'cdms-pk1' or SimpleId eq guid'cdms-pk3')",
+                'order_by': ['SimpleId asc']
+            }
+        )
+
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', 'name')),
+            [('cdms-pk1', 'new cdms-pk1'), ('cdms-pk2', 'name2'), ('cdms-pk3', 'new cdms-pk3')]
+        )
+
+    def test_chunks(self):
+        modified_on = timezone.now()
+        mocked_list = [
+            self.get_cdms_data('cdms-pk{0:02}'.format(index), modified_on) for index in range(30)
+        ]
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(list_data=mocked_list)
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_guid_list(mocked_list)
+
+        self.assertEqual(len(list(SimpleObj.objects.all())), 30)
+        self.assertEqual(
+            [kwargs['top'] for _, kwargs in self.mocked_cdms_api.list.call_args_list],
+            [25, 5]
+        )
+
+    def test_nothing_changed(self):
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk1', name='name1')
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list(
+            list_data=[self.get_cdms_data('cdms-pk1', obj.modified)]
+        )
+
+        self.assertEqual(list(SimpleObj.objects.all()), [obj])
+        self.assertAPINotCalled('list')
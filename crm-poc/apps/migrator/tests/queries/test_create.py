@@ -18,7 +18,8 @@ class CreateWithSaveTestCase(BaseMockedCDMSApiTestCase):
         self.mocked_cdms_api.create.side_effect = mocked_cdms_create(
             create_data={
                 'SimpleId': cdms_id,
-                'ModifiedOn': modified_on
+                'ModifiedOn': modified_on,
+                '__metadata': {'etag': 'W/"1"'}
             }
         )
 
@@ -44,12 +45,13 @@ class CreateWithSaveTestCase(BaseMockedCDMSApiTestCase):
                 }
             }
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'get'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'get'])
 
-        # reload obj and check cdms_pk and modified
+        # reload obj and check cdms_pk, modified and etag
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
         self.assertEqual(obj.cdms_pk, cdms_id)
         self.assertEqual(obj.modified, modified_on)
+        self.assertEqual(obj.cdms_etag, 'W/"1"')
 
     def test_exception_triggers_rollback(self):
         """
@@ -64,7 +66,7 @@ class CreateWithSaveTestCase(BaseMockedCDMSApiTestCase):
         self.assertRaises(Exception, obj.save)
         self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
 
-        self.assertAPINotCalled(['list', 'update', 'delete', 'get'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'get'])
 
 
 class CreateWithManagerTestCase(BaseMockedCDMSApiTestCase):
@@ -98,7 +100,7 @@ class CreateWithManagerTestCase(BaseMockedCDMSApiTestCase):
                 }
             }
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'get'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'get'])
 
         # reload obj and check cdms_pk and modified
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
@@ -118,7 +120,7 @@ class CreateWithManagerTestCase(BaseMockedCDMSApiTestCase):
         )
         self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
 
-        self.assertAPINotCalled(['list', 'update', 'delete', 'get'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'get'])
 
     def test_with_bulk_create(self):
         """
@@ -22,7 +22,7 @@ class DeleteTestCase(BaseDeleteTestCase):
         self.assertAPIDeleteCalled(
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
-        self.assertAPINotCalled(['list', 'update', 'get', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'get', 'create'])
 
     def test_with_manager(self):
         """
@@ -49,7 +49,7 @@ class DeleteTestCase(BaseDeleteTestCase):
         )
         self.assertEqual(SimpleObj.objects.skip_cdms().count(), 1)
 
-        self.assertAPINotCalled(['list', 'update', 'get', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'get', 'create'])
 
 
 class DeleteSkipCDMSTestCase(BaseDeleteTestCase):
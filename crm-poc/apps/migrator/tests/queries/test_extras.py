@@ -1,8 +1,12 @@
+import datetime
+
 from django.db.models import Count
 
 from migrator.tests.queries.models import SimpleObj
 from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
 
+from cdms_api.tests.utils import mocked_cdms_list
+
 
 class SingleObjMixin(object):
     def setUp(self):
@@ -223,12 +227,63 @@ class UpdateOrCreateTestCase(BaseMockedCDMSApiTestCase):
 
 class CountTestCase(BaseMockedCDMSApiTestCase):
     def test(self):
-        self.assertRaises(
-            NotImplementedError,
-            SimpleObj.objects.count
-        )
+        """
+        count() should count the cdms objs without getting them.
+        """
+        self.mocked_cdms_api.count.return_value = 10
+
+        self.assertEqual(SimpleObj.objects.count(), 10)
+
+        self.assertAPICalled(SimpleObj, 'count', kwargs={'filters': ''})
+        self.assertNoAPICalled()
+
+    def test_with_filters(self):
+        """
+        count() should use the same filters as the list call and should not create local objs.
+        """
+        self.mocked_cdms_api.count.return_value = 10
+
+        self.assertEqual(SimpleObj.objects.filter(name='name').count(), 10)
+
+        self.assertAPICalled(SimpleObj, 'count', kwargs={'filters': "Name eq 'name'"})
+        self.assertNoAPICalled()
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
+
+    def test_with_slicing(self):
+        self.mocked_cdms_api.count.return_value = 10
+
+        self.assertEqual(SimpleObj.objects.filter(name='name')[2:5].count(), 3)
+        self.assertEqual(SimpleObj.objects.filter(name='name')[8:20].count(), 2)
+
+    def test_none(self):
+        self.assertEqual(SimpleObj.objects.none().count(), 0)
+        self.assertAPINotCalled(['count'])
+
+    def test_by_pk(self):
+        """
+        Filtering only by pk is local only so the count is local as well.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+
+        self.assertEqual(SimpleObj.objects.filter(pk=obj.pk).count(), 1)
+        self.assertAPINotCalled(['count'])
         self.assertNoAPICalled()
 
+    def test_by_pk_and_cdms_field(self):
+        """
+        Filtering by pk and by cdms fields is counted locally as the pk is not in the cdms query.
+        """
+        self.mocked_cdms_api.count.return_value = 10
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk2', name='name')
+
+        self.assertEqual(SimpleObj.objects.filter(pk=obj.pk).filter(name='name').count(), 1)
+        self.assertEqual(SimpleObj.objects.filter(name='name').filter(pk=obj.pk).count(), 1)
+        self.assertEqual(SimpleObj.objects.filter(pk=obj.pk, name='name').count(), 1)
+        self.assertEqual(SimpleObj.objects.filter(pk=obj.pk, name='other').count(), 0)
+        self.assertFalse(SimpleObj.objects.filter(name='name').filter(pk=0).exists())
+        self.assertAPINotCalled(['count', 'list'])
+
     def test_skip_cdms(self):
         SimpleObj.objects.skip_cdms().count()
         self.assertNoAPICalled()
@@ -247,52 +302,135 @@ class InBulkTestCase(BaseMockedCDMSApiTestCase):
         self.assertNoAPICalled()
 
 
-class LatestTestCase(SingleObjMixin, BaseMockedCDMSApiTestCase):
+class SingleCDMSObjMixin(SingleObjMixin):
+    """
+    Mocks cdms list so that it returns one cdms obj more up-to-date than the local one.
+    """
+    def setUp(self):
+        super(SingleCDMSObjMixin, self).setUp()
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_list(
+            list_data=[{
+                'SimpleId': self.obj.cdms_pk,
+                'Name': 'new name',
+                'ModifiedOn': self.obj.modified + datetime.timedelta(days=1),
+                'DateTimeField': None,
+                'IntField': None,
+                'FKField': None
+            }]
+        )
+
+    def assertAPIFirstCalled(self, order_by, filters=''):
+        self.assertAPICalled(
+            SimpleObj, 'list', kwargs={
+                'top': 1, 'skip': 0,
+                'select': SimpleObj.cdms_migrator.select_fields,
+                'filters': filters,
+                'order_by': order_by
+            }
+        )
+        self.assertAPINotCalled(['iter_list', 'get', 'create', 'update', 'delete'])
+
+
+class LatestTestCase(SingleCDMSObjMixin, BaseMockedCDMSApiTestCase):
     def test(self):
+        """
+        latest(field) should get one single cdms obj ordered by field desc and refresh the local obj.
+        """
+        obj = SimpleObj.objects.latest('dt_field')
+        self.assertEqual(obj.pk, self.obj.pk)
+        self.assertEqual(obj.name, 'new name')
+
+        self.assertAPIFirstCalled(order_by=['DateTimeField desc'])
+
+    def test_does_not_exist(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_list(list_data=[])
+
         self.assertRaises(
-            NotImplementedError,
-            SimpleObj.objects.latest, 'dt_field'
+            SimpleObj.DoesNotExist,
+            SimpleObj.objects.filter(name='other').latest, 'dt_field'
         )
-        self.assertNoAPICalled()
+        self.assertAPIFirstCalled(order_by=['DateTimeField desc'], filters="Name eq 'other'")
 
     def test_skip_cdms(self):
         SimpleObj.objects.skip_cdms().latest('dt_field')
         self.assertNoAPICalled()
 
 
-class EarliestTestCase(SingleObjMixin, BaseMockedCDMSApiTestCase):
+class EarliestTestCase(SingleCDMSObjMixin, BaseMockedCDMSApiTestCase):
     def test(self):
-        self.assertRaises(
-            NotImplementedError,
-            SimpleObj.objects.earliest, 'dt_field'
-        )
-        self.assertNoAPICalled()
+        obj = SimpleObj.objects.earliest('dt_field')
+        self.assertEqual(obj.pk, self.obj.pk)
+        self.assertEqual(obj.name, 'new name')
+
+        self.assertAPIFirstCalled(order_by=['DateTimeField asc'])
 
     def test_skip_cdms(self):
         SimpleObj.objects.skip_cdms().earliest('dt_field')
         self.assertNoAPICalled()
 
 
-class FirstTestCase(SingleObjMixin, BaseMockedCDMSApiTestCase):
+class FirstTestCase(SingleCDMSObjMixin, BaseMockedCDMSApiTestCase):
     def test(self):
-        self.assertRaises(
-            NotImplementedError,
-            SimpleObj.objects.first
-        )
-        self.assertNoAPICalled()
+        """
+        first() should get one single cdms obj using the default ordering and refresh the local obj.
+        """
+        obj = SimpleObj.objects.filter(name='name').first()
+        self.assertEqual(obj.pk, self.obj.pk)
+        self.assertEqual(obj.name, 'new name')
+
+        # reload obj and check
+        obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
+        self.assertEqual(obj.name, 'new name')
+
+        self.assertAPIFirstCalled(order_by=['ModifiedOn asc'], filters="Name eq 'name'")
+
+    def test_with_ordering(self):
+        SimpleObj.objects.order_by('-name').first()
+        self.assertAPIFirstCalled(order_by=['Name desc'])
+
+    def test_by_pk_and_cdms_field(self):
+        """
+        first() filtered by pk and by cdms fields gets the local obj and refreshes it.
+        """
+        obj = SimpleObj.objects.filter(name='other').filter(pk=self.obj.pk).first()
+        self.assertEqual(obj, None)
+
+        obj = SimpleObj.objects.filter(name=self.obj.name).filter(pk=self.obj.pk).first()
+        self.assertEqual(obj.pk, self.obj.pk)
+        self.assertAPINotCalled(['list'])
+
+    def test_none_found(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_list(list_data=[])
+
+        self.assertEqual(SimpleObj.objects.filter(name='other').first(), None)
+
+    def test_by_pk(self):
+        """
+        Filtering by pk only, the local obj is refreshed as with get(pk=...).
+        """
+        SimpleObj.objects.filter(pk=self.obj.pk).first()
+
+        self.assertAPIGetCalled(SimpleObj, kwargs={'guid': self.obj.cdms_pk})
+        self.assertAPINotCalled(['list', 'iter_list'])
 
     def test_skip_cdms(self):
         SimpleObj.objects.skip_cdms().first()
         self.assertNoAPICalled()
 
 
-class LastTestCase(SingleObjMixin, BaseMockedCDMSApiTestCase):
+class LastTestCase(SingleCDMSObjMixin, BaseMockedCDMSApiTestCase):
     def test(self):
-        self.assertRaises(
-            NotImplementedError,
-            SimpleObj.objects.last
-        )
-        self.assertNoAPICalled()
+        """
+        last() should reverse the ordering.
+        """
+        obj = SimpleObj.objects.filter(name='name').last()
+        self.assertEqual(obj.pk, self.obj.pk)
+
+        self.assertAPIFirstCalled(order_by=['ModifiedOn desc'], filters="Name eq 'name'")
+
+    def test_with_ordering(self):
+        SimpleObj.objects.order_by('-name').last()
+        self.assertAPIFirstCalled(order_by=['Name asc'])
 
     def test_skip_cdms(self):
         SimpleObj.objects.skip_cdms().last()
@@ -314,11 +452,28 @@ class AggregateTestCase(BaseMockedCDMSApiTestCase):
 
 class ExistsTestCase(BaseMockedCDMSApiTestCase):
     def test(self):
-        self.assertRaises(
-            NotImplementedError,
-            SimpleObj.objects.exists
+        """
+        exists() should get one single cdms obj with its id only and not create local objs.
+        """
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_list(list_data=[{}])
+
+        self.assertTrue(SimpleObj.objects.filter(name='name').exists())
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
+
+        self.assertAPICalled(
+            SimpleObj, 'list', kwargs={
+                'top': 1, 'skip': 0,
+                'select': ['SimpleId'],
+                'filters': "Name eq 'name'",
+                'order_by': ['ModifiedOn asc']
+            }
         )
-        self.assertNoAPICalled()
+        self.assertAPINotCalled(['iter_list', 'get', 'create', 'update', 'delete'])
+
+    def test_not_exists(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_list(list_data=[])
+
+        self.assertFalse(SimpleObj.objects.filter(name='name').exists())
 
     def test_skip_cdms(self):
         SimpleObj.objects.skip_cdms().exists()
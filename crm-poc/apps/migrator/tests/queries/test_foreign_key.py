@@ -163,7 +163,7 @@ class GetParentFromChildTestCase(BaseForeignKeyTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': self.simple_obj.cdms_pk}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
         self.mocked_cdms_api.reset_mock()
 
@@ -187,7 +187,7 @@ class GetParentFromChildTestCase(BaseForeignKeyTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': self.simple_obj.cdms_pk}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
         self.mocked_cdms_api.reset_mock()
 
@@ -230,7 +230,7 @@ class CreateChildTestCase(BaseForeignKeyTestCase):
                 }
             }
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'get'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'get'])
 
         # reload obj and check cdms_pk and modified
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
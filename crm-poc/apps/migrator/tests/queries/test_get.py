@@ -31,7 +31,7 @@ class GetByIdTestCase(BaseGetTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
     def test_local_doesnt_exist(self):
         """
@@ -45,6 +45,25 @@ class GetByIdTestCase(BaseGetTestCase):
 
         self.assertNoAPICalled()
 
+    def test_stores_cdms_etag(self):
+        """
+        When the local obj gets refreshed, the etag of the cdms obj is stored as well.
+        """
+        self.mocked_cdms_api.get.side_effect = mocked_cdms_get(
+            get_data={
+                'Name': 'name',
+                'DateTimeField': None,
+                'IntField': None,
+                'FKField': None,
+                'ModifiedOn': timezone.now() + datetime.timedelta(days=1),
+                '__metadata': {'etag': 'W/"2"'}
+            }
+        )
+
+        obj = SimpleObj.objects.get(pk=self.obj.pk)
+        self.assertEqual(obj.cdms_etag, 'W/"2"')
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(pk=self.obj.pk).cdms_etag, 'W/"2"')
+
 
 class GetByCmdPKTestCase(BaseGetTestCase):
     def test_local_exists(self):
@@ -58,7 +77,7 @@ class GetByCmdPKTestCase(BaseGetTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
     def test_local_doesnt_exist(self):
         """
@@ -88,7 +107,7 @@ class GetByCmdPKTestCase(BaseGetTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': 'cdms-pk'}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
         # reload obj and check
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
@@ -115,7 +134,7 @@ class GetByCmdPKTestCase(BaseGetTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': 'cdms-pk'}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
 
 class GetByOtherFieldsTestCase(BaseGetTestCase):
@@ -129,7 +148,7 @@ class GetByOtherFieldsTestCase(BaseGetTestCase):
         self.assertAPIGetCalled(
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
     def test_multiple_objects_returned(self):
         SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk1', name='name')
@@ -165,7 +184,7 @@ class SyncGetTestCase(BaseGetTestCase):
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
 
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
     def test_with_local_more_up_to_date(self):
         """
@@ -188,7 +207,7 @@ class SyncGetTestCase(BaseGetTestCase):
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
 
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
     def test_with_cdms_more_up_to_date(self):
         """
@@ -219,7 +238,7 @@ class SyncGetTestCase(BaseGetTestCase):
             SimpleObj, kwargs={'guid': self.obj.cdms_pk}
         )
 
-        self.assertAPINotCalled(['list', 'update', 'delete', 'create'])
+        self.assertAPINotCalled(['iter_list', 'update', 'delete', 'create'])
 
         # reload obj and check
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
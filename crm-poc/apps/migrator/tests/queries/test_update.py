@@ -1,8 +1,14 @@
 import datetime
 
+from unittest import mock
+
 from django.db import transaction
 from django.utils import timezone
+from django.test.utils import override_settings
+
+from cdms_api.exceptions import CDMSConflictException, CDMSNotFoundException
 
+from migrator.models import OutboxEntry, cdms_write_counters
 from migrator.tests.queries.models import SimpleObj
 from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
 
@@ -14,7 +20,7 @@ class UpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
         """
         obj.save() should
             - get the related cdms obj
-            - update the cdms obj
+            - update the cdms obj with the changed mapped fields only
             - save local obj
 
 
@@ -48,9 +54,9 @@ class UpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
         self.assertEqual(SimpleObj.objects.skip_cdms().count(), 1)
         self.assertEqual(obj.modified, modified_on)
 
-        # check cdms get called
+        # check cdms get called, the whole record is needed for the update
         self.assertAPIGetCalled(
-            SimpleObj, kwargs={'guid': 'cdms-pk'}
+            SimpleObj, kwargs={'guid': 'cdms-pk', 'select': None}
         )
 
         # check cdms update called
@@ -60,14 +66,11 @@ class UpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
                 'guid': 'cdms-pk',
                 'data': {
                     'Name': 'simple obj',
-                    'DateTimeField': None,
-                    'IntField': None,
-                    'SimpleId': 'cdms-pk',
-                    'FKField': None
+                    'SimpleId': 'cdms-pk'
                 }
             }
         )
-        self.assertAPINotCalled(['list', 'create', 'delete'])
+        self.assertAPINotCalled(['iter_list', 'create', 'delete'])
 
         # reload obj and check, 'modified' should be == cdms modified
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
@@ -94,11 +97,11 @@ class UpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
         self.assertRaises(Exception, obj.save)
         self.assertEqual(SimpleObj.objects.skip_cdms().count(), 1)
 
-        # check cdms get called
+        # check cdms get called, the whole record is needed for the update
         self.assertAPIGetCalled(
-            SimpleObj, kwargs={'guid': 'cdms-pk'}
+            SimpleObj, kwargs={'guid': 'cdms-pk', 'select': None}
         )
-        self.assertAPINotCalled(['create', 'list', 'delete'])
+        self.assertAPINotCalled(['create', 'iter_list', 'delete'])
 
         # check that the obj in the db didn't change
         obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
@@ -127,6 +130,226 @@ class UpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
         self.assertEqual(obj.name, 'simple obj')
 
 
+@override_settings(CDMS_PARTIAL_UPDATES=True)
+class PartialUpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
+    def test_save(self):
+        """
+        With CDMS_PARTIAL_UPDATES, obj.save() should
+            - NOT get the related cdms obj
+            - partially update the cdms obj with the changed mapped fields only
+            - save local obj with the modified value returned by cdms
+        """
+        modified_on = (timezone.now() + datetime.timedelta(days=1)).replace(microsecond=0)
+        self.mocked_cdms_api.partial_update.side_effect = mocked_cdms_update(
+            update_data={
+                'ModifiedOn': modified_on
+            }
+        )
+
+        # create without cdms and then save
+        obj = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk',
+            name='old name'
+        )
+
+        obj.name = 'simple obj'
+        obj.save()
+        self.assertEqual(obj.modified, modified_on)
+
+        self.assertAPICalled(
+            SimpleObj, 'partial_update',
+            kwargs={
+                'guid': 'cdms-pk',
+                'data': {
+                    'Name': 'simple obj'
+                }
+            }
+        )
+        self.assertAPINotCalled(['get', 'update', 'iter_list', 'create', 'delete'])
+
+        # reload obj and check, 'modified' should be == cdms modified
+        obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
+        self.assertEqual(obj.name, 'simple obj')
+        self.assertEqual(obj.modified, modified_on)
+
+    def test_exception_triggers_rollback(self):
+        self.mocked_cdms_api.partial_update.side_effect = Exception
+
+        obj = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk',
+            name='old name'
+        )
+
+        obj.name = 'new name'
+        self.assertRaises(Exception, obj.save)
+
+        obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
+        self.assertEqual(obj.name, 'old name')
+
+
+@override_settings(CDMS_CONDITIONAL_UPDATES=True)
+class ConditionalUpdateWithSaveTestCase(BaseMockedCDMSApiTestCase):
+    def test_save(self):
+        """
+        With CDMS_CONDITIONAL_UPDATES and a known etag, obj.save() should
+            - NOT get the related cdms obj
+            - partially update the cdms obj with If-Match: etag
+            - save local obj with the modified value and etag returned by cdms
+        """
+        modified_on = (timezone.now() + datetime.timedelta(days=1)).replace(microsecond=0)
+        self.mocked_cdms_api.partial_update.side_effect = mocked_cdms_update(
+            update_data={
+                'ModifiedOn': modified_on,
+                '__metadata': {'etag': 'W/"2"'}
+            }
+        )
+
+        obj = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk', cdms_etag='W/"1"', name='old name'
+        )
+
+        obj.name = 'simple obj'
+        obj.save()
+        self.assertEqual(obj.modified, modified_on)
+        self.assertEqual(obj.cdms_etag, 'W/"2"')
+
+        self.assertAPICalled(
+            SimpleObj, 'partial_update',
+            kwargs={
+                'guid': 'cdms-pk',
+                'data': {
+                    'Name': 'simple obj'
+                },
+                'if_match': 'W/"1"'
+            }
+        )
+        self.assertAPINotCalled(['get', 'update', 'iter_list', 'create', 'delete'])
+
+        obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
+        self.assertEqual(obj.modified, modified_on)
+        self.assertEqual(obj.cdms_etag, 'W/"2"')
+
+    def test_save_without_etag(self):
+        """
+        If the etag is not known, the cdms obj is got and updated as usual and its etag stored.
+        """
+        self.mocked_cdms_api.update.side_effect = mocked_cdms_update(
+            update_data={'__metadata': {'etag': 'W/"2"'}}
+        )
+
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='old name')
+        obj.name = 'simple obj'
+        obj.save()
+
+        self.assertEqual(self.mocked_cdms_api.get.call_count, 1)
+        self.assertEqual(self.mocked_cdms_api.update.call_count, 1)
+        self.assertAPINotCalled('partial_update')
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(pk=obj.pk).cdms_etag, 'W/"2"')
+
+    def test_conflict(self):
+        """
+        If the cdms obj changed in the meantime, CDMSConflictException is raised with the
+        fields different in cdms and the local changes are rolled back.
+        """
+        self.mocked_cdms_api.partial_update.side_effect = CDMSConflictException('changed', status_code=412)
+        self.mocked_cdms_api.get.side_effect = mocked_cdms_get(
+            get_data={
+                'Name': 'changed in cdms',
+                'DateTimeField': None,
+                'IntField': None,
+                'FKField': None
+            }
+        )
+
+        obj = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk', cdms_etag='W/"1"', name='old name'
+        )
+
+        obj.name = 'simple obj'
+        with self.assertRaises(CDMSConflictException) as cm:
+            obj.save()
+
+        self.assertEqual(
+            cm.exception.conflicting_fields['name'], {'theirs': 'changed in cdms', 'yours': 'simple obj'}
+        )
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(pk=obj.pk).name, 'old name')
+
+    @mock.patch('migrator.models.logger')
+    def test_conflict_with_cdms_obj_not_available(self, mocked_logger):
+        """
+        If the cdms obj cannot be got, the conflict is raised anyway without conflicting fields.
+        """
+        self.mocked_cdms_api.partial_update.side_effect = CDMSConflictException('changed', status_code=412)
+        self.mocked_cdms_api.get.side_effect = CDMSNotFoundException('deleted', status_code=404)
+
+        obj = SimpleObj.objects.skip_cdms().create(
+            cdms_pk='cdms-pk', cdms_etag='W/"1"', name='old name'
+        )
+
+        obj.name = 'simple obj'
+        with self.assertRaises(CDMSConflictException) as cm:
+            obj.save()
+
+        self.assertEqual(cm.exception.conflicting_fields, None)
+        self.assertEqual(mocked_logger.exception.call_count, 1)
+        self.assertEqual(SimpleObj.objects.skip_cdms().get(pk=obj.pk).name, 'old name')
+
+
+class DirtyFieldsTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(DirtyFieldsTestCase, self).setUp()
+        cdms_write_counters.clear()
+        self.obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='old name')
+
+    def test_get_dirty_fields(self):
+        obj = SimpleObj.objects.skip_cdms().get(pk=self.obj.pk)
+        self.assertEqual(obj.get_dirty_fields(), {})
+
+        obj.name = 'new name'
+        obj.int_field = 1
+        obj.d_field = datetime.date.today()  # not mapped
+        self.assertEqual(obj.get_dirty_fields(), {'name': 'old name', 'int_field': None})
+
+        obj.save(skip_cdms=True)
+        self.assertEqual(obj.get_dirty_fields(), {})
+
+    def test_get_dirty_fields_of_new_obj(self):
+        self.assertEqual(
+            SimpleObj(name='name').get_dirty_fields(),
+            {'name': None, 'dt_field': None, 'int_field': None, 'fk_obj': None}
+        )
+
+    def test_noop_save(self):
+        """
+        If no mapped field changed, cdms is not called and the local modified doesn't change.
+        """
+        obj = SimpleObj.objects.skip_cdms().get(pk=self.obj.pk)
+        obj.d_field = datetime.date.today()  # not mapped
+        obj.save()
+
+        self.assertNoAPICalled()
+        self.assertEqual(cdms_write_counters, {'avoided': 1})
+
+        obj = SimpleObj.objects.skip_cdms().get(pk=self.obj.pk)
+        self.assertEqual(obj.d_field, datetime.date.today())
+        self.assertEqual(obj.modified, self.obj.modified)
+
+    def test_saves_after_save(self):
+        self.mocked_cdms_api.update.side_effect = mocked_cdms_update()
+
+        self.obj.name = 'new name'
+        self.obj.save()
+        self.obj.save()
+
+        self.assertEqual(self.mocked_cdms_api.update.call_count, 1)
+        self.assertEqual(cdms_write_counters, {'sent': 1, 'avoided': 1})
+
+    @override_settings(CDMS_WRITE_BEHIND=True)
+    def test_noop_save_with_write_behind(self):
+        self.obj.save()
+        self.assertEqual(OutboxEntry.objects.count(), 0)
+
+
 class UpdateWithManagerTestCase(BaseMockedCDMSApiTestCase):
     def test_update(self):
         """
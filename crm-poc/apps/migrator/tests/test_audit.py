@@ -0,0 +1,86 @@
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from migrator.audit import ModelAudit
+from migrator.tests.queries.models import SimpleObj, ParentObj
+from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
+
+from cdms_api.tests.utils import populate_data
+
+
+class ModelAuditTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(ModelAuditTestCase, self).setUp()
+        self.modified_on = timezone.now().replace(microsecond=0)
+        parent = ParentObj.objects.skip_cdms().create(cdms_pk='parent-pk', name='parent')
+
+        self.list_data = []
+        for index in range(5):
+            cdms_data = {
+                'SimpleId': 'cdms-pk{0}'.format(index),
+                'Name': 'name{0}'.format(index),
+                'ModifiedOn': self.modified_on,
+                'DateTimeField': None,
+                'IntField': index,
+                'FKField': {'Id': 'parent-pk'}
+            }
+            self.list_data.append(populate_data('Simple', cdms_data))
+
+            if index == 4:
+                # missing locally
+                continue
+            SimpleObj.objects.skip_cdms().create(
+                cdms_pk=cdms_data['SimpleId'], name=cdms_data['Name'],
+                int_field=index, fk_obj=parent, modified=self.modified_on
+            )
+
+        # drifted
+        SimpleObj.objects.skip_cdms().filter(cdms_pk='cdms-pk1').update(name='changed')
+        SimpleObj.objects.skip_cdms().filter(cdms_pk='cdms-pk2').update(name='changed', int_field=None)
+        SimpleObj.objects.skip_cdms().filter(cdms_pk='cdms-pk3').update(fk_obj=None)
+
+        def list(service, top=50, skip=0, select=None, filters=None, order_by=None):
+            return self.list_data[skip:skip + top]
+        self.mocked_cdms_api.list.side_effect = list
+        self.mocked_cdms_api.count.return_value = len(self.list_data)
+
+    def test_run(self):
+        report = ModelAudit(SimpleObj, page_size=2).run()
+
+        self.assertEqual(report.checked, 5)
+        self.assertEqual(report.missing, 1)
+        self.assertEqual(report.drifted, 3)
+        self.assertEqual(report.fields, {'name': 2, 'int_field': 1, 'fk_obj': 1})
+
+        self.assertEqual(self.mocked_cdms_api.list.call_count, 3)
+        self.assertAPINotCalled('get')
+
+    def test_constant_number_of_local_queries_per_page(self):
+        with self.assertNumQueries(3):
+            ModelAudit(SimpleObj, page_size=2).run()
+
+    def test_sample_rate(self):
+        report = ModelAudit(SimpleObj, sample_rate=0.5, page_size=1).run()
+
+        self.assertEqual(report.checked, 3)
+        self.assertEqual(self.mocked_cdms_api.list.call_count, 3)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('cdms_audit', 'queries.SimpleObj', stdout=out)
+
+        self.assertEqual(
+            out.getvalue(),
+            'queries.SimpleObj: 5 checked, 1 missing, 3 drifted\n'
+            '  name: 2\n'
+            '  fk_obj: 1\n'
+            '  int_field: 1\n'
+        )
+
+    def test_command_invalid_model(self):
+        self.assertRaises(
+            CommandError,
+            call_command, 'cdms_audit', 'migrator.SyncState', stdout=StringIO()
+        )
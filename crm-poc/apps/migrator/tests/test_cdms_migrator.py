@@ -0,0 +1,157 @@
+import os
+import sys
+import timeit
+import datetime
+
+from unittest import skipUnless
+
+from django.test.testcases import SimpleTestCase
+from django.utils import timezone
+
+from migrator.exceptions import NotMappingFieldException
+from migrator.tests.queries.models import SimpleObj
+
+from cdms_api.tests.utils import populate_data
+
+
+class PlanTestCase(SimpleTestCase):
+    def test_built_at_class_preparation(self):
+        self.assertTrue(SimpleObj in SimpleObj.cdms_migrator.plans)
+
+    def test_mapped_fields_only(self):
+        plan = SimpleObj.cdms_migrator.get_plan(SimpleObj)
+        self.assertEqual(
+            sorted((field_plan.name, field_plan.cdms_name) for field_plan in plan),
+            [
+                ('dt_field', 'DateTimeField'),
+                ('fk_obj', 'FKField'),
+                ('int_field', 'IntField'),
+                ('modified', 'ModifiedOn'),
+                ('name', 'Name')
+            ]
+        )
+
+    def test_roundtrip(self):
+        migrator = SimpleObj.cdms_migrator
+        now = timezone.now().replace(microsecond=0)
+        cdms_data = populate_data('Simple', {
+            'Name': 'name',
+            'DateTimeField': now,
+            'IntField': 1,
+            'FKField': None,
+            'ModifiedOn': now
+        })
+
+        obj = migrator.update_local_from_cdms_data(SimpleObj(), cdms_data)
+        self.assertEqual(
+            (obj.name, obj.dt_field, obj.int_field, obj.fk_obj, obj.modified),
+            ('name', now, 1, None, now)
+        )
+        self.assertEqual(migrator.get_conflicting_fields(obj, cdms_data), {})
+
+        self.assertEqual(
+            migrator.update_cdms_data_from_local(obj, {}),
+            {
+                'Name': 'name',
+                'DateTimeField': cdms_data['DateTimeField'],
+                'IntField': 1,
+                'FKField': None,
+                'ModifiedOn': cdms_data['ModifiedOn']
+            }
+        )
+
+
+class RowTestCase(SimpleTestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.cdms_data = populate_data('Simple', {
+            'Name': 'name',
+            'DateTimeField': self.now,
+            'IntField': 1,
+            'FKField': None,
+            'CreatedOn': self.now,
+            'ModifiedOn': self.now
+        }, guid='cdms-pk')
+
+    def test_fields(self):
+        row, = SimpleObj.cdms_migrator.get_rows(SimpleObj, [self.cdms_data])
+
+        self.assertEqual(
+            (row.cdms_pk, row.name, row.dt_field, row.int_field, row.fk_obj, row.created, row.modified),
+            ('cdms-pk', 'name', self.now, 1, None, self.now, self.now)
+        )
+        self.assertRaises(AttributeError, getattr, row, 'd_field')  # not mapped
+
+        del self.cdms_data['IntField']
+        row, = SimpleObj.cdms_migrator.get_rows(SimpleObj, [self.cdms_data])
+        self.assertRaises(AttributeError, getattr, row, 'int_field')  # not in cdms data
+        self.assertFalse(hasattr(row, '__dict__'))
+
+    def test_converted_on_first_access_only(self):
+        row, = SimpleObj.cdms_migrator.get_rows(SimpleObj, [self.cdms_data])
+
+        self.assertEqual(row.dt_field, self.now)
+
+        # cached
+        self.cdms_data['DateTimeField'] = None
+        self.assertEqual(row.dt_field, self.now)
+
+        # not converted until read
+        self.cdms_data['IntField'] = 2
+        self.assertEqual(row.int_field, 2)
+
+    def test_same_class_per_model(self):
+        migrator = SimpleObj.cdms_migrator
+        self.assertTrue(migrator.get_row_class(SimpleObj) is migrator.get_row_class(SimpleObj))
+        self.assertEqual(migrator.get_row_class(SimpleObj).__name__, 'SimpleObjRow')
+
+
+def update_local_from_cdms_data_per_field(migrator, local_obj, cdms_data):
+    """
+    Previous implementation going through all the model fields for each obj, used as
+    reference by the benchmark.
+    """
+    for field in local_obj._meta.fields:
+        try:
+            cdms_field = migrator.get_cdms_field(field.name)
+        except NotMappingFieldException:
+            continue
+        setattr(local_obj, field.name, cdms_field.from_cdms_value(cdms_data[cdms_field.cdms_name]))
+    return local_obj
+
+
+@skipUnless(os.environ.get('BENCHMARK'), 'set BENCHMARK=1 to run the benchmarks')
+class PlanBenchmarkTestCase(SimpleTestCase):
+    rows = 10000
+
+    def test_update_local_from_cdms_data(self):
+        migrator = SimpleObj.cdms_migrator
+        now = timezone.now()
+        page = [
+            populate_data('Simple', {
+                'Name': 'name{0}'.format(index),
+                'DateTimeField': now - datetime.timedelta(minutes=index),
+                'IntField': index,
+                'FKField': None,
+                'ModifiedOn': now
+            })
+            for index in range(self.rows)
+        ]
+        objs = [SimpleObj() for _ in page]
+
+        def before():
+            for obj, cdms_data in zip(objs, page):
+                update_local_from_cdms_data_per_field(migrator, obj, cdms_data)
+
+        def after():
+            for obj, cdms_data in zip(objs, page):
+                migrator.update_local_from_cdms_data(obj, cdms_data)
+
+        before_seconds = min(timeit.repeat(before, number=1, repeat=3))
+        after_seconds = min(timeit.repeat(after, number=1, repeat=3))
+        sys.stderr.write(
+            '\nupdate_local_from_cdms_data, {0} rows: {1:.2f}us/row before, {2:.2f}us/row after\n'.format(
+                self.rows, before_seconds / self.rows * 10 ** 6, after_seconds / self.rows * 10 ** 6
+            )
+        )
+        self.assertLess(after_seconds, before_seconds)
@@ -2,7 +2,7 @@ import datetime
 
 from django.test.testcases import TestCase
 
-from migrator.lookups import FilterNode, Lookup
+from migrator.lookups import FilterNode, Lookup, GuidLookup
 
 
 class LookupTestCase(TestCase):
@@ -121,3 +121,15 @@ class ValueLookupTestCase(TestCase):
             filters.as_filter_string(),
             "Field eq 2"
         )
+
+    def test_guid(self):
+        filters = FilterNode(
+            children=[
+                GuidLookup('FieldId', 'exact', 'my-guid')
+            ]
+        )
+
+        self.assertEqual(
+            filters.as_filter_string(),
+            "FieldId eq guid'my-guid'"
+        )
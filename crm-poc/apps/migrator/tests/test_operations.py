@@ -0,0 +1,33 @@
+from django.db import connection
+
+from migrator.exceptions import DuplicateCDMSPkException
+from migrator.operations import create_cdms_pk_index, delete_cdms_pk_index
+from migrator.tests.queries.models import SimpleObj
+from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
+
+
+class CreateCDMSPkIndexTestCase(BaseMockedCDMSApiTestCase):
+    def test_duplicates(self):
+        """
+        If more than one obj has the same cdms_pk, the index is not created and
+        the exception lists the duplicate cdms_pks.
+        """
+        for cdms_pk in ['cdms-pk2', 'cdms-pk1', 'cdms-pk2', 'cdms-pk1', 'cdms-pk3', '', '']:
+            SimpleObj.objects.skip_cdms().create(cdms_pk=cdms_pk, name='name')
+
+        with self.assertRaisesRegex(DuplicateCDMSPkException, 'obj: cdms-pk1, cdms-pk2$'):
+            with connection.schema_editor() as schema_editor:
+                create_cdms_pk_index(schema_editor, SimpleObj)
+
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 7)
+
+    def test_without_duplicates(self):
+        """
+        Objs without cdms_pk don't count as duplicates.
+        """
+        for cdms_pk in ['cdms-pk1', 'cdms-pk2', '', '']:
+            SimpleObj.objects.skip_cdms().create(cdms_pk=cdms_pk, name='name')
+
+        with connection.schema_editor() as schema_editor:
+            create_cdms_pk_index(schema_editor, SimpleObj)
+            delete_cdms_pk_index(schema_editor, SimpleObj)
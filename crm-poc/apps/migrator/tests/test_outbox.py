@@ -0,0 +1,382 @@
+import datetime
+
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from migrator.models import OutboxEntry
+from migrator.outbox import OutboxWorker, enqueue
+from migrator.tests.queries.models import SimpleObj
+from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
+
+from cdms_api.tests.utils import mocked_cdms_create, mocked_cdms_get, mocked_cdms_update
+
+
+@override_settings(CDMS_WRITE_BEHIND=True)
+class WriteBehindTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(WriteBehindTestCase, self).setUp()
+        self.modified_on = (timezone.now() + datetime.timedelta(days=1)).replace(microsecond=0)
+        self.mocked_cdms_api.create.side_effect = mocked_cdms_create(
+            create_data={
+                'SimpleId': 'cdms-pk',
+                'ModifiedOn': self.modified_on,
+                '__metadata': {'etag': 'W/"1"'}
+            }
+        )
+        self.mocked_cdms_api.update.side_effect = mocked_cdms_update(
+            update_data={
+                'ModifiedOn': self.modified_on,
+                '__metadata': {'etag': 'W/"2"'}
+            }
+        )
+
+    def assertEntries(self, entries):
+        self.assertEqual(
+            list(OutboxEntry.objects.values_list('verb', 'model_label', 'object_id')),
+            entries
+        )
+
+    def test_create(self):
+        """
+        obj.save() should only save the obj locally with an outbox entry,
+        the worker then creates the cdms obj and writes back its cdms_pk, modified and etag.
+        """
+        obj = SimpleObj.objects.create(name='name')
+        self.assertEqual(obj.cdms_pk, '')
+        self.assertNoAPICalled()
+        self.assertEntries([('create', 'queries.SimpleObj', obj.pk)])
+
+        self.assertEqual(OutboxWorker().drain(), 1)
+
+        self.assertAPICreateCalled(
+            SimpleObj, kwargs={
+                'data': {
+                    'Name': 'name',
+                    'DateTimeField': None,
+                    'IntField': None,
+                    'FKField': None
+                }
+            }
+        )
+        self.assertEntries([])
+
+        obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
+        self.assertEqual(obj.cdms_pk, 'cdms-pk')
+        self.assertEqual(obj.modified, self.modified_on)
+        self.assertEqual(obj.cdms_etag, 'W/"1"')
+
+    def test_update(self):
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+
+        obj.name = 'new name'
+        obj.save()
+        self.assertNoAPICalled()
+        self.assertEntries([('update', 'queries.SimpleObj', obj.pk)])
+
+        self.assertEqual(OutboxWorker().drain(), 1)
+
+        self.assertEqual(self.mocked_cdms_api.update.call_count, 1)
+        _, kwargs = self.mocked_cdms_api.update.call_args
+        self.assertEqual(kwargs['guid'], 'cdms-pk')
+        self.assertEqual(kwargs['data']['Name'], 'new name')
+
+        obj = SimpleObj.objects.skip_cdms().get(pk=obj.pk)
+        self.assertEqual(obj.modified, self.modified_on)
+        self.assertEqual(obj.cdms_etag, 'W/"2"')
+        self.assertEntries([])
+
+    def test_delete(self):
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        pk = obj.pk
+
+        obj.delete()
+        self.assertNoAPICalled()
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
+        self.assertEntries([('delete', 'queries.SimpleObj', pk)])
+
+        self.assertEqual(OutboxWorker().drain(), 1)
+        self.assertAPIDeleteCalled(SimpleObj, kwargs={'guid': 'cdms-pk'})
+        self.assertEntries([])
+
+    def test_create_then_delete(self):
+        """
+        If the obj gets deleted before its create entry is sent, nothing is sent to cdms.
+        """
+        obj = SimpleObj.objects.create(name='name')
+        pk = obj.pk
+        obj.delete()
+        self.assertEntries([
+            ('create', 'queries.SimpleObj', pk),
+            ('delete', 'queries.SimpleObj', pk)
+        ])
+
+        self.assertEqual(OutboxWorker().drain(), 2)
+        self.assertNoAPICalled()
+        self.assertEntries([])
+
+    def test_deleted_while_creating(self):
+        """
+        If the obj gets deleted while its cdms obj is being created, the delete entry gets
+        the cdms_pk written back by the create so that the cdms obj gets deleted as well.
+        """
+        obj = SimpleObj.objects.create(name='name')
+        create = self.mocked_cdms_api.create.side_effect
+
+        def create_and_delete(*args, **kwargs):
+            SimpleObj.objects.get(pk=obj.pk).delete()
+            return create(*args, **kwargs)
+        self.mocked_cdms_api.create.side_effect = create_and_delete
+
+        self.assertEqual(OutboxWorker().drain(), 2)
+        self.assertAPIDeleteCalled(SimpleObj, kwargs={'guid': 'cdms-pk'})
+        self.assertEntries([])
+
+    def test_deleted_after_creating(self):
+        """
+        If the cdms_pk got written back after the obj was loaded, the delete entry gets it.
+        """
+        obj = SimpleObj.objects.create(name='name')
+        self.assertEqual(OutboxWorker().drain(), 1)
+        self.assertEqual(obj.cdms_pk, '')
+
+        obj.delete()
+        self.assertEqual(list(OutboxEntry.objects.values_list('verb', 'cdms_pk')), [('delete', 'cdms-pk')])
+
+    def test_in_order_per_obj(self):
+        """
+        Changes to the same obj are sent in order, the delete after the update.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        obj.name = 'new name'
+        obj.save()
+        obj.delete()
+        self.assertEqual(
+            list(OutboxEntry.objects.values_list('verb', flat=True)), ['update', 'delete']
+        )
+
+        self.assertEqual(OutboxWorker().drain(), 2)
+
+        # the obj is gone by the time the update gets processed
+        self.assertAPINotCalled('update')
+        self.assertAPIDeleteCalled(SimpleObj, kwargs={'guid': 'cdms-pk'})
+
+    def test_next_entries(self):
+        """
+        Only the oldest entry of each obj is considered, if due, and at most CDMS_OUTBOX_BATCH_SIZE.
+        """
+        now = timezone.now()
+        entries = [
+            OutboxEntry.objects.create(
+                model_label='queries.SimpleObj', object_id=object_id, verb=OutboxEntry.UPDATE,
+                next_attempt_on=next_attempt_on
+            )
+            for object_id, next_attempt_on in [
+                (1, now), (2, now), (1, now), (3, now + datetime.timedelta(hours=1)), (4, now), (3, now)
+            ]
+        ]
+
+        with self.assertNumQueries(1):
+            self.assertEqual(OutboxWorker().get_next_entries(), [entries[0], entries[1], entries[4]])
+
+        with override_settings(CDMS_OUTBOX_BATCH_SIZE=2):
+            self.assertEqual(OutboxWorker().get_next_entries(), [entries[0], entries[1]])
+
+    @mock.patch('migrator.outbox.logger')
+    def test_retry(self, mocked_logger):
+        """
+        Failing entries are retried later and the following ones of the same obj wait.
+        """
+        self.mocked_cdms_api.create.side_effect = Exception('cdms down')
+
+        obj = SimpleObj.objects.create(name='name')
+        obj.name = 'new name'
+        obj.save()
+
+        self.assertEqual(OutboxWorker().drain(), 0)
+        self.assertAPINotCalled('update')
+        self.assertEqual(mocked_logger.exception.call_count, 1)
+
+        entry = OutboxEntry.objects.first()
+        self.assertEqual(entry.attempts, 1)
+        self.assertTrue('cdms down' in entry.last_error)
+        self.assertTrue(entry.next_attempt_on > timezone.now())
+
+        # not due yet
+        self.assertEqual(OutboxWorker().drain(), 0)
+        self.assertEqual(self.mocked_cdms_api.create.call_count, 1)
+
+        # cdms back up
+        self.mocked_cdms_api.create.side_effect = mocked_cdms_create(
+            create_data={'SimpleId': 'cdms-pk', 'ModifiedOn': self.modified_on}
+        )
+        OutboxEntry.objects.update(next_attempt_on=timezone.now())
+
+        self.assertEqual(OutboxWorker().drain(), 1)
+        self.assertEntries([])
+
+    def test_pending_changes_not_overridden_on_read(self):
+        """
+        Reading an obj with local changes not sent to cdms yet returns the local version.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        self.mocked_cdms_api.get.side_effect = mocked_cdms_get(
+            get_data={
+                'Name': 'cdms name',
+                'ModifiedOn': obj.modified - datetime.timedelta(days=1)
+            }
+        )
+
+        obj.name = 'new name'
+        obj.save()
+
+        obj = SimpleObj.objects.get(pk=obj.pk)
+        self.assertEqual(obj.name, 'new name')
+
+    def test_command(self):
+        SimpleObj.objects.create(name='name')
+
+        out = StringIO()
+        call_command('cdms_outbox', stdout=out)
+
+        self.assertEqual(out.getvalue(), '1 changes sent to cdms (0 writes saved by coalescing)\n')
+        self.assertEntries([])
+
+
+@override_settings(CDMS_WRITE_BEHIND=True)
+class CoalescingTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(CoalescingTestCase, self).setUp()
+        self.mocked_cdms_api.create.side_effect = mocked_cdms_create(
+            create_data={'SimpleId': 'cdms-pk'}
+        )
+        self.mocked_cdms_api.update.side_effect = mocked_cdms_update()
+
+    def test_updates_merged(self):
+        """
+        Repeated updates of the same obj are sent once with the latest values.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        for index in range(3):
+            obj.name = 'name{0}'.format(index)
+            obj.save()
+
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.coalesced, 2)
+
+        worker = OutboxWorker()
+        self.assertEqual(worker.drain(), 1)
+        self.assertEqual(worker.coalesced, 2)
+
+        self.assertEqual(self.mocked_cdms_api.update.call_count, 1)
+        _, kwargs = self.mocked_cdms_api.update.call_args
+        self.assertEqual(kwargs['data']['Name'], 'name2')
+
+    def test_updates_merged_into_create(self):
+        obj = SimpleObj.objects.create(name='name')
+        obj.name = 'new name'
+        obj.save()
+
+        self.assertEqual(OutboxWorker().drain(), 1)
+
+        self.assertAPINotCalled('update')
+        _, kwargs = self.mocked_cdms_api.create.call_args
+        self.assertEqual(kwargs['data']['Name'], 'new name')
+
+    def test_updates_within_one_transaction(self):
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        with transaction.atomic():
+            obj.name = 'name1'
+            obj.save()
+            obj.int_field = 1
+            obj.save()
+
+        self.assertEqual(OutboxEntry.objects.get().coalesced, 1)
+
+    def test_update_merged_while_sending(self):
+        """
+        If the obj changes while its entry is being sent, the entry is sent again.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        obj.name = 'name1'
+        obj.save()
+
+        mocked_update = mocked_cdms_update()
+
+        def update(*args, **kwargs):
+            if self.mocked_cdms_api.update.call_count == 1:
+                obj.name = 'name2'
+                obj.save()
+            return mocked_update(*args, **kwargs)
+        self.mocked_cdms_api.update.side_effect = update
+
+        self.assertEqual(OutboxWorker().drain(), 2)
+        self.assertEqual(self.mocked_cdms_api.update.call_count, 2)
+
+        _, kwargs = self.mocked_cdms_api.update.call_args
+        self.assertEqual(kwargs['data']['Name'], 'name2')
+        self.assertEqual(OutboxEntry.objects.count(), 0)
+
+    def test_entry_sent_before_merging(self):
+        """
+        If the entry to merge into gets sent and deleted in the meantime, a new one is created.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        obj.name = 'name1'
+        obj.save()
+
+        entry = OutboxEntry.objects.get()
+        entry.delete()
+        with mock.patch('django.db.models.query.QuerySet.last', return_value=entry):
+            new_entry = enqueue(SimpleObj, OutboxEntry.UPDATE, obj.pk, cdms_pk='cdms-pk')
+
+        self.assertNotEqual(new_entry.pk, entry.pk)
+        self.assertEqual(
+            list(OutboxEntry.objects.values_list('verb', 'object_id')), [(OutboxEntry.UPDATE, obj.pk)]
+        )
+
+    @mock.patch('migrator.outbox.logger')
+    def test_update_merged_while_failing(self, mocked_logger):
+        """
+        If the obj changes while its entry is being sent and that fails, the merged
+        change is not lost.
+        """
+        obj = SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        obj.name = 'name1'
+        obj.save()
+
+        def update(*args, **kwargs):
+            obj.name = 'name2'
+            obj.save()
+            raise Exception('cdms down')
+        self.mocked_cdms_api.update.side_effect = update
+
+        self.assertEqual(OutboxWorker().drain(), 0)
+
+        entry = OutboxEntry.objects.get()
+        self.assertEqual((entry.attempts, entry.coalesced), (1, 1))
+
+    @override_settings(CDMS_OUTBOX_COALESCE_WINDOW=60)
+    def test_window(self):
+        """
+        New entries are only sent after the coalesce window.
+        """
+        SimpleObj.objects.create(name='name')
+
+        self.assertEqual(OutboxWorker().drain(), 0)
+        self.assertNoAPICalled()
+
+        OutboxEntry.objects.update(next_attempt_on=timezone.now())
+        self.assertEqual(OutboxWorker().drain(), 1)
+
+
+class WithoutWriteBehindTestCase(BaseMockedCDMSApiTestCase):
+    def test_no_outbox_entries(self):
+        SimpleObj.objects.create(name='name')
+
+        self.assertEqual(self.mocked_cdms_api.create.call_count, 1)
+        self.assertEqual(OutboxEntry.objects.count(), 0)
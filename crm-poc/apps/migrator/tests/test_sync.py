@@ -0,0 +1,375 @@
+import re
+import datetime
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+from django.utils.six import StringIO
+
+from migrator.models import SyncState, OutboxEntry
+from migrator.sync import ModelSync, ModelBackfill, ModelReconcile
+from migrator.tests.queries.models import SimpleObj
+from migrator.tests.queries.base import BaseMockedCDMSApiTestCase
+
+from cdms_api.exceptions import CDMSNotFoundException
+from cdms_api.tests.utils import populate_data, mocked_cdms_list
+from cdms_api.utils import cdms_datetime_to_datetime
+
+
+def mocked_cdms_sorted_list(list_data):
+    """
+    Mocks cdms list so that it behaves like cdms with `list_data` ordered by ModifiedOn and id,
+    honouring the ModifiedOn ge ... and the (ModifiedOn, id) > (..., ...) filters and $top.
+    `list_data` can be changed between calls.
+    """
+    def parse_datetime(value):
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+    def internal(service, top=50, skip=0, select=None, filters=None, order_by=None):
+        results = sorted(
+            (populate_data('Simple', item) for item in list_data),
+            key=lambda item: (cdms_datetime_to_datetime(item['ModifiedOn']), item['SimpleId'])
+        )
+        filters = filters or ''
+        match = re.search(r"ModifiedOn ge datetime'(.+?)'", filters)
+        if match:
+            high_water_mark = parse_datetime(match.group(1))
+            results = [
+                item for item in results
+                if cdms_datetime_to_datetime(item['ModifiedOn']) >= high_water_mark
+            ]
+        match = re.search(r"SimpleId gt guid'(.+?)'", filters)
+        if match:
+            high_water_mark = parse_datetime(re.search(r"ModifiedOn gt datetime'(.+?)'", filters).group(1))
+            results = [
+                item for item in results
+                if (cdms_datetime_to_datetime(item['ModifiedOn']), item['SimpleId']) > (high_water_mark, match.group(1))
+            ]
+        return results[skip:skip + top]
+    return internal
+
+
+class ModelSyncTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(ModelSyncTestCase, self).setUp()
+        self.now = timezone.now().replace(microsecond=0)
+
+    def get_cdms_data(self, index, modified_on):
+        return {
+            'SimpleId': 'cdms-pk{0}'.format(index),
+            'Name': 'name{0}'.format(index),
+            'CreatedOn': modified_on,
+            'ModifiedOn': modified_on,
+            'DateTimeField': None,
+            'IntField': None,
+            'FKField': None
+        }
+
+    def test_from_scratch(self):
+        """
+        All the cdms objs get synced one page at a time, ordered by ModifiedOn
+        and the progress is saved.
+        """
+        list_data = [
+            self.get_cdms_data(index, self.now - datetime.timedelta(days=10 - index))
+            for index in range(5)
+        ]
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list(list_data)
+
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 5)
+
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', flat=True)),
+            ['cdms-pk{0}'.format(index) for index in range(5)]
+        )
+
+        _, kwargs = self.mocked_cdms_api.list.call_args_list[0]
+        self.assertEqual(kwargs['filters'], '')
+        self.assertEqual(kwargs['order_by'], ['ModifiedOn asc', 'SimpleId asc'])
+        self.assertEqual((kwargs['skip'], kwargs['top']), (0, 2))
+
+        _, kwargs = self.mocked_cdms_api.list.call_args_list[1]
+        self.assertEqual(
+            kwargs['filters'],
+            "((ModifiedOn eq datetime'{0}' and SimpleId gt guid'cdms-pk1') or ModifiedOn gt datetime'{0}')".format(
+                list_data[1]['ModifiedOn'].strftime('%Y-%m-%dT%H:%M:%S')
+            )
+        )
+        self.assertEqual((kwargs['skip'], kwargs['top']), (0, 2))
+
+        state = SyncState.objects.get(model_label='queries.SimpleObj')
+        self.assertEqual(state.high_water_mark, list_data[-1]['ModifiedOn'])
+        self.assertEqual(state.last_cdms_pk, 'cdms-pk4')
+
+    def test_resume(self):
+        """
+        A new run only gets the objs modified since the high-water mark.
+        """
+        list_data = [
+            self.get_cdms_data(index, self.now - datetime.timedelta(days=10 - index))
+            for index in range(5)
+        ]
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list(list_data)
+        SyncState.objects.create(
+            model_label='queries.SimpleObj',
+            high_water_mark=list_data[2]['ModifiedOn'], last_cdms_pk='cdms-pk2'
+        )
+
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 2)
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', flat=True)),
+            ['cdms-pk3', 'cdms-pk4']
+        )
+
+    def test_resume_after_backfill(self):
+        """
+        Without last id (e.g. after a backfill) all the objs modified since the high-water mark are pulled.
+        """
+        list_data = [
+            self.get_cdms_data(index, self.now - datetime.timedelta(days=10 - index))
+            for index in range(5)
+        ]
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list(list_data)
+        SyncState.objects.create(model_label='queries.SimpleObj', high_water_mark=list_data[2]['ModifiedOn'])
+
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 3)
+
+    def test_same_modified_on_across_pages(self):
+        """
+        Objs modified within the same second are paged by id instead of getting
+        the same page over and over again.
+        """
+        list_data = [self.get_cdms_data(index, self.now) for index in range(5)]
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list(list_data)
+
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 5)
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 5)
+        self.assertEqual(self.mocked_cdms_api.list.call_count, 3)
+
+        state = SyncState.objects.get(model_label='queries.SimpleObj')
+        self.assertEqual((state.high_water_mark, state.last_cdms_pk), (self.now, 'cdms-pk4'))
+
+    def test_modified_within_high_water_mark_second_between_runs(self):
+        """
+        If an obj of the high-water mark second gets modified again before the next run,
+        the objs following it in that second are not skipped.
+        """
+        list_data = [self.get_cdms_data(index, self.now) for index in range(2)]
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list(list_data)
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 2)
+
+        list_data[0]['ModifiedOn'] = self.now + datetime.timedelta(seconds=5)
+        list_data.append(self.get_cdms_data(2, self.now))
+
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 2)
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', flat=True)),
+            ['cdms-pk0', 'cdms-pk1', 'cdms-pk2']
+        )
+        self.assertEqual(
+            SimpleObj.objects.skip_cdms().get(cdms_pk='cdms-pk0').modified,
+            self.now + datetime.timedelta(seconds=5)
+        )
+
+    def test_nothing_new(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list([])
+
+        self.assertEqual(ModelSync(SimpleObj, page_size=2).run(), 0)
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
+
+
+def mocked_cdms_created_on_list(list_data):
+    """
+    Mocks cdms list so that it behaves like cdms with `list_data`, honouring
+    the CreatedOn ge/lt filters, the ordering by CreatedOn or id, $skip and $top.
+    """
+    list_data = [populate_data('Simple', item) for item in list_data]
+
+    def parse_datetime(value):
+        return datetime.datetime.strptime(value, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+
+    def internal(service, top=50, skip=0, select=None, filters=None, order_by=None):
+        results = list_data
+        for expr, value in re.findall(r"CreatedOn (ge|lt) datetime'([^']+)'", filters or ''):
+            value = parse_datetime(value)
+            results = [
+                item for item in results
+                if (cdms_datetime_to_datetime(item['CreatedOn']) >= value) == (expr == 'ge')
+            ]
+
+        field, order = order_by[0].split()
+        key = cdms_datetime_to_datetime if field == 'CreatedOn' else str
+        results = sorted(results, key=lambda item: key(item[field]), reverse=(order == 'desc'))
+        return results[skip:skip + top]
+    return internal
+
+
+class ModelBackfillTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(ModelBackfillTestCase, self).setUp()
+        now = timezone.now().replace(microsecond=0)
+        self.list_data = [
+            {
+                'SimpleId': 'cdms-pk{0:02}'.format(index),
+                'Name': 'name{0}'.format(index),
+                'CreatedOn': now - datetime.timedelta(days=index // 2),
+                'ModifiedOn': now,
+                'DateTimeField': None,
+                'IntField': index,
+                'FKField': None
+            }
+            for index in range(25)
+        ]
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_created_on_list(self.list_data)
+
+    def test_partitions(self):
+        """
+        The CreatedOn range gets split into contiguous ranges covering all the cdms objs.
+        """
+        partitions = ModelBackfill(SimpleObj, workers=2, partitions=5).get_partitions()
+
+        self.assertEqual(len(partitions), 5)
+        self.assertEqual(partitions[0][0], self.list_data[-1]['CreatedOn'])
+        self.assertEqual(partitions[-1][1], self.list_data[0]['CreatedOn'] + datetime.timedelta(seconds=1))
+        for (_, end), (start, _) in zip(partitions, partitions[1:]):
+            self.assertEqual(end, start)
+
+    def test_run(self):
+        """
+        All the cdms objs get pulled concurrently and mapped as the online refresh does.
+        """
+        tot, seconds = ModelBackfill(SimpleObj, workers=3, partitions=4, page_size=2).run()
+        self.assertEqual(tot, 25)
+
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', 'name', 'int_field')),
+            [(item['SimpleId'], item['Name'], item['IntField']) for item in self.list_data]
+        )
+
+        # the following cdms_sync runs only pull the later changes
+        state = SyncState.objects.get(model_label='queries.SimpleObj')
+        self.assertTrue(state.high_water_mark < timezone.now())
+        self.assertEqual(state.last_cdms_pk, '')
+
+    def test_nothing_to_backfill(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_created_on_list([])
+
+        tot, _ = ModelBackfill(SimpleObj, workers=2).run()
+        self.assertEqual(tot, 0)
+
+
+class ModelReconcileTestCase(BaseMockedCDMSApiTestCase):
+    def setUp(self):
+        super(ModelReconcileTestCase, self).setUp()
+        self.objs = [
+            SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk{0}'.format(index), name='name')
+            for index in range(5)
+        ]
+        # local only
+        SimpleObj.objects.skip_cdms().create(name='name')
+
+        self.mocked_cdms_api.iter_list.side_effect = mocked_cdms_list([
+            {'SimpleId': 'cdms-pk0'}, {'SimpleId': 'cdms-pk2'}, {'SimpleId': 'cdms-pk4'}
+        ])
+
+        # cdms-pk3 not streamed but still in cdms (e.g. pages shifted while streaming)
+        def get(service, guid, select=None):
+            if guid == 'cdms-pk1':
+                raise CDMSNotFoundException('not found')
+            return populate_data(service, guid=guid)
+        self.mocked_cdms_api.get.side_effect = get
+
+    def test_run(self):
+        """
+        Only the ids get streamed and the confirmed orphans get deleted locally.
+        """
+        orphans = ModelReconcile(SimpleObj).run()
+        self.assertEqual(orphans, [(self.objs[1].pk, 'cdms-pk1')])
+
+        self.assertEqual(
+            sorted(SimpleObj.objects.skip_cdms().values_list('cdms_pk', flat=True)),
+            ['', 'cdms-pk0', 'cdms-pk2', 'cdms-pk3', 'cdms-pk4']
+        )
+
+        _, kwargs = self.mocked_cdms_api.iter_list.call_args
+        self.assertEqual(kwargs['select'], ['SimpleId'])
+        self.assertEqual(kwargs['order_by'], ['SimpleId asc'])
+        self.assertEqual(
+            sorted(kwargs['guid'] for _, kwargs in self.mocked_cdms_api.get.call_args_list),
+            ['cdms-pk1', 'cdms-pk3']
+        )
+
+    def test_dry_run(self):
+        orphans = ModelReconcile(SimpleObj).run(dry_run=True)
+        self.assertEqual(orphans, [(self.objs[1].pk, 'cdms-pk1')])
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 6)
+
+    @override_settings(CDMS_WRITE_BEHIND=True)
+    def test_pending_changes_kept(self):
+        OutboxEntry.objects.create(
+            model_label='queries.SimpleObj', object_id=self.objs[1].pk,
+            verb=OutboxEntry.UPDATE, next_attempt_on=timezone.now()
+        )
+
+        self.assertEqual(ModelReconcile(SimpleObj).run(), [])
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 6)
+
+
+class CDMSSyncCommandTestCase(BaseMockedCDMSApiTestCase):
+    def test(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list([
+            {
+                'SimpleId': 'cdms-pk',
+                'Name': 'name',
+                'DateTimeField': None,
+                'IntField': None,
+                'FKField': None
+            }
+        ])
+        out = StringIO()
+        call_command('cdms_sync', 'queries.SimpleObj', stdout=out)
+
+        self.assertEqual(out.getvalue(), 'queries.SimpleObj: 1 objs synced\n')
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 1)
+
+    def test_reset(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_sorted_list([])
+        SyncState.objects.create(model_label='queries.SimpleObj', high_water_mark=timezone.now())
+
+        call_command('cdms_sync', 'queries.SimpleObj', reset=True, stdout=StringIO())
+
+        _, kwargs = self.mocked_cdms_api.list.call_args
+        self.assertEqual(kwargs['filters'], '')
+
+    def test_backfill(self):
+        self.mocked_cdms_api.list.side_effect = mocked_cdms_created_on_list([
+            {
+                'SimpleId': 'cdms-pk',
+                'Name': 'name',
+                'DateTimeField': None,
+                'IntField': None,
+                'FKField': None
+            }
+        ])
+        out = StringIO()
+        call_command('cdms_sync', 'queries.SimpleObj', backfill=True, workers=2, stdout=out)
+
+        self.assertTrue(out.getvalue().startswith('queries.SimpleObj: 1 objs backfilled in '))
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 1)
+
+    def test_reconcile(self):
+        SimpleObj.objects.skip_cdms().create(cdms_pk='cdms-pk', name='name')
+        self.mocked_cdms_api.get.side_effect = CDMSNotFoundException('not found')
+
+        out = StringIO()
+        call_command('cdms_sync', 'queries.SimpleObj', reconcile=True, stdout=out)
+
+        self.assertEqual(out.getvalue(), 'queries.SimpleObj: 1 objs deleted in cdms removed\n')
+        self.assertEqual(SimpleObj.objects.skip_cdms().count(), 0)
+
+    def test_invalid_model(self):
+        self.assertRaises(
+            CommandError,
+            call_command, 'cdms_sync', 'migrator.SyncState', stdout=StringIO()
+        )
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from migrator.operations import AddCDMSPkUniqueIndex
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0008_auto_20160218_1405'),
+    ]
+
+    operations = [
+        AddCDMSPkUniqueIndex('organisation'),
+        AddCDMSPkUniqueIndex('contact'),
+    ]
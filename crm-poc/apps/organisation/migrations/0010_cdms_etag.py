@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organisation', '0009_cdms_pk_unique_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='cdms_etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='organisation',
+            name='cdms_etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -31,6 +31,7 @@ INSTALLED_APPS = (
 )
 
 PROJECT_APPS = (
+    'migrator',
     'organisation',
 )
 
@@ -121,6 +122,54 @@ CDMS_BASE_URL = ''
 CDMS_USERNAME = ''
 CDMS_PASSWORD = ''
 
+# max number of http sessions used concurrently by the cdms client and whether to keep connections alive
+CDMS_SESSION_POOL_SIZE = 10
+CDMS_SESSION_KEEP_ALIVE = True
+
+# max number of concurrent connections used by cdms_api.aio.AsyncCDMSApi
+CDMS_ASYNC_POOL_SIZE = 100
+
+# if True, updates only send the mapped fields (MERGE) in one single round trip
+# instead of GET + PUT + GET
+CDMS_PARTIAL_UPDATES = False
+
+# if True, updates of objs with a known cdms etag are sent as MERGE with If-Match: etag without getting
+# the cdms obj first, cdms_api.exceptions.CDMSConflictException is raised if the cdms obj changed in the meantime
+CDMS_CONDITIONAL_UPDATES = False
+
+# number of list pages requested concurrently while the current one is consumed, 0 to disable
+CDMS_LIST_PREFETCH = 0
+
+# if True, local objs are refreshed with one single INSERT ... ON CONFLICT statement per page.
+# Requires postgres >= 9.5 and the unique index on cdms_pk (see migrator.operations.AddCDMSPkUniqueIndex)
+CDMS_REFRESH_UPSERT = False
+
+# if True, querysets first request only the id and ModifiedOn of the cdms objs and then
+# the full data of the ones new or changed since the local copy
+CDMS_LIST_PROBE = False
+
+# max number of cdms objs whose local changes are kept in memory while refreshing a queryset,
+# the changes get written every time the limit is reached instead of all at the end
+CDMS_REFRESH_BUFFER_SIZE = 1000
+
+# number of cdms objs requested per page by the cdms_sync management command
+CDMS_SYNC_PAGE_SIZE = 50
+
+# if True, model changes are saved locally with an outbox entry and sent to cdms later
+# by the cdms_outbox management command, retrying failed ones with exponential backoff (max seconds)
+CDMS_WRITE_BEHIND = False
+CDMS_OUTBOX_MAX_BACKOFF = 60 * 60
+
+# seconds new outbox entries wait before getting sent so that following updates of the same obj
+# can be merged into them and sent once
+CDMS_OUTBOX_COALESCE_WINDOW = 0
+
+# max number of outbox entries sent per cdms_outbox iteration
+CDMS_OUTBOX_BATCH_SIZE = 100
+
+# number of threads pulling cdms objs concurrently with cdms_sync --backfill
+CDMS_BACKFILL_WORKERS = 4
+
 
 # .local.py overrides all the common settings.
 try: